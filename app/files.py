@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from os import getenv
+from typing import Callable, List, Optional, Tuple
+
+import aiofiles
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+from loguru import logger
+from starlette.types import Receive, Scope, Send
+
+from lib.db_operations import db_ops
+from lib.media_cache import media_cache
+from lib.storage import storage
+from util.cache import TTLCache
+
+RESULT_CACHE_MAX_AGE = int(getenv("RESULT_CACHE_MAX_AGE") or 31536000)
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# (path, mtime_ns, size) -> ETag，结果图写入后不再修改，按文件元信息缓存内容哈希
+_etag_cache: TTLCache[Tuple[str, int, int], str] = TTLCache(maxsize=100000)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+async def file_etag(path: str, stat_result: os.stat_result) -> str:
+    """基于内容哈希的强 ETag"""
+    key = (path, stat_result.st_mtime_ns, stat_result.st_size)
+    etag = _etag_cache.get(key)
+    if etag is None:
+        loop = asyncio.get_running_loop()
+        etag = await loop.run_in_executor(None, _hash_file, path)
+        _etag_cache.set(key, etag)
+    return etag
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range，返回 [start, end]
+
+    多段、无法解析或 last < first 时返回 None，按规范忽略 Range 返回完整内容；
+    起始位置超出文件大小时 start >= size，由调用方返回 416
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    return any(tag.strip() in (etag, "*") for tag in header.split(","))
+
+
+class ResultFileResponse(Response):
+    """
+    结果图文件响应
+
+    - 强 ETag + If-None-Match 返回 304
+    - Cache-Control: immutable
+    - 单段 Range / If-Range 返回 206
+    - 服务器支持 http.response.zerocopysend 扩展时使用 sendfile 零拷贝发送
+    - on_close 在响应发送结束（包括客户端中途断开）后调用
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        etag: str,
+        request: Request,
+        media_type: Optional[str] = None,
+        on_close: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.path = path
+        self.on_close = on_close
+        self.media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.background = None
+        self.send_body = request.method != "HEAD"
+        self.offset = 0
+        self.count = stat_result.st_size
+
+        size = stat_result.st_size
+        headers: List[Tuple[str, str]] = [
+            ("etag", etag),
+            ("cache-control", f"public, max-age={RESULT_CACHE_MAX_AGE}, immutable"),
+            ("last-modified", formatdate(stat_result.st_mtime, usegmt=True)),
+            ("accept-ranges", "bytes"),
+        ]
+
+        if_none_match = request.headers.get("if-none-match")
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+
+        byte_range = None
+        if range_header and (not if_range or if_range.strip() == etag):
+            byte_range = _parse_range(range_header, size)
+
+        if if_none_match and _etag_matches(if_none_match, etag):
+            self.status_code = 304
+            self.send_body = False
+        elif byte_range is not None and byte_range[0] >= size:
+            self.status_code = 416
+            self.send_body = False
+            headers.append(("content-range", f"bytes */{size}"))
+            headers.append(("content-length", "0"))
+        elif byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset = start
+            self.count = end - start + 1
+            headers.append(("content-range", f"bytes {start}-{end}/{size}"))
+            headers.append(("content-length", str(self.count)))
+            headers.append(("content-type", self.media_type))
+        else:
+            self.status_code = 200
+            headers.append(("content-length", str(size)))
+            headers.append(("content-type", self.media_type))
+
+        self.raw_headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self._send(scope, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+    async def _send(self, scope: Scope, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def file_response(path: str, request: Request, on_close: Optional[Callable[[], None]] = None) -> Response:
+    """本地文件响应，文件不存在返回 404；on_close 在响应发送结束或未能返回文件时调用"""
+    try:
+        try:
+            stat_result = await asyncio.get_running_loop().run_in_executor(None, os.stat, path)
+        except (FileNotFoundError, NotADirectoryError):
+            stat_result = None
+        if stat_result is None or not os.path.isfile(path):
+            if on_close is not None:
+                on_close()
+            return Response(status_code=404)
+        etag = await file_etag(path, stat_result)
+    except BaseException:
+        if on_close is not None:
+            on_close()
+        raise
+    return ResultFileResponse(path, stat_result, etag, request, on_close=on_close)
+
+
+router = APIRouter()
+
+
+@router.api_route("/downloads/{key:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def download_result(key: str, request: Request):
+    """本地存储的结果图"""
+    path = storage.local_path(key)
+    if path is None:
+        return Response(status_code=404)
+    return await file_response(path, request)
+
+
+@router.api_route("/media/{task_id}", methods=["GET", "HEAD"], include_in_schema=False)
+async def media_proxy(task_id: str, request: Request):
+    """任务的 Discord 附件，首次访问时拉取并缓存到本地"""
+    task = await db_ops.get_task_by_task_id(task_id)
+    if not task:
+        return Response(status_code=404)
+
+    try:
+        path = await media_cache.acquire(task)
+    except Exception as e:
+        logger.error(f"❌ 附件代理拉取失败: {task_id} - {e}")
+        return Response(status_code=502)
+    if path is None:
+        return Response(status_code=404)
+    # 发送结束后才释放引用，避免发送过程中文件被淘汰删除
+    return await file_response(path, request, on_close=lambda: media_cache.release(path))
@@ -0,0 +1,70 @@
+import zlib
+from os import getenv
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from exceptions import ErrorCode
+
+# 解压后请求体的最大字节数，防止压缩炸弹
+GZIP_REQUEST_MAX_BYTES = int(getenv("GZIP_REQUEST_MAX_MB") or 32) * 1024 * 1024
+
+
+class GzipRequestMiddleware:
+    """解压 Content-Encoding: gzip 的请求体，供 bot 批量投递结果事件使用"""
+
+    def __init__(self, app: ASGIApp, max_bytes: int = GZIP_REQUEST_MAX_BYTES) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not any(
+            name == b"content-encoding" and value.strip().lower() == b"gzip"
+            for name, value in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = bytearray()
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body += decompressor.decompress(message.get("body", b""), self.max_bytes + 1 - len(body))
+                if len(body) > self.max_bytes or decompressor.unconsumed_tail:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"code": ErrorCode.REQUEST_PARAMS_ERROR.value, "message": "request body too large"},
+                    )
+                    await response(scope, receive, send)
+                    return
+                if not message.get("more_body", False):
+                    break
+            body += decompressor.flush()
+        except zlib.error:
+            response = JSONResponse(
+                status_code=400,
+                content={"code": ErrorCode.REQUEST_PARAMS_ERROR.value, "message": "invalid gzip body"},
+            )
+            await response(scope, receive, send)
+            return
+
+        headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        scope = dict(scope, headers=headers)
+
+        sent = False
+
+        async def receive_body() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": bytes(body), "more_body": False}
+
+        await self.app(scope, receive_body, send)
@@ -1,22 +1,30 @@
-from fastapi import APIRouter, UploadFile, Depends
+from fastapi import APIRouter, UploadFile, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials
 from loguru import logger
 import uuid
 from datetime import datetime
-import os
-from urllib.parse import urlparse
-import requests
 import time
-from typing import List
+from typing import Optional
 
 from lib.api import discord
 from lib.api.discord import TriggerType
-from lib.db_operations import db_ops
+from lib.db_operations import db_ops, hash_ops, MAX_SIMILAR_DISTANCE
 from lib.auth import get_current_user, check_user_token_limit, consume_user_token_by_app_key
+from lib.postprocess import postprocess, SPLIT_TASK_TYPES
+from lib.media_cache import media_cache, MEDIA_PUBLIC_BASE_URL
+from lib.progress import progress_tracker
+from lib.export import stream_zip, EXPORT_MAX_TASKS
+from lib.upload import uploader, upload_dedup
+from lib.rehost import rehoster, split_prompt_picurl, REHOST_PICURL
+from lib.webhook import webhook
 from util._queue import taskqueue
-from .handler import prompt_handler, unique_id
-from PIL import Image
+from util.cache import TTLCache
+from .handler import check_banned, prompt_handler, unique_id
+from exceptions import RequestParamsError
+from util.net import UnsafeAddressError, check_public_url
 from .schema import (
+    CallbackIn,
     TriggerExpandIn,
     TriggerImagineIn,
     TriggerUVIn,
@@ -29,6 +37,8 @@ from .schema import (
     SendMessageResponse,
     SendMessageIn,
     MidjourneyResultIn,
+    MidjourneyResultBatchIn,
+    MidjourneyResultBatchResponse,
     SimpleResponse,
 )
 
@@ -36,73 +46,23 @@ from .schema import (
 
 
 
-def _download_and_split_file( file_url: str,  download_dir: str) -> List[str]:
-        """下载文件到本地"""
-        try:
-            # 解析文件URL获取文件扩展名
-            file_name = f"{int(time.time()*1000)}.png"
-
-            # 帧图片保存到场景目录
-            local_path = os.path.join(download_dir, file_name)
-            
-            # 下载文件
-            logger.info(f"⬇️ 开始下载: {file_url}")
-            result_local_path = []
-            response = requests.get(file_url, stream=True, timeout=30)
-            if response.status_code == 200:
-                # 如果文件已存在，跳过下载
-                if os.path.exists(local_path):
-                    ## 如果文件存在，重命名
-                    os.rename(local_path, local_path.replace(".png", f"_{int(time.time())}.png"))   
-                    
-                with open(local_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-
-                ##图片是 discord 的，是由4张图组成的，需要下载4张图, 对图片进行裁剪，然后保存到本地
-                ##图片是 discord 的，是由4张图组成的，需要下载4张图, 对图片进行裁剪，然后保存到本地
-                img = Image.open(local_path)
-                width, height = img.size
-                # 计算单张图片的尺寸
-                single_width = width // 2
-                single_height = height // 2
-                
-                print(f"单张图片尺寸: {single_width} x {single_height}")
-                
-                # 获取原图文件名（不含扩展名）
-                base_name = os.path.splitext(os.path.basename(local_path))[0]
-                ext = os.path.splitext(local_path)[1]
-
-                # 定义四个区域的坐标 (left, top, right, bottom)
-                regions = [
-                    (0, 0, single_width, single_height),                    # 左上
-                    (single_width, 0, width, single_height),                # 右上
-                    (0, single_height, single_width, height),               # 左下
-                    (single_width, single_height, width, height)            # 右下
-                ]
-                position_labels = ['1', '2', '3', '4']
-                for i, (region, label) in enumerate(zip(regions, position_labels)):
-                    # 裁剪图片
-                    cropped_img = img.crop(region)
-                    
-                    # 生成输出文件名
-                    output_filename = f"{base_name}_{label}{ext}"
-                    output_path = os.path.join(download_dir, output_filename)
-                    
-                    # 保存图片
-                    cropped_img.save(output_path)
-                    result_local_path.append("http://v2v.jifeng.online:8086/downloads/" + output_filename)
-                img.close()
-            else:
-                logger.error(f"❌ 下载失败: HTTP {response.status_code}")
+router = APIRouter()
 
-            return result_local_path
-        except Exception as e:
-            logger.error(f"❌ 下载文件失败: {file_url} - {e}")
-            return None
+# bot 回调至少投递一次，同一结果消息的同一状态只处理一次
+RESULT_EVENTS: TTLCache[str, bool] = TTLCache(maxsize=10000, ttl=6 * 3600)
+# 队列释放同样至少投递一次；U / V 任务与父任务共用 trigger_id，重复的释放会误释放其他任务的并发位置
+RELEASE_EVENTS: TTLCache[str, bool] = TTLCache(maxsize=10000, ttl=6 * 3600)
 
-router = APIRouter()
+
+async def task_callback_url(body: CallbackIn, current_user: dict) -> str:
+    """任务的回调地址：请求中的 callback_url 需解析为公网地址，否则使用用户默认地址"""
+    if not body.callback_url:
+        return current_user.get('callback_url') or ""
+    try:
+        await check_public_url(body.callback_url)
+    except UnsafeAddressError as e:
+        raise RequestParamsError(f"callback_url not allowed: {e}")
+    return body.callback_url
 
 
 @router.post("/imagine", response_model=TriggerResponse)
@@ -111,10 +71,18 @@ async def imagine(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     # 记录API请求日志
     logger.info(f"🎨 /imagine请求 - 用户: {current_user.get('user_name')}, Prompt长度: {len(body.prompt)}, PicURL: {'有' if body.picurl else '无'}")
     
-    trigger_id, prompt = prompt_handler(body.prompt, body.picurl)
+    prompt, picurl = split_prompt_picurl(body.prompt, body.picurl)
+    # 先检查敏感词，被禁的提示词不拉取、不转存参考图
+    check_banned(prompt)
+    if picurl and REHOST_PICURL:
+        # 提交前转存外部参考图，拉取失败或不是图片时直接拒绝，不占用队列
+        picurl = await rehoster.rehost_picurl(picurl)
+
+    trigger_id, prompt = prompt_handler(prompt, picurl)
     trigger_type = TriggerType.generate.value
 
     
@@ -129,7 +97,10 @@ async def imagine(
             ref_pic_url=body.picurl,
             image_index=0,
             task_status="SUBMITTED",
-            prompts=body.prompt
+            prompts=body.prompt,
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -150,6 +121,7 @@ async def upscale(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     
     trigger_type = TriggerType.upscale.value
 
@@ -172,7 +144,10 @@ async def upscale(
             image_index=body.index,
             msg_id=body.msg_id,
             msg_hash=body.msg_hash,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -192,6 +167,7 @@ async def variation(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_type = TriggerType.variation.value
 
     # 创建数据库任务记录
@@ -214,7 +190,10 @@ async def variation(
             image_index=body.index,
             msg_id=body.msg_id,
             msg_hash=body.msg_hash,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -233,6 +212,7 @@ async def reset(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.reset.value
 
@@ -246,7 +226,10 @@ async def reset(
             task_type=trigger_type,
             ref_pic_url='',
             image_index=0,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -265,6 +248,7 @@ async def describe(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.describe.value
 
@@ -278,7 +262,10 @@ async def describe(
             task_type=trigger_type,
             ref_pic_url=body.upload_filename,
             image_index=0,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -294,15 +281,23 @@ async def describe(
 @router.post("/upload", response_model=UploadResponse)
 async def upload_attachment(
     file: UploadFile,
+    dedup: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    上传图片，返回 upload_filename / upload_url 供 /describe、/message 使用
+
+    dedup=true 时相同内容已发送过则只返回 picurl（不返回 upload_filename），无需再调用 /message。
+    """
     if not file.content_type.startswith("image/"):
         return {"message": "must image"}
 
     trigger_id = str(unique_id())
     filename = f"{trigger_id}.jpg"
-    file_size = file.size
-    attachment = await discord.upload_attachment(filename, file_size, await file.read())
+    # 从临时文件流式上传，不把整张图读入内存
+    attachment = await uploader.upload(filename, file, dedup)
+    if attachment and attachment.get("picurl"):
+        return {"picurl": attachment["picurl"], "trigger_id": trigger_id}
     if not (attachment and attachment.get("upload_url")):
         return {"message": "Failed to upload image"}
 
@@ -321,10 +316,69 @@ async def send_message(
     picurl = await discord.send_attachment_message(body.upload_filename)
     if not picurl:
         return {"message": "Failed to send message"}
+    upload_dedup.set_message(body.upload_filename, picurl)
 
     return {"picurl": picurl}
 
 
+def result_update(body: MidjourneyResultIn, task: dict) -> dict:
+    """根据 end 事件生成任务结果更新参数"""
+    # 提取结果URL
+    result_url = None
+    msg_hash = ''
+    if body.attachments and len(body.attachments) > 0:
+        result_url = body.attachments[0].get("url")
+        msg_hash = body.attachments[0].get("filename").split("_")[-1].split(".")[0]
+
+    task_id = task.get("task_id")
+    if task.get("task_type").startswith(SPLIT_TASK_TYPES):
+        ## 四宫格需要下载切图，先持久化结果，交给后处理队列异步完成
+        return dict(
+            task_id=task_id,
+            task_status="PROCESSING",
+            attachments=body.attachments,
+            msg_id=body.id,
+            msg_hash=msg_hash
+        )
+
+    # 配置了附件代理时，结果地址改为本服务的 /media/{task_id}，避免 Discord 地址过期
+    if result_url and MEDIA_PUBLIC_BASE_URL:
+        result_url = f"{MEDIA_PUBLIC_BASE_URL.rstrip('/')}/{task_id}"
+
+    return dict(
+        task_id=task_id,
+        task_status="SUCCESS",
+        result_url=result_url,
+        attachments=body.attachments,
+        msg_id=body.id,
+        msg_hash=msg_hash  # 如果有消息hash，可以从其他地方获取
+    )
+
+
+def submit_result(body: MidjourneyResultIn, task: dict, update: dict):
+    """结果写库后，四宫格任务提交后处理，其余任务推送结果到租户回调地址"""
+    task_id = update["task_id"]
+    if update["task_status"] == "PROCESSING":
+        if body.attachments:
+            postprocess.submit_preview(task_id, body.attachments[0])
+        postprocess.submit(task_id)
+        logger.info(f"任务结果已提交后处理: {task_id} , trigger_id: {body.trigger_id}")
+    else:
+        webhook.notify(
+            task, update["task_status"],
+            result_url=update.get("result_url"), msg_id=str(body.id), msg_hash=update.get("msg_hash"),
+        )
+        logger.info(f"任务结果更新成功: {task_id} , trigger_id: {body.trigger_id}")
+
+
+async def submitted_task(trigger_id: str) -> Optional[dict]:
+    """trigger_id 最新的 SUBMITTED 任务，不存在返回 None，查询失败抛出异常"""
+    tasks = await db_ops.get_tasks_by_trigger_ids_status([trigger_id], "SUBMITTED")
+    if tasks is None:
+        raise RuntimeError("查询任务失败")
+    return (tasks.get(trigger_id) or [None])[0]
+
+
 @router.post("/midjourney/result", response_model=SimpleResponse)
 async def midjourney_result(body: MidjourneyResultIn):
     """接收Midjourney结果数据并打印JSON内容	{
@@ -352,64 +406,157 @@ async def midjourney_result(body: MidjourneyResultIn):
     logger.info(f"收到Midjourney结果数据: {body.json()}")
     print(f"Midjourney Result JSON: {body.json()}")
     
+    # 生成中的进度可重复覆盖，其余状态按 (状态, 消息ID) 去重
+    event_key = f"{body.type}:{body.id}"
+    if body.type != "generating":
+        if RESULT_EVENTS.get(event_key):
+            logger.info(f"重复的结果回调，已忽略: {event_key} , trigger_id: {body.trigger_id}")
+            return {"message": "duplicate"}
+        RESULT_EVENTS.set(event_key, True)
+
     # 更新数据库任务状态和结果
     try:
         if body.trigger_id:
 
-            # 确定任务状态
+            # 生成中：只记录进度与中间图，由进度表合并写库
+            if body.type == "generating":
+                await progress_tracker.update(body.trigger_id, body.id, body.content, body.attachments)
+                return {"message": "success"}
+
+            # 确定任务状态；数据库查询或写入失败时抛出异常，返回 503 由 bot 重新投递
             if body.type == "end":
-                            # 提取结果URL
-                result_url = None
-                msg_hash = ''
-                if body.attachments and len(body.attachments) > 0:
-                    result_url = body.attachments[0].get("url")
-                    msg_hash = body.attachments[0].get("filename").split("_")[-1].split(".")[0]
-
-                task = await db_ops.get_task_by_trigger_id_status(body.trigger_id, "SUBMITTED")
+                task = await submitted_task(body.trigger_id)
                 if not task:
+                    # API 重启后内存去重表为空，已写入该消息结果的任务视为重复投递
+                    written = await db_ops.get_tasks_by_trigger_ids_msg_ids([body.trigger_id], [body.id])
+                    if written is None:
+                        raise RuntimeError("查询已写入的任务失败")
+                    if written:
+                        logger.info(f"重复的结果回调，已忽略: {event_key} , trigger_id: {body.trigger_id}")
+                        return {"message": "duplicate"}
                     logger.error(f"任务不存在: {body.trigger_id}")
                     return {"message": "任务不存在"}
-                
-                task_id = task.get("task_id")
-
-                if task.get("task_type") == 'generate' or  task.get("task_type").startswith('variation'):
-                    ##下载图片result_url到本地
-                    result_local_path = _download_and_split_file(result_url, "downloads")
-                    if result_local_path and len(result_local_path) > 1:
-                        result_url = ''
-                        for i, url in enumerate(result_local_path):
-                            if i > 0:
-                                result_url += "||"
-                            result_url += url
-
-                # 更新任务结果
-                await db_ops.update_task_result(
-                    task_id=task_id,
-                    task_status="SUCCESS",
-                    result_url=result_url,
-                    attachments=body.attachments,
-                    msg_id=body.id, 
-                    msg_hash=msg_hash  # 如果有消息hash，可以从其他地方获取
-                )
-                logger.info(f"任务结果更新成功: {task_id} , trigger_id: {body.trigger_id}")
+
+                progress_tracker.finish(task["task_id"])
+                update = result_update(body, task)
+                if not await db_ops.update_task_results([update]):
+                    raise RuntimeError("写入任务结果失败")
+                submit_result(body, task, update)
             elif body.type == "banned":
                 logger.error(f"任务被封禁: {body.trigger_id}")
-                await db_ops.update_task_result(
-                    task_id=task_id,
-                    task_status="BANNED"
-                )
+                task = await submitted_task(body.trigger_id)
+                if not task:
+                    logger.error(f"任务不存在: {body.trigger_id}")
+                    return {"message": "任务不存在"}
+                progress_tracker.finish(task["task_id"])
+                if not await db_ops.update_task_results([dict(task_id=task.get("task_id"), task_status="BANNED")]):
+                    raise RuntimeError("写入任务状态失败")
+                webhook.notify(task, "BANNED")
                 logger.info(f"任务被封禁: {body.trigger_id}")
     except Exception as e:
+        # 返回 503，bot 发件箱稍后重新投递
+        RESULT_EVENTS.pop(event_key)
         logger.error(f"更新任务结果失败: {e}")
+        return JSONResponse(status_code=503, content={"message": "retry later"})
     
     return {"message": "success"}
 
 
+@router.post("/midjourney/results", response_model=MidjourneyResultBatchResponse)
+async def midjourney_results(body: MidjourneyResultBatchIn):
+    """
+    批量接收 bot 结果事件
+
+    一次查询解析所有 trigger_id 对应的任务，在一个事务中写入结果，按 events 顺序返回每个事件的状态；
+    状态为 error 的事件可由 bot 重新投递。
+    """
+    results = ["success"] * len(body.events)
+    pending = []  # (序号, 事件, 去重键)
+    for index, event in enumerate(body.events):
+        if not event.trigger_id:
+            continue
+        if event.type == "generating":
+            await progress_tracker.update(event.trigger_id, event.id, event.content, event.attachments)
+            continue
+        if event.type not in ("end", "banned"):
+            continue
+        event_key = f"{event.type}:{event.id}"
+        if RESULT_EVENTS.get(event_key):
+            results[index] = "duplicate"
+            continue
+        RESULT_EVENTS.set(event_key, True)
+        pending.append((index, event, event_key))
+
+    if not pending:
+        return {"results": results}
+
+    trigger_ids = list({event.trigger_id for _, event, _ in pending})
+    tasks = await db_ops.get_tasks_by_trigger_ids_status(trigger_ids, "SUBMITTED")
+    if tasks is None:
+        for index, _, event_key in pending:
+            RESULT_EVENTS.pop(event_key)
+            results[index] = "error"
+        return {"results": results}
+
+    updates = []  # (序号, 事件, 去重键, 任务, 更新参数)
+    missing = []
+    for index, event, event_key in pending:
+        # 同一trigger_id的多个结束事件（例如同时完成的 U1 / U2）按单条接口的顺序依次分配 SUBMITTED 任务
+        candidates = tasks.get(event.trigger_id)
+        task = candidates.pop(0) if candidates else None
+        if task is None:
+            missing.append((index, event, event_key))
+            continue
+        progress_tracker.finish(task["task_id"])
+        if event.type == "end":
+            updates.append((index, event, event_key, task, result_update(event, task)))
+        else:
+            logger.error(f"任务被封禁: {event.trigger_id}")
+            updates.append((index, event, event_key, task, dict(task_id=task.get("task_id"), task_status="BANNED")))
+
+    if missing:
+        # API 重启后内存去重表为空，已写入该消息结果的任务视为重复投递
+        written = await db_ops.get_tasks_by_trigger_ids_msg_ids(
+            list({event.trigger_id for _, event, _ in missing}), list({event.id for _, event, _ in missing})
+        )
+        written = None if written is None else {(task["trigger_id"], task["msg_id"]) for task in written}
+        for index, event, event_key in missing:
+            if written is None:
+                RESULT_EVENTS.pop(event_key)
+                results[index] = "error"
+                continue
+            results[index] = "duplicate" if (event.trigger_id, event.id) in written else "not_found"
+            if results[index] == "not_found":
+                logger.error(f"任务不存在: {event.trigger_id}")
+
+    if updates:
+        if await db_ops.update_task_results([update for *_, update in updates]):
+            for _, event, _, task, update in updates:
+                if event.type == "end":
+                    submit_result(event, task, update)
+                else:
+                    webhook.notify(task, "BANNED")
+        else:
+            for index, _, event_key, _, _ in updates:
+                RESULT_EVENTS.pop(event_key)
+                results[index] = "error"
+
+    logger.info(f"批量结果事件: {len(body.events)} 条, 写库: {len(updates)} 条")
+    return {"results": results}
+
+
 @router.post("/queue/release", response_model=TriggerResponse)
 async def queue_release(
     body: QueueReleaseIn
 ):
     """bot 清除队列任务"""
+    if body.msg_id is not None:
+        release_key = f"{body.trigger_id}:{body.msg_id}"
+        if RELEASE_EVENTS.get(release_key):
+            logger.info(f"重复的队列释放，已忽略: {release_key}")
+            return {"trigger_id": body.trigger_id, "trigger_type": "queue_release", "result": "duplicate"}
+        RELEASE_EVENTS.set(release_key, True)
+
     logger.info(f"清除队列任务: {body.trigger_id}")
     taskqueue.pop(body.trigger_id)
 
@@ -426,6 +573,7 @@ async def solo_variation(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.solo_variation.value
 
@@ -439,7 +587,10 @@ async def solo_variation(
             task_type=trigger_type,
             ref_pic_url='',
             image_index=0,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -458,6 +609,7 @@ async def solo_low_variation(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.solo_low_variation.value
 
@@ -471,7 +623,10 @@ async def solo_low_variation(
             task_type=trigger_type,
             ref_pic_url='',
             image_index=0,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -490,6 +645,7 @@ async def solo_high_variation(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.solo_high_variation.value
 
@@ -503,7 +659,10 @@ async def solo_high_variation(
             task_type=trigger_type,
             ref_pic_url='',
             image_index=0,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -522,6 +681,7 @@ async def expand(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.expand.value
 
@@ -536,7 +696,10 @@ async def expand(
             ref_pic_url='',
             image_index=0,
             direction=body.direction,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -556,6 +719,7 @@ async def zoomout(
     current_user: dict = Depends(get_current_user),
     _: bool = Depends(check_user_token_limit)
 ):
+    callback_url = await task_callback_url(body, current_user)
     trigger_id = body.trigger_id
     trigger_type = TriggerType.zoomout.value
 
@@ -570,7 +734,10 @@ async def zoomout(
             ref_pic_url='',
             image_index=0,
             zoom_out=body.zoomout,
-            task_status="SUBMITTED"
+            task_status="SUBMITTED",
+            app_key=current_user.get('app_key'),
+            callback_url=callback_url,
+            callback_images=body.callback_images or ""
         )
     except Exception as e:
         logger.error(f"创建任务记录失败: {e}")
@@ -593,11 +760,13 @@ async def get_task_by_id(
         task = await db_ops.get_task_by_task_id(task_id)
         if task:
             if task["task_status"] == "SUCCESS":
-                return {"status": "SUCCESS", "imageUrl": task["result_url"], "buttons": {"msg_id": task["msg_id"], "msg_hash": task["msg_hash"]}}
+                return {"status": "SUCCESS", "imageUrl": task["result_url"], "previewUrl": task.get("preview_url"), "buttons": {"msg_id": task["msg_id"], "msg_hash": task["msg_hash"]}}
             elif task["task_status"] == "TIMEOUT":
                 return {"status": "FAILURE", "message": "任务超时，已自动清理"}
             elif task["task_status"] == "BANNED":
                 return {"status": "FAILURE", "message": "任务被封禁"}
+            elif task["task_status"] == "FAILURE":
+                return {"status": "FAILURE", "message": "结果图处理失败"}
             else:
                 tm1 = task['updated_at']
                 now = datetime.now()
@@ -605,7 +774,21 @@ async def get_task_by_id(
                 if diff.total_seconds() > 300:  # 5分钟超时
                     return {"status": "FAILURE", "message": "任务超时"}
 
-                return {"status":task["task_status"], "message": "任务未完成"}
+                if task["task_status"] == "PROCESSING":
+                    # 已出图、正在切图上传的内部状态，对外仍按已提交返回，避免旧客户端识别不了
+                    return {
+                        "status": "SUBMITTED",
+                        "message": "任务未完成",
+                        "progress": 100,
+                        "previewUrl": task.get("preview_url"),
+                    }
+                progress = progress_tracker.get(task["task_id"]) if task["task_status"] == "SUBMITTED" else None
+                return {
+                    "status": task["task_status"],
+                    "message": "任务未完成",
+                    "progress": progress["progress"] if progress else task.get("progress") or 0,
+                    "previewUrl": (progress and progress["preview_url"]) or task.get("preview_url"),
+                }
         else:
             return {"status": "FAILURE", "message": "任务不存在"}
     except Exception as e:
@@ -613,6 +796,84 @@ async def get_task_by_id(
         return {"status": "FAILURE"}
 
 
+@router.get("/similar")
+async def find_similar_images(
+    task_id: str = None,
+    image_index: int = 1,
+    phash: str = Query(None, regex="^[0-9a-fA-F]{16}$"),
+    max_distance: int = MAX_SIMILAR_DISTANCE,
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    按感知哈希查找当前用户相似的已生成图片，可传 task_id + image_index 或 16 位十六进制 phash
+
+    phash 格式错误时返回 400。
+    """
+    app_key = current_user.get('app_key')
+    try:
+        if phash is None and task_id:
+            record = await hash_ops.get_hash(app_key, task_id, image_index)
+            if not record:
+                return {"code": 1, "message": "图片哈希不存在"}
+            phash = record["phash"]
+        if not phash:
+            return {"code": 1, "message": "缺少 task_id 或 phash"}
+
+        value = int(phash, 16)
+        max_distance = max(0, min(max_distance, MAX_SIMILAR_DISTANCE))
+        candidates = await hash_ops.find_similar(app_key, value, max_distance)
+        if candidates is None:
+            return {"code": 1, "message": "查询失败"}
+        matches = [
+            {
+                "task_id": candidate["task_id"],
+                "image_index": candidate["image_index"],
+                "image_url": candidate["image_url"],
+                "distance": candidate["distance"],
+            }
+            for candidate in candidates
+            if not (candidate["task_id"] == task_id and candidate["image_index"] == image_index)
+        ]
+        matches.sort(key=lambda item: item["distance"])
+        return {"code": 0, "data": {"phash": phash, "matches": matches[:limit]}}
+    except Exception as e:
+        logger.error(f"查询相似图片失败: {e}")
+        return {"code": 1, "message": "查询失败"}
+
+
+@router.get("/export")
+async def export_results(
+    task_ids: str = None,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    导出当前用户已完成任务的结果图为 ZIP
+
+    task_ids 为逗号分隔的 task_id 列表，或用 start_time / end_time 指定创建时间范围。
+    压缩包边读边写，不生成临时文件。
+    """
+    ids = [task_id.strip() for task_id in (task_ids or "").split(",") if task_id.strip()]
+    if not ids and not start_time and not end_time:
+        return {"code": 1, "message": "缺少 task_ids 或时间范围"}
+
+    tasks = await db_ops.get_user_tasks(
+        current_user.get('app_key'), ids, start_time, end_time, EXPORT_MAX_TASKS
+    )
+    if not tasks:
+        return {"code": 1, "message": "没有可导出的任务"}
+
+    file_name = f"midjourney_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    logger.info(f"📦 开始导出 - 用户: {current_user.get('user_name')}, 任务: {len(tasks)}")
+    return StreamingResponse(
+        stream_zip(tasks),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+    )
+
+
 @router.get("/tasks")
 async def get_tasks(
     status: str = None,
@@ -645,11 +906,13 @@ async def get_task_by_id(
             if task["task_status"] == "SUCCESS":
                 return {"code":0, "data":{
                     "file_url": task["result_url"],
+                    "preview_url": task.get("preview_url"),
                     "task_status": "FINISH",
                 }}
-            elif task["task_status"] == "SUBMITTED" or task["task_status"] == "AUTOMA":
+            elif task["task_status"] in ("SUBMITTED", "AUTOMA", "PROCESSING"):
                 return {"code":0, "data":{
                     "task_status": "RUNNING",
+                    "preview_url": task.get("preview_url"),
                 }}
             elif task["task_status"] == "TIMEOUT":
                 return {"code":0, "data":{
@@ -690,6 +953,58 @@ async def get_queue_status(
         return {"code": 1, "message": "获取队列状态失败"}
 
 
+@router.get("/postprocess/status")
+async def get_postprocess_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """获取结果图后处理队列状态"""
+    try:
+        return {"code": 0, "data": postprocess.get_status()}
+    except Exception as e:
+        logger.error(f"获取后处理队列状态失败: {e}")
+        return {"code": 1, "message": "获取后处理队列状态失败"}
+
+
+@router.get("/upload/status")
+async def get_upload_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """获取附件上传状态"""
+    return {"code": 0, "data": uploader.get_status()}
+
+
+@router.get("/rehost/status")
+async def get_rehost_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """获取参考图转存状态"""
+    return {"code": 0, "data": rehoster.get_status()}
+
+
+@router.get("/webhook/status")
+async def get_webhook_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """租户回调地址的队列、熔断状态与推送统计"""
+    return {"code": 0, "data": webhook.get_status()}
+
+
+@router.get("/progress/status")
+async def get_progress_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """获取生成进度表状态"""
+    return {"code": 0, "data": progress_tracker.get_status()}
+
+
+@router.get("/media/status")
+async def get_media_cache_status(
+    current_user: dict = Depends(get_current_user)
+):
+    """获取附件代理缓存状态"""
+    return {"code": 0, "data": media_cache.get_status()}
+
+
 @router.post("/queue/cleanup")
 async def manual_queue_cleanup(
     current_user: dict = Depends(get_current_user)
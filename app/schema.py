@@ -1,14 +1,43 @@
-from typing import Optional, Any
+from typing import List, Optional, Any
+from urllib.parse import urlparse
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
+from util.net import UnsafeAddressError, check_literal_host
 
-class TriggerImagineIn(BaseModel):
+
+class CallbackIn(BaseModel):
+    callback_url: Optional[str]  # 任务结束时推送结果的地址，不传时使用用户默认的回调地址
+    # 成功回调以 multipart/form-data 附带图片：quadrants 四张切图，1-4 其中一张，preview 预览图
+    callback_images: Optional[str]
+
+    @validator("callback_url")
+    def check_callback_url(cls, value):
+        if not value:
+            return value
+        parsed = urlparse(value)
+        if parsed.scheme not in ("http", "https") or len(value) > 512:
+            raise ValueError("callback_url must be an http(s) url")
+        # 这里只拒绝内网 IP 字面量与 localhost，主机名由路由解析后检查（task_callback_url）
+        try:
+            check_literal_host(parsed.hostname)
+        except UnsafeAddressError as e:
+            raise ValueError(f"callback_url not allowed: {e}")
+        return value
+
+    @validator("callback_images")
+    def check_callback_images(cls, value):
+        if value and value not in ("quadrants", "1", "2", "3", "4", "preview"):
+            raise ValueError("callback_images must be one of quadrants, 1-4, preview")
+        return value
+
+
+class TriggerImagineIn(CallbackIn):
     prompt: str
     picurl: Optional[str]
 
 
-class TriggerUVIn(BaseModel):
+class TriggerUVIn(CallbackIn):
     index: int
     msg_id: str
     msg_hash: str
@@ -16,21 +45,21 @@ class TriggerUVIn(BaseModel):
     trigger_id: str  # 供业务定位触发ID，/trigger/imagine 接口返回的 trigger_id
 
 
-class TriggerResetIn(BaseModel):
+class TriggerResetIn(CallbackIn):
     msg_id: str
     msg_hash: str
 
     trigger_id: str  # 供业务定位触发ID，/trigger/imagine 接口返回的 trigger_id
 
 
-class TriggerExpandIn(BaseModel):
+class TriggerExpandIn(CallbackIn):
     msg_id: str
     msg_hash: str
     direction: str  # right/left/up/down
 
     trigger_id: str  # 供业务定位触发ID，/trigger/imagine 接口返回的 trigger_id
 
-class TriggerZoomOutIn(BaseModel):
+class TriggerZoomOutIn(CallbackIn):
     msg_id: str
     msg_hash: str
     zoomout: int    # 2x: 50; 1.5x: 75
@@ -38,13 +67,14 @@ class TriggerZoomOutIn(BaseModel):
     trigger_id: str  # 供业务定位触发ID，/trigger/imagine 接口返回的 trigger_id
 
 
-class TriggerDescribeIn(BaseModel):
+class TriggerDescribeIn(CallbackIn):
     upload_filename: str
     trigger_id: str
 
 
 class QueueReleaseIn(BaseModel):
     trigger_id: str
+    msg_id: Optional[int] = None  # 触发释放的 Discord 消息 ID，重复投递的释放按此去重
 
 
 class TriggerResponse(BaseModel):
@@ -59,6 +89,7 @@ class UploadResponse(BaseModel):
     message: str = "success"
     upload_filename: str = ""
     upload_url: str = ""
+    picurl: str = ""  # 请求带 dedup=true 且相同内容已发送过时直接返回附件地址，无需再调用 /message
     trigger_id: str
     
 class SendMessageIn(BaseModel):
@@ -80,6 +111,17 @@ class MidjourneyResultIn(BaseModel):
     trigger_id: str
 
 
+class MidjourneyResultBatchIn(BaseModel):
+    """批量接收 bot 结果事件"""
+    events: List[MidjourneyResultIn]
+
+
+class MidjourneyResultBatchResponse(BaseModel):
+    """与 events 顺序一致的处理状态：success / duplicate / not_found / error"""
+    message: str = "success"
+    results: List[str]
+
+
 class SimpleResponse(BaseModel):
     """简单的成功响应模型"""
     message: str = "success"
@@ -1,25 +1,38 @@
 import uvicorn
 from fastapi import FastAPI, status
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from loguru import logger
 import os
 
 from exceptions import APPBaseException, ErrorCode
 from lib.database import connect_db, disconnect_db, create_tables
+from lib.postprocess import postprocess
+from lib.progress import progress_tracker
+from lib.upload import upload_dedup
+from lib.storage import storage, STORAGE_LOCAL_DIR
+from util.download import downloader
+from lib.rehost import rehoster
+from lib.webhook import webhook
 from log_config import setup_api_logger
 
 
-def init_app():
+def init_app(with_bot: bool = False):
     # 初始化日志系统
     setup_api_logger()
     
     _app = FastAPI(title="Midjourney API")
 
+    register_middlewares(_app)
     register_blueprints(_app)
     register_static_files(_app)
     exc_handler(_app)
     register_events(_app)
+    if with_bot:
+        register_bot(_app)
+    else:
+        register_eventbus(_app)
     
     return _app
 
@@ -31,11 +44,25 @@ def register_events(_app):
         create_tables()
         # 连接数据库
         await connect_db()
+        # 启动结果图后处理队列
+        postprocess.start()
+        # 启动生成进度合并写库
+        progress_tracker.start()
+        # 加载上传去重缓存
+        upload_dedup.load()
 
     @_app.on_event("shutdown")
     async def shutdown_event():
+        await postprocess.stop()
+        await progress_tracker.stop()
+        upload_dedup.save()
         # 断开数据库连接
         await disconnect_db()
+        # 关闭存储后端连接
+        await storage.close()
+        await downloader.close()
+        await rehoster.close()
+        await webhook.close()
 
 
 def exc_handler(_app):
@@ -64,7 +91,7 @@ def register_static_files(_app):
     """注册静态文件服务"""
     # 创建静态文件目录（如果不存在）
     static_dir = "static"
-    downloads_dir = "downloads"
+    downloads_dir = STORAGE_LOCAL_DIR
     
     if not os.path.exists(static_dir):
         os.makedirs(static_dir)
@@ -74,7 +101,100 @@ def register_static_files(_app):
     
     # 挂载静态文件目录
     _app.mount("/static", StaticFiles(directory=static_dir), name="static")
-    _app.mount("/downloads", StaticFiles(directory=downloads_dir), name="downloads")
+    # 本地结果图（/downloads）与 Discord 附件代理（/media）由支持 ETag / Range 的专用路由提供，
+    # 使用对象存储时结果图由存储服务直接对外提供
+    from app import files
+    _app.include_router(files.router)
+
+
+def ensure_delivered(result):
+    """路由返回非 2xx 响应（如数据库不可用时的 503）时抛出异常，事件留在 bot 发件箱中重新投递"""
+    if isinstance(result, Response) and not 200 <= result.status_code < 300:
+        raise RuntimeError(f"HTTP {result.status_code}")
+    return result
+
+
+async def handle_bot_result(data):
+    """bot 结果回调，进程内直接调用 /midjourney/result 的处理函数"""
+    from app import routers
+    from app.schema import MidjourneyResultIn
+    return ensure_delivered(await routers.midjourney_result(MidjourneyResultIn(**data)))
+
+
+async def handle_bot_release(data):
+    """bot 队列释放，进程内直接调用 /queue/release 的处理函数"""
+    from app import routers
+    from app.schema import QueueReleaseIn
+    return ensure_delivered(await routers.queue_release(QueueReleaseIn(**data)))
+
+
+def register_eventbus(_app):
+    """配置了 EVENTBUS_ADDRESS 时监听 bot 的事件通道"""
+    from lib.eventbus import EVENTBUS_ADDRESS, EVENTBUS_TOKEN, EventBusServer
+
+    if not EVENTBUS_ADDRESS:
+        return
+
+    async def handle_event(kind: str, data):
+        if kind == "callback":
+            return await handle_bot_result(data)
+        if kind == "release":
+            return await handle_bot_release(data)
+        logger.warning(f"⚠️ 未知的事件类型: {kind}")
+
+    server = EventBusServer(EVENTBUS_ADDRESS, handle_event, EVENTBUS_TOKEN)
+    _app.state.eventbus = server
+
+    @_app.on_event("startup")
+    async def start_eventbus():
+        await server.start()
+
+    @_app.on_event("shutdown")
+    async def stop_eventbus():
+        await server.stop()
+
+
+def register_bot(_app):
+    """
+    单进程模式：Discord bot 与 API 运行在同一事件循环
+
+    bot 的结果回调与队列释放经发件箱日志后直接调用路由处理函数，不再经过 CALLBACK_URL / QUEUE_RELEASE_API。
+    """
+    import asyncio
+
+    from exceptions import MissRequiredVariableError
+    from lib.api.callback import register_local_handlers, unregister_local_handlers
+    from task.bot.listener import bot
+
+    bot_token = os.getenv("BOT_TOKEN")
+    if not bot_token:
+        raise MissRequiredVariableError("Missing required environment variable: [BOT_TOKEN]")
+
+    bot_task = None
+
+    def on_bot_exit(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Discord bot 已退出: {task.exception()}")
+
+    @_app.on_event("startup")
+    async def start_bot():
+        nonlocal bot_task
+        register_local_handlers(handle_bot_result, handle_bot_release)
+        bot_task = asyncio.get_running_loop().create_task(bot.start(bot_token))
+        bot_task.add_done_callback(on_bot_exit)
+        logger.info("🤖 单进程模式：Discord bot 已在 API 事件循环中启动")
+
+    @_app.on_event("shutdown")
+    async def stop_bot():
+        unregister_local_handlers()
+        await bot.close()
+        if bot_task is not None:
+            await asyncio.gather(bot_task, return_exceptions=True)
+
+
+def register_middlewares(_app):
+    from app.middleware import GzipRequestMiddleware
+    _app.add_middleware(GzipRequestMiddleware)
 
 
 def register_blueprints(_app):
@@ -82,6 +202,6 @@ def register_blueprints(_app):
     _app.include_router(routers.router, prefix="/v1/api/trigger")
 
 
-def run(host, port):
-    _app = init_app()
+def run(host, port, with_bot: bool = False):
+    _app = init_app(with_bot)
     uvicorn.run(_app, port=port, host=host)
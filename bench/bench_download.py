@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+下载压测脚本 - 在本地故障注入服务上测量下载吞吐与失败率
+
+本地启动一个模拟 Discord CDN 的 HTTP 服务，按比例注入：
+  - 5xx 错误
+  - 传输中途断开连接
+  - 慢速响应
+分别用旧实现（requests 单次下载）与 util.download.Downloader 下载，对比结果。
+
+用法: python bench/bench_download.py --count 50 --size 8 --fault 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from util.download import Downloader
+
+
+def make_app(payload: bytes, fault_rate: float, slow_rate: float) -> web.Application:
+    async def handler(request: web.Request) -> web.StreamResponse:
+        start = 0
+        range_header = request.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+
+        roll = random.random()
+        if roll < fault_rate / 3:
+            return web.Response(status=503)
+
+        status = 206 if start else 200
+        resp = web.StreamResponse(status=status)
+        resp.content_length = len(payload) - start
+        if start:
+            resp.headers["Content-Range"] = f"bytes {start}-{len(payload) - 1}/{len(payload)}"
+        await resp.prepare(request)
+
+        # 传输中途断开
+        cut = len(payload)
+        if roll < fault_rate:
+            cut = random.randint(start, len(payload) - 1)
+
+        pos = start
+        while pos < cut:
+            end = min(pos + 256 * 1024, cut)
+            await resp.write(payload[pos:end])
+            pos = end
+            if random.random() < slow_rate:
+                await asyncio.sleep(0.05)
+
+        if cut < len(payload):
+            request.transport.close()
+            return resp
+
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/attachments/{name}", handler)
+    return app
+
+
+def legacy_download(url: str, path: str) -> bool:
+    import requests
+
+    try:
+        response = requests.get(url, stream=True, timeout=30)
+        if response.status_code != 200:
+            return False
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+        return True
+    except Exception:
+        return False
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=50, help="下载次数")
+    parser.add_argument("--size", type=int, default=8, help="文件大小 MB")
+    parser.add_argument("--fault", type=float, default=0.3, help="故障注入比例")
+    parser.add_argument("--slow", type=float, default=0.05, help="慢速分块比例")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size * 1024 * 1024)
+    runner = web.AppRunner(make_app(payload, args.fault, args.slow))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = f"http://127.0.0.1:{port}/attachments"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 旧实现
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def run_legacy(i):
+            async with semaphore:
+                path = os.path.join(tmp, f"legacy_{i}.png")
+                ok = await loop.run_in_executor(None, legacy_download, f"{base}/{i}.png", path)
+                return ok and os.path.getsize(path) == len(payload)
+
+        begin = time.perf_counter()
+        results = await asyncio.gather(*(run_legacy(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - begin
+        ok = sum(results)
+        print(f"legacy    : 成功 {ok}/{args.count}, 失败率 {1 - ok / args.count:.1%}, "
+              f"吞吐 {ok * args.size / elapsed:.1f} MB/s, 耗时 {elapsed:.2f}s")
+
+        # 新实现
+        downloader = Downloader(limit_per_host=args.concurrency, backoff=0.05, backoff_max=0.5)
+
+        async def run_new(i):
+            async with semaphore:
+                path = os.path.join(tmp, f"new_{i}.png")
+                try:
+                    await downloader.download(f"{base}/{i}.png", path, len(payload))
+                    return True
+                except Exception:
+                    return False
+
+        begin = time.perf_counter()
+        results = await asyncio.gather(*(run_new(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - begin
+        ok = sum(results)
+        print(f"downloader: 成功 {ok}/{args.count}, 失败率 {1 - ok / args.count:.1%}, "
+              f"吞吐 {ok * args.size / elapsed:.1f} MB/s, 耗时 {elapsed:.2f}s, 统计 {downloader.stats}")
+        await downloader.close()
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+上传归一化压测脚本 - 统计归一化前后的上传字节数与耗时
+
+生成大尺寸 PNG / JPEG 参考图，分别按原图与归一化后的文件上传到本地模拟的 upload_url，
+上传链路按 --bandwidth 限速（模拟经代理访问 Discord 的带宽）。
+
+用法: python bench/bench_normalize.py --size 8192x8192 --bandwidth 4 --max-edge 2048
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+for name in ("GUILD_ID", "CHANNEL_ID", "USER_TOKEN", "DRAW_VERSION"):
+    os.environ.setdefault(name, "bench")
+
+
+def make_app(bandwidth: float):
+    from aiohttp import web
+
+    async def handler(request: web.Request) -> web.Response:
+        # 按带宽限速读取请求体
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            await asyncio.sleep(len(chunk) / (bandwidth * 1024 * 1024))
+        return web.Response(status=200)
+
+    app = web.Application(client_max_size=1 << 31)
+    app.router.add_put("/upload/{name}", handler)
+    return app
+
+
+async def run(sources, args):
+    from aiohttp import web
+
+    from lib.api import discord
+    from lib.image import normalize_image
+    from lib.upload import open_file_stream
+
+    runner = web.AppRunner(make_app(args.bandwidth))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    url = f"http://127.0.0.1:{args.port}/upload/bench"
+    loop = asyncio.get_running_loop()
+
+    for src in sources:
+        size = os.path.getsize(src)
+        begin = time.perf_counter()
+        await discord.put_attachment(url, open_file_stream(src), size)
+        raw_seconds = time.perf_counter() - begin
+
+        output = f"{src}.{args.format}"
+        begin = time.perf_counter()
+        out_size = await loop.run_in_executor(
+            None, normalize_image, src, output, args.max_edge, args.format, args.quality
+        )
+        normalize_seconds = time.perf_counter() - begin
+        begin = time.perf_counter()
+        await discord.put_attachment(url, open_file_stream(output), out_size)
+        upload_seconds = time.perf_counter() - begin
+
+        print(f"{os.path.basename(src):<10}: {size / 1024 / 1024:.1f}MB -> {out_size / 1024 / 1024:.2f}MB "
+              f"(节省 {(1 - out_size / size) * 100:.0f}%), 原图上传 {raw_seconds:.2f}s, "
+              f"归一化 {normalize_seconds:.2f}s + 上传 {upload_seconds:.2f}s")
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="8192x8192")
+    parser.add_argument("--bandwidth", type=float, default=4, help="上传带宽（MB/s）")
+    parser.add_argument("--max-edge", type=int, default=2048)
+    parser.add_argument("--format", choices=["jpeg", "webp"], default="jpeg")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--port", type=int, default=18090)
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    from bench.bench_split import make_grid
+
+    width, height = (int(v) for v in args.size.split("x"))
+    with tempfile.TemporaryDirectory() as tmp:
+        png = os.path.join(tmp, "photo.png")
+        make_grid(png, width, height)
+        jpg = os.path.join(tmp, "photo.jpg")
+        with Image.open(png) as img:
+            img.save(jpg, quality=95)
+        asyncio.run(run([png, jpg], args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+结果图下载压测脚本 - 对比 StaticFiles 挂载与 /downloads 专用路由
+
+同一目录分别挂载为 /static_mount（旧实现）与 /downloads（app.files），
+并发客户端重复下载同一批切图：
+  - full: 每次完整下载
+  - revalidate: 携带 If-None-Match 重复请求（客户端轮询场景）
+
+用法: python bench/bench_serve.py --files 20 --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+async def run_clients(base: str, names, total: int, concurrency: int, revalidate: bool):
+    import aiohttp
+
+    etags = {}
+    transferred = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def one(i):
+            nonlocal transferred
+            name = names[i % len(names)]
+            headers = {}
+            if revalidate and name in etags:
+                headers["If-None-Match"] = etags[name]
+            async with semaphore:
+                async with session.get(f"{base}/{name}", headers=headers) as resp:
+                    body = await resp.read()
+                    transferred += len(body)
+                    if resp.headers.get("ETag"):
+                        etags[name] = resp.headers["ETag"]
+
+        begin = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - begin, transferred
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size", type=int, default=2, help="单个文件大小 MB")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["STORAGE_LOCAL_DIR"] = tmp
+    os.environ["STORAGE_BACKEND"] = "local"
+
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.staticfiles import StaticFiles
+
+    from app import files
+
+    names = []
+    for i in range(args.files):
+        name = f"bench_{i}.png"
+        with open(os.path.join(tmp, name), "wb") as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        names.append(name)
+
+    app = FastAPI()
+    app.include_router(files.router)
+    app.mount("/static_mount", StaticFiles(directory=tmp), name="static_mount")
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=18086, log_level="warning")
+    server = uvicorn.Server(config)
+    serve = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    for path in ("static_mount", "downloads"):
+        for revalidate in (False, True):
+            elapsed, transferred = await run_clients(
+                f"http://127.0.0.1:18086/{path}", names, args.requests, args.concurrency, revalidate
+            )
+            mode = "revalidate" if revalidate else "full"
+            print(f"/{path:<13} {mode:<10}: {args.requests / elapsed:8.1f} req/s, "
+                  f"传输 {transferred / 1024 / 1024:8.1f} MB, 耗时 {elapsed:.2f}s")
+
+    server.should_exit = True
+    await serve
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
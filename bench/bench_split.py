@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+切图编码压测脚本 - 统计每核每秒处理的四宫格数量
+
+生成与 Midjourney 输出相同尺寸（1632x2912）的 PNG 四宫格，
+分别用单线程（旧实现）与 SplitPool 的 thread / process 模式切分编码。
+
+用法: python bench/bench_split.py --images 32 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from lib.image import SplitPool, split_grid
+
+
+def make_grid(path: str, width: int, height: int):
+    """生成带渐变与噪点的四宫格，压缩率接近真实生成图"""
+    noise = Image.effect_noise((width, height), 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(noise, gradient, 0.6).filter(ImageFilter.GaussianBlur(1))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, 97):
+        draw.line((i, 0, width - i, height), fill=(i % 255, 80, 160), width=5)
+    img.save(path)
+
+
+def report(name: str, images: int, elapsed: float, cores: int):
+    rate = images / elapsed
+    print(f"{name:<16}: {images} 张, 耗时 {elapsed:.2f}s, {rate:.2f} 张/s, 每核 {rate / cores:.2f} 张/s")
+
+
+async def run_pool(kind: str, workers: int, sources, tmp: str):
+    pool = SplitPool(
+        kind=kind, workers=workers, queue_size=workers * 2, compress_level=6, pixel_budget=1024 ** 3
+    )
+    pool.start()
+    begin = time.perf_counter()
+    await asyncio.gather(*(pool.split(src, tmp) for src in sources))
+    elapsed = time.perf_counter() - begin
+    await pool.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=32, help="四宫格数量")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--width", type=int, default=1632)
+    parser.add_argument("--height", type=int, default=2912)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "grid.png")
+        make_grid(template, args.width, args.height)
+        with open(template, "rb") as f:
+            data = f.read()
+        sources = []
+        for i in range(args.images):
+            path = os.path.join(tmp, f"grid_{i}.png")
+            with open(path, "wb") as f:
+                f.write(data)
+            sources.append(path)
+        print(f"四宫格: {args.width}x{args.height}, 文件 {len(data) / 1024 / 1024:.1f} MB, worker: {args.workers}")
+
+        begin = time.perf_counter()
+        for src in sources:
+            split_grid(src, tmp)
+        report("single thread", args.images, time.perf_counter() - begin, 1)
+
+        for kind in ("thread", "process"):
+            elapsed = asyncio.run(run_pool(kind, args.workers, sources, tmp))
+            report(f"{kind} pool", args.images, elapsed, args.workers)
+
+
+if __name__ == "__main__":
+    main()
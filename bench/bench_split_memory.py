@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+切图内存压测脚本 - 统计 N 个任务同时完成时的峰值 RSS
+
+对比不同解码内存预算（SPLIT_PIXEL_BUDGET_MB）下的峰值 RSS 与耗时。
+每次测量在独立子进程中运行，避免互相影响 ru_maxrss。
+
+用法: python bench/bench_split_memory.py --concurrency 16 --budgets 0,64,128,256
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+async def measure(kind: str, budget_mb: int, concurrency: int, sources, out_dir: str):
+    from lib.image import SplitPool
+
+    # 预算为 0 时视为不限制
+    budget = budget_mb * 1024 * 1024 if budget_mb else 1 << 62
+    pool = SplitPool(kind=kind, workers=concurrency, queue_size=concurrency,
+                     compress_level=6, pixel_budget=budget)
+    pool.start()
+
+    peak = rss_mb()
+    done = False
+
+    async def sample():
+        nonlocal peak
+        while not done:
+            peak = max(peak, rss_mb())
+            await asyncio.sleep(0.005)
+
+    sampler = asyncio.get_running_loop().create_task(sample())
+    begin = time.perf_counter()
+    await asyncio.gather(*(pool.split(src, out_dir) for src in sources))
+    elapsed = time.perf_counter() - begin
+    done = True
+    await sampler
+    await pool.stop()
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{kind:<7} budget={budget_mb or '不限':>4}MB concurrency={concurrency}: "
+          f"峰值 RSS {peak:.0f} MB, 子进程峰值 {children:.0f} MB, 耗时 {elapsed:.2f}s")
+
+
+def child(args):
+    sources = [os.path.join(args.dir, f"grid_{i}.png") for i in range(args.concurrency)]
+    asyncio.run(measure(args.kind, args.budget, args.concurrency, sources, args.dir))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16, help="同时完成的任务数")
+    parser.add_argument("--budgets", default="0,64,128,256", help="解码内存预算 MB，逗号分隔，0 为不限")
+    parser.add_argument("--kind", default="thread")
+    parser.add_argument("--budget", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dir:
+        child(args)
+        return
+
+    from bench.bench_split import make_grid
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "grid_0.png")
+        make_grid(template, 1632, 2912)
+        with open(template, "rb") as f:
+            data = f.read()
+        for i in range(1, args.concurrency):
+            with open(os.path.join(tmp, f"grid_{i}.png"), "wb") as f:
+                f.write(data)
+
+        for budget in args.budgets.split(","):
+            subprocess.run([
+                sys.executable, __file__,
+                "--kind", args.kind,
+                "--concurrency", str(args.concurrency),
+                "--budget", budget,
+                "--dir", tmp,
+            ], check=True, cwd=ROOT)
+
+
+if __name__ == "__main__":
+    main()
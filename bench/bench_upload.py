@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+上传内存压测脚本 - 统计 N 个并发上传的峰值 RSS
+
+本地启动一个模拟 Discord upload_url 的 HTTP 服务（接收 PUT 并丢弃数据），
+对比两种上传方式：
+  - buffered: await file.read() 读入整张图后 PUT（旧实现）
+  - stream:   从 UploadFile 临时文件按块流式 PUT（lib.upload）
+每种方式在独立子进程中运行，避免互相影响。
+
+用法: python bench/bench_upload.py --concurrency 32 --size 16
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# lib.api 导入时检查必填环境变量，压测不访问 Discord，填入占位值
+for name in ("GUILD_ID", "CHANNEL_ID", "USER_TOKEN", "DRAW_VERSION"):
+    os.environ.setdefault(name, "bench")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def make_app():
+    from aiohttp import web
+
+    async def handler(request: web.Request) -> web.Response:
+        expected = request.content_length
+        received = 0
+        async for chunk in request.content.iter_chunked(256 * 1024):
+            received += len(chunk)
+        if expected is not None and received != expected:
+            return web.Response(status=400)
+        return web.Response(status=200)
+
+    app = web.Application(client_max_size=1 << 31)
+    app.router.add_put("/upload/{name}", handler)
+    return app
+
+
+def make_upload_file(path: str, size: int):
+    """构造与 FastAPI 收到的请求一致的 UploadFile（超过阈值后落盘的 SpooledTemporaryFile）"""
+    from fastapi import UploadFile
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            spooled.write(chunk)
+    spooled.seek(0)
+    return UploadFile(file=spooled, size=size, filename=os.path.basename(path))
+
+
+async def measure(mode: str, concurrency: int, source: str, port: int):
+    from aiohttp import web
+
+    from lib.api import discord
+    from lib.upload import open_upload_stream
+
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    size = os.path.getsize(source)
+    files = [make_upload_file(source, size) for _ in range(concurrency)]
+    baseline = rss_mb()
+    peak = baseline
+    done = False
+
+    async def sample():
+        nonlocal peak
+        while not done:
+            peak = max(peak, rss_mb())
+            await asyncio.sleep(0.005)
+
+    async def upload(index: int, file):
+        url = f"http://127.0.0.1:{port}/upload/{index}.png"
+        if mode == "buffered":
+            return await discord.put_attachment(url, await file.read())
+        return await discord.put_attachment(url, open_upload_stream(file), size)
+
+    sampler = asyncio.get_running_loop().create_task(sample())
+    begin = time.perf_counter()
+    results = await asyncio.gather(*(upload(i, f) for i, f in enumerate(files)))
+    elapsed = time.perf_counter() - begin
+    done = True
+    await sampler
+    await runner.cleanup()
+
+    ok = sum(1 for r in results if r)
+    print(f"{mode:<8} concurrency={concurrency} size={size / 1024 / 1024:.0f}MB: "
+          f"成功 {ok}/{concurrency}, 峰值 RSS 增量 {peak - baseline:.0f} MB, 耗时 {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--size", type=int, default=16, help="单个文件大小（MB）")
+    parser.add_argument("--port", type=int, default=18089)
+    parser.add_argument("--mode", choices=["buffered", "stream"], help="内部使用：单独运行一种方式")
+    parser.add_argument("--source")
+    args = parser.parse_args()
+
+    if args.mode:
+        asyncio.run(measure(args.mode, args.concurrency, args.source, args.port))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "upload.png")
+        with open(source, "wb") as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        for mode in ("buffered", "stream"):
+            subprocess.run([
+                sys.executable, __file__, "--mode", mode, "--source", source,
+                "--concurrency", str(args.concurrency), "--port", str(args.port),
+            ], check=True)
+
+
+if __name__ == "__main__":
+    main()
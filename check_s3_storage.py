@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+S3 存储后端检查脚本
+对 S3 兼容服务（MinIO 等）执行一遍存储接口，验证 SigV4 签名、分片上传、流式读取与预签名地址
+
+先在 .env 中配置 S3_ENDPOINT / S3_BUCKET / S3_ACCESS_KEY / S3_SECRET_KEY（bucket 需已存在），例如本地 MinIO:
+  docker run -p 9000:9000 minio/minio server /data
+用法: python check_s3_storage.py
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import uuid
+
+import aiohttp
+from dotenv import load_dotenv
+load_dotenv()
+
+import __init__  # noqa
+from lib.storage import (
+    S3_ACCESS_KEY, S3_BUCKET, S3_ENDPOINT, S3_PREFIX, S3_PUBLIC_BASE_URL, S3_REGION, S3_SECRET_KEY,
+)
+from lib.storage.s3 import S3Storage
+
+# S3 要求除最后一片外每片至少 5MB
+PART_SIZE = 5 * 1024 * 1024
+
+
+def create(secret_key: str = S3_SECRET_KEY) -> S3Storage:
+    return S3Storage(
+        endpoint=S3_ENDPOINT,
+        bucket=S3_BUCKET,
+        access_key=S3_ACCESS_KEY,
+        secret_key=secret_key,
+        region=S3_REGION,
+        public_base_url=S3_PUBLIC_BASE_URL,
+        presign_expires=300,
+        part_size=PART_SIZE,
+        upload_concurrency=2,
+        prefix=S3_PREFIX,
+    )
+
+
+async def read_all(storage: S3Storage, key: str) -> bytes:
+    return b"".join([chunk async for chunk in storage.stream(key)])
+
+
+async def check(storage: S3Storage, keys: list):
+    run = uuid.uuid4().hex[:8]
+
+    # 1. 单次上传
+    key = f"check/{run}/small.png"
+    keys.append(key)
+    data = os.urandom(1024)
+    await storage.put_bytes(key, data, content_type="image/png")
+    assert await storage.size(key) == len(data), "size 不一致"
+    assert await read_all(storage, key) == data, "stream 内容不一致"
+    print("✅ put_bytes / size / stream")
+
+    # 2. 分片上传（3 片），move=True 后本地文件应被删除
+    key = f"check/{run}/large.png"
+    keys.append(key)
+    fd, path = tempfile.mkstemp(suffix=".png")
+    with os.fdopen(fd, "wb") as f:
+        f.write(os.urandom(PART_SIZE * 2 + 12345))
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    await storage.put_file(key, path, content_type="image/png", move=True)
+    assert not os.path.exists(path), "move=True 未删除本地文件"
+    assert hashlib.sha256(await read_all(storage, key)).hexdigest() == digest, "分片上传内容不一致"
+    print("✅ put_file 分片上传")
+
+    # 3. 预签名地址不带凭证直接访问
+    async with aiohttp.ClientSession() as session:
+        async with session.get(await storage.presign_url(keys[0])) as resp:
+            assert resp.status == 200, f"预签名地址访问失败: HTTP {resp.status}"
+            assert await resp.read() == data, "预签名地址内容不一致"
+    print("✅ presign_url")
+
+    # 4. 错误的密钥必须被服务端拒绝，确认服务端确实校验了签名
+    wrong = create(S3_SECRET_KEY + "x")
+    try:
+        try:
+            await wrong.put_bytes(f"check/{run}/denied.png", b"x")
+        except IOError as e:
+            print(f"✅ 错误密钥被拒绝: {str(e).splitlines()[0][:80]}")
+        else:
+            raise AssertionError("错误密钥的请求被接受，服务端未校验签名")
+    finally:
+        await wrong.close()
+
+
+async def main():
+    if not all([S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY]):
+        print("❌ 缺少 S3_ENDPOINT / S3_BUCKET / S3_ACCESS_KEY / S3_SECRET_KEY")
+        sys.exit(1)
+
+    storage = create()
+    keys = []
+    try:
+        await check(storage, keys)
+        print("🎉 S3 存储后端检查通过")
+    except AssertionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        for key in keys:
+            async with await storage._request("DELETE", key):
+                pass
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,6 +5,10 @@ if [ "$1" = 'http' ]; then
   set -- python server.py
 fi
 
+if [ "$1" = 'all' ]; then
+  set -- python server_bot.py
+fi
+
 if [ "$1" = 'bot' ]; then
   set -- python task_bot.py "$@"
 fi
@@ -8,6 +8,8 @@ class ErrorCode(Enum):
     REQUEST_PARAMS_ERROR = 13
     BANNED_PROMPT_ERROR = 14
     QUEUE_FULL_ERROR = 15
+    DOWNLOAD_ERROR = 16
+    UPLOAD_TOO_LARGE_ERROR = 17
 
 
 class SuccessCode(Enum):
@@ -49,3 +51,13 @@ class BannedPromptError(APPBaseException):
 class QueueFullError(APPBaseException):
     """队列已满"""
     code = ErrorCode.QUEUE_FULL_ERROR
+
+
+class DownloadError(APPBaseException):
+    """文件下载失败"""
+    code = ErrorCode.DOWNLOAD_ERROR
+
+
+class UploadTooLargeError(APPBaseException):
+    """上传文件超过大小限制"""
+    code = ErrorCode.UPLOAD_TOO_LARGE_ERROR
@@ -1,37 +1,90 @@
 from os import getenv
+from typing import Any, Awaitable, Callable, Dict, Optional
 
-import aiohttp
 from loguru import logger
 
 from lib.api import CALLBACK_URL
-from util.fetch import fetch
+from lib.api.outbox import outbox
+from lib.eventbus import EVENTBUS_DESTINATION, EVENTBUS_LINGER_MS, EVENTBUS_MAX_BATCH, eventbus_client
+
+# 配置为 API 的 /midjourney/results 时，结果事件合并后批量投递，代替逐条 POST 到 CALLBACK_URL
+CALLBACK_BATCH_URL = getenv("CALLBACK_BATCH_URL")
+# 客户的 CALLBACK_URL 按窗口合并为 {"events": [...]} 批量推送，同一任务的生成进度只保留最新一条
+CALLBACK_BATCH = (getenv("CALLBACK_BATCH") or "false").lower() in ("1", "true", "yes")
+CALLBACK_BATCH_LINGER_MS = int(getenv("CALLBACK_BATCH_LINGER_MS") or 1000)
+# 批量请求体使用 gzip 压缩（接收方需支持 Content-Encoding: gzip，本服务 API 已支持）
+CALLBACK_GZIP = (getenv("CALLBACK_GZIP") or "false").lower() in ("1", "true", "yes")
+
+if CALLBACK_BATCH_URL:
+    outbox.enable_batch(CALLBACK_BATCH_URL, compress=CALLBACK_GZIP)
+if CALLBACK_BATCH and CALLBACK_URL:
+    outbox.enable_batch(CALLBACK_URL, linger_ms=CALLBACK_BATCH_LINGER_MS, compress=CALLBACK_GZIP)
+if eventbus_client is not None:
+    outbox.enable_batch(EVENTBUS_DESTINATION, linger_ms=EVENTBUS_LINGER_MS, max_batch=EVENTBUS_MAX_BATCH)
+    outbox.register_transport(EVENTBUS_DESTINATION, eventbus_client.send)
+
+# 单进程模式下由 API 注册的本地处理函数，注册后不再走 HTTP 回调；
+# 事件同样先写入发件箱日志，处理函数抛出异常时按退避重试，超过次数移入死信
+LOCAL_CALLBACK = "local://callback"
+LOCAL_RELEASE = "local://release"
+_local_handlers = False
+
+
+def register_local_handlers(
+        callback_handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        release_handler: Callable[[Dict[str, Any]], Awaitable[Any]]
+):
+    """bot 与 API 运行在同一事件循环时，回调与队列释放直接调用处理函数"""
+    global _local_handlers
+    outbox.register_transport(LOCAL_CALLBACK, callback_handler)
+    outbox.register_transport(LOCAL_RELEASE, release_handler)
+    _local_handlers = True
+
+
+def unregister_local_handlers():
+    global _local_handlers
+    outbox.unregister_transport(LOCAL_CALLBACK)
+    outbox.unregister_transport(LOCAL_RELEASE)
+    _local_handlers = False
 
 
 async def callback(data):
     logger.debug(f"callback data: {data}")
+    if _local_handlers:
+        await outbox.put(LOCAL_CALLBACK, data)
+        return
+
+    # 配置了事件通道时经长连接批量发送
+    if eventbus_client is not None:
+        await outbox.put(EVENTBUS_DESTINATION, {"kind": "callback", "data": data})
+        return
+
+    if CALLBACK_BATCH_URL:
+        await outbox.put(CALLBACK_BATCH_URL, data)
+        return
+
     logger.debug(f"CALLBACK_URL : {CALLBACK_URL}")
     if not CALLBACK_URL:
         return
 
-    headers = {"Content-Type": "application/json"}
-    async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            headers=headers
-    ) as session:
-        await fetch(session, CALLBACK_URL, json=data)
+    # 放入发件箱后立即返回，不阻塞 discord 事件处理
+    await outbox.put(CALLBACK_URL, data)
 
 
 QUEUE_RELEASE_API = getenv("QUEUE_RELEASE_API") \
                     or "http://127.0.0.1:8062/v1/api/trigger/queue/release"
 
 
-async def queue_release(trigger_id: str):
+async def queue_release(trigger_id: str, msg_id: Optional[int] = None):
+    """释放任务的并发队列位置；msg_id 为触发释放的消息，重复投递时由 API 去重"""
     logger.debug(f"queue_release: {trigger_id}")
+    data = {"trigger_id": trigger_id, "msg_id": msg_id}
+    if _local_handlers:
+        await outbox.put(LOCAL_RELEASE, data)
+        return
+
+    if eventbus_client is not None:
+        await outbox.put(EVENTBUS_DESTINATION, {"kind": "release", "data": data})
+        return
 
-    headers = {"Content-Type": "application/json"}
-    data = {"trigger_id": trigger_id}
-    async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            headers=headers
-    ) as session:
-        await fetch(session, QUEUE_RELEASE_API, json=data)
+    await outbox.put(QUEUE_RELEASE_API, data)
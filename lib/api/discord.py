@@ -1,15 +1,16 @@
 import json
 from enum import Enum
-from typing import Dict, Any, Union
+from typing import Dict, Any, AsyncIterator, Callable, List, Union
 
 import aiohttp
 
 from lib.api import CHANNEL_ID, USER_TOKEN, GUILD_ID, DRAW_VERSION, PROXY_URL
-from util.fetch import fetch, fetch_json, FetchMethod
+from util.fetch import fetch, fetch_json, FetchMethod, MaxRetry
 
 TRIGGER_URL = "https://discord.com/api/v9/interactions"
 UPLOAD_ATTACHMENT_URL = f"https://discord.com/api/v9/channels/{CHANNEL_ID}/attachments"
 SEND_MESSAGE_URL = f"https://discord.com/api/v9/channels/{CHANNEL_ID}/messages"
+REFRESH_URLS_URL = "https://discord.com/api/v9/attachments/refresh-urls"
 HEADERS = {
     "Content-Type": "application/json",
     "Authorization": USER_TOKEN
@@ -38,8 +39,12 @@ async def trigger(payload: Dict[str, Any]):
         return await fetch(session, TRIGGER_URL, data=json.dumps(payload), proxy=PROXY_URL)
 
 
+# 上传内容：完整字节，或每次调用返回新迭代器的工厂函数（重试时需要重新读取）
+UploadBody = Union[bytes, Callable[[], AsyncIterator[bytes]]]
+
+
 async def upload_attachment(
-        filename: str, file_size: int, image: bytes
+        filename: str, file_size: int, image: UploadBody
 ) -> Union[Dict[str, Union[str, int]], None]:
     payload = {
         "files": [{
@@ -58,16 +63,29 @@ async def upload_attachment(
 
         attachment = response["attachments"][0]
 
-    response = await put_attachment(attachment.get("upload_url"), image)
+    response = await put_attachment(attachment.get("upload_url"), image, file_size)
     return attachment if response is not None else None
 
 
-async def put_attachment(url: str, image: bytes):
+@MaxRetry(2)
+async def _put_stream(session: aiohttp.ClientSession, url: str, open_stream: Callable[[], AsyncIterator[bytes]]):
+    async with session.put(url, data=open_stream()) as resp:
+        if not resp.ok:
+            return None
+        return True
+
+
+async def put_attachment(url: str, image: UploadBody, file_size: int = None):
     headers = {"Content-Type": "image/png"}
+    if callable(image):
+        # 异步迭代器默认使用 chunked 编码，上传地址需要明确的 Content-Length
+        headers["Content-Length"] = str(file_size)
     async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30),
             headers=headers
     ) as session:
+        if callable(image):
+            return await _put_stream(session, url, image)
         return await fetch(session, url, data=image, method=FetchMethod.put)
 
 
@@ -96,6 +114,23 @@ async def send_attachment_message(upload_filename: str) -> Union[str, None]:
         return attachment.get("url")
 
 
+async def refresh_attachment_urls(urls: List[str]) -> Dict[str, str]:
+    """刷新已过期的附件签名地址，返回 {原地址: 新地址}"""
+    payload = {"attachment_urls": urls}
+    async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            headers=HEADERS
+    ) as session:
+        response = await fetch_json(session, REFRESH_URLS_URL, data=json.dumps(payload), proxy=PROXY_URL)
+        if not response:
+            return {}
+
+        return {
+            item.get("original"): item.get("refreshed")
+            for item in response.get("refreshed_urls", [])
+        }
+
+
 def _trigger_payload(type_: int, data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
     payload = {
         "type": type_,
@@ -0,0 +1,156 @@
+import json
+import sqlite3
+import threading
+import time
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+# bot 待发送回调的本地日志，进程重启后继续投递
+OUTBOX_JOURNAL = getenv("OUTBOX_JOURNAL") or "outbox.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox_event (next_attempt);
+CREATE TABLE IF NOT EXISTS outbox_dead_letter (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class OutboxJournal:
+    """
+    回调发件箱的 SQLite 日志
+
+    事件先追加到 outbox_event，投递成功后删除；多次失败或目标地址明确拒绝的事件
+    移入 outbox_dead_letter，可通过 manage_outbox.py 查看与重新投递。
+    每次写入都在单独的事务中提交，WAL 模式下开销在毫秒以内。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def append(self, url: str, payload: Dict[str, Any]) -> int:
+        with self._lock:
+            cursor = self._get_conn().execute(
+                "INSERT INTO outbox_event (url, payload, created_at) VALUES (?, ?, ?)",
+                (url, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return cursor.lastrowid
+
+    def ack(self, event_ids: List[int]):
+        with self._lock:
+            self._get_conn().execute(
+                f"DELETE FROM outbox_event WHERE id IN ({','.join('?' * len(event_ids))})", tuple(event_ids)
+            )
+
+    def reschedule(self, event_id: int, attempts: int, next_attempt: float, error: str):
+        with self._lock:
+            self._get_conn().execute(
+                "UPDATE outbox_event SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt, error, event_id),
+            )
+
+    def bury(self, event_id: int, attempts: int, error: str):
+        """移入死信表"""
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT OR REPLACE INTO outbox_dead_letter "
+                "(id, url, payload, attempts, last_error, created_at, failed_at) "
+                "SELECT id, url, payload, ?, ?, created_at, ? FROM outbox_event WHERE id = ?",
+                (attempts, error, time.time(), event_id),
+            )
+            conn.execute("DELETE FROM outbox_event WHERE id = ?", (event_id,))
+            conn.execute("COMMIT")
+
+    def due(self, exclude: List[int], limit: int) -> List[Dict[str, Any]]:
+        """到期待投递的事件，按写入顺序"""
+        with self._lock:
+            rows = self._get_conn().execute(
+                "SELECT id, url, payload, attempts FROM outbox_event "
+                "WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                (time.time(), limit + len(exclude)),
+            ).fetchall()
+        skip = set(exclude)
+        events = [
+            {"id": row["id"], "url": row["url"], "payload": json.loads(row["payload"]), "attempts": row["attempts"]}
+            for row in rows if row["id"] not in skip
+        ]
+        return events[:limit]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._get_conn().execute("SELECT COUNT(*) FROM outbox_event").fetchone()[0]
+
+    def dead_count(self) -> int:
+        with self._lock:
+            return self._get_conn().execute("SELECT COUNT(*) FROM outbox_dead_letter").fetchone()[0]
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._get_conn().execute(
+                "SELECT * FROM outbox_dead_letter ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def replay(self, event_ids: Optional[List[int]] = None) -> int:
+        """把死信重新放回待投递队列，不传 event_ids 时重放全部"""
+        where, params = "", ()
+        if event_ids:
+            where = f" WHERE id IN ({','.join('?' * len(event_ids))})"
+            params = tuple(event_ids)
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN")
+            cursor = conn.execute(
+                "INSERT INTO outbox_event (url, payload, created_at) "
+                f"SELECT url, payload, created_at FROM outbox_dead_letter{where} ORDER BY id",
+                params,
+            )
+            conn.execute(f"DELETE FROM outbox_dead_letter{where}", params)
+            conn.execute("COMMIT")
+            return cursor.rowcount
+
+    def purge(self, event_ids: Optional[List[int]] = None) -> int:
+        where, params = "", ()
+        if event_ids:
+            where = f" WHERE id IN ({','.join('?' * len(event_ids))})"
+            params = tuple(event_ids)
+        with self._lock:
+            return self._get_conn().execute(f"DELETE FROM outbox_dead_letter{where}", params).rowcount
+
+
+journal = OutboxJournal(OUTBOX_JOURNAL)
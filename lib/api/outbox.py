@@ -0,0 +1,427 @@
+import asyncio
+import gzip
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from loguru import logger
+
+from lib.api.journal import OutboxJournal, journal
+
+OUTBOX_WORKERS = int(getenv("OUTBOX_WORKERS") or 4)
+OUTBOX_QUEUE_SIZE = int(getenv("OUTBOX_QUEUE_SIZE") or 1000)
+OUTBOX_PER_DESTINATION = int(getenv("OUTBOX_PER_DESTINATION") or 2)
+OUTBOX_MAX_RETRY = int(getenv("OUTBOX_MAX_RETRY") or 10)
+OUTBOX_MAX_BACKOFF = float(getenv("OUTBOX_MAX_BACKOFF") or 300)
+OUTBOX_TIMEOUT = float(getenv("OUTBOX_TIMEOUT") or 10)
+# 批量地址每次最多合并的事件数，以及默认的合并窗口（毫秒）
+OUTBOX_MAX_BATCH = int(getenv("OUTBOX_MAX_BATCH") or 100)
+OUTBOX_LINGER_MS = int(getenv("OUTBOX_LINGER_MS") or 20)
+# bot 进程没有 HTTP 接口，定期把队列指标写入日志
+OUTBOX_STATS_INTERVAL = int(getenv("OUTBOX_STATS_INTERVAL") or 60)
+
+# 目标地址明确拒绝的请求重试也不会成功，直接移入死信
+RETRYABLE_STATUS = (408, 425, 429)
+# 小于该大小的请求体压缩收益不大
+GZIP_MIN_BYTES = 1024
+
+# 不经 HTTP 的投递方式（进程内处理函数、事件通道），返回值等同于响应 JSON，抛出异常视为可重试的失败
+Transport = Callable[[Any], Awaitable[Any]]
+
+
+class OutboxItem:
+    __slots__ = ("event_id", "url", "payload", "attempt")
+
+    def __init__(self, event_id: int, url: str, payload: Dict[str, Any], attempt: int = 0) -> None:
+        self.event_id = event_id
+        self.url = url
+        self.payload = payload
+        self.attempt = attempt
+
+
+def coalesce(items: List[OutboxItem]) -> Tuple[List[OutboxItem], List[OutboxItem]]:
+    """同一 trigger 的 generating 事件只保留最新一条，返回 (保留, 被取代)，保留的事件顺序不变"""
+    latest: Dict[str, int] = {}
+    for index, item in enumerate(items):
+        if item.payload.get("type") == "generating" and item.payload.get("trigger_id"):
+            latest[item.payload["trigger_id"]] = index
+    kept, superseded = [], []
+    for index, item in enumerate(items):
+        if item.payload.get("type") == "generating" and latest.get(item.payload.get("trigger_id"), index) != index:
+            superseded.append(item)
+        else:
+            kept.append(item)
+    return kept, superseded
+
+
+class Outbox:
+    """
+    bot 回调发件箱
+
+    on_message / on_message_edit 只把回调写入本地日志并放入有界队列后立即返回，
+    由 N 个 worker 通过共享的长连接 session 发送，每个目标地址有独立的并发上限。
+    投递至少一次：成功后才从日志删除，失败按指数退避重新调度，
+    超过重试次数或被目标地址拒绝（4xx）的事件移入死信表。
+    内存中事件已满或进程重启时，未投递的事件由补充任务从日志中按顺序取回。
+
+    开启批量的地址按目标地址缓冲事件，合并窗口结束或达到 max_batch 时以 {"events": [...]} 一次发送，
+    同一 trigger 的 generating 事件只发送最新一条，可选 gzip 压缩请求体。
+
+    通过 register_transport 注册的地址（如 local://callback）不发 HTTP 请求，而是调用对应的投递函数，
+    同样经过日志、重试与死信。
+    """
+
+    def __init__(self, journal: OutboxJournal, workers: int, queue_size: int, per_destination: int,
+                 max_retry: int, max_backoff: float, timeout: float,
+                 max_batch: int = 100, linger_ms: int = 20) -> None:
+        self._journal = journal
+        self._workers = workers
+        self._queue_size = queue_size
+        self._per_destination = per_destination
+        self._max_retry = max_retry
+        self._max_backoff = max_backoff
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._max_batch = max_batch
+        self._linger_ms = linger_ms
+        self._batch_urls: Dict[str, Dict[str, Any]] = {}  # 地址 -> {"linger": 秒, "gzip": bool, "max_batch": int}
+        self._transports: Dict[str, Transport] = {}
+        self._buffers: Dict[str, List[OutboxItem]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flushing: Set[asyncio.Task] = set()
+        # SQLite 写入放在单线程中按顺序执行，不阻塞 discord 事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-journal")
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[int] = set()  # 已在内存队列、缓冲区或投递中的事件 ID
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._destinations: Dict[str, Dict[str, Any]] = {}
+        self._metrics = {
+            "enqueued": 0,
+            "delivered": 0,
+            "coalesced": 0,
+            "retried": 0,
+            "batches": 0,
+            "dead": 0,
+            "overflow": 0,
+            "in_flight": 0,
+            "max_depth": 0,
+            "bytes_raw": 0,
+            "bytes_sent": 0,
+        }
+
+    def start(self):
+        """启动 worker，并从日志中恢复上次未投递的事件"""
+        if self._tasks:
+            return
+        # 内存中的事件总数由 _queued 限制，队列本身不设上限
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self._workers)]
+        self._tasks.append(loop.create_task(self._refill()))
+        self._tasks.append(loop.create_task(self._report()))
+        logger.info(f"📮 回调发件箱已启动 - worker: {self._workers}, 队列长度: {self._queue_size}, "
+                    f"日志: {self._journal.path}")
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._buffers.clear()
+        tasks = [*self._tasks, *self._flushing]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queued.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run_journal(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=self._workers * 2, keepalive_timeout=60),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._session
+
+    def enable_batch(self, url: str, linger_ms: Optional[int] = None, compress: bool = False,
+                     max_batch: Optional[int] = None):
+        """
+        该地址接受 {"events": [...]} 批量请求，响应中可带与 events 顺序一致的 results，
+        值为 "error" 的事件会重新投递
+        """
+        linger_ms = self._linger_ms if linger_ms is None else linger_ms
+        self._batch_urls[url] = {
+            "linger": linger_ms / 1000,
+            "gzip": compress,
+            "max_batch": max_batch or self._max_batch,
+        }
+
+    def register_transport(self, url: str, transport: Transport):
+        """该地址的事件交给 transport(payload) 投递，不发 HTTP 请求"""
+        self._transports[url] = transport
+
+    def unregister_transport(self, url: str):
+        self._transports.pop(url, None)
+
+    async def put(self, url: str, payload: Dict[str, Any]) -> int:
+        """写入日志后投递，返回事件 ID；内存中事件已满时留在日志中等待补充任务取回"""
+        if not self._tasks:
+            self.start()
+        event_id = await self._run_journal(self._journal.append, url, payload)
+        self._metrics["enqueued"] += 1
+        self._enqueue(OutboxItem(event_id, url, payload))
+        return event_id
+
+    def _enqueue(self, item: OutboxItem) -> bool:
+        if item.event_id in self._queued:
+            return True
+        # 队列、缓冲区与投递中的事件合计不超过 queue_size
+        if len(self._queued) >= self._queue_size:
+            self._metrics["overflow"] += 1
+            return False
+        self._queue.put_nowait(item)
+        self._queued.add(item.event_id)
+        self._metrics["max_depth"] = max(self._metrics["max_depth"], self._queue.qsize())
+        return True
+
+    async def _refill(self):
+        """把日志中到期（重试或溢出）的事件放回内存队列"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            room = self._queue_size - len(self._queued)
+            if room <= 0:
+                continue
+            try:
+                events = await self._run_journal(self._journal.due, list(self._queued), room)
+            except Exception as e:
+                logger.error(f"❌ 读取回调日志失败: {e}")
+                continue
+            for event in events:
+                if not self._enqueue(OutboxItem(event["id"], event["url"], event["payload"], event["attempts"])):
+                    break
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                if item.url in self._batch_urls:
+                    # 批量地址只放入缓冲区，合并窗口结束后由发送任务投递
+                    self._buffer(item)
+                    continue
+                try:
+                    await self._deliver(item)
+                finally:
+                    self._queued.discard(item.event_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 回调发送异常: {item.url} - {e}")
+            finally:
+                self._queue.task_done()
+
+    def _buffer(self, item: OutboxItem):
+        buffer = self._buffers.setdefault(item.url, [])
+        buffer.append(item)
+        if len(buffer) >= self._batch_urls[item.url]["max_batch"]:
+            self._flush(item.url)
+        elif len(buffer) == 1:
+            linger = self._batch_urls[item.url]["linger"]
+            self._timers[item.url] = asyncio.get_running_loop().call_later(linger, self._flush, item.url)
+
+    def _flush(self, url: str):
+        timer = self._timers.pop(url, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._buffers.pop(url, None)
+        if not items:
+            return
+        task = asyncio.get_running_loop().create_task(self._deliver_batch(url, items))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    def _get_destination(self, url: str):
+        semaphore = self._semaphores.get(url)
+        if semaphore is None:
+            semaphore = self._semaphores[url] = asyncio.Semaphore(self._per_destination)
+        stats = self._destinations.setdefault(url, {"delivered": 0, "dead": 0, "batches": 0, "latency_ms": 0.0})
+        return semaphore, stats
+
+    async def _post(self, url: str, payload: Any, compress: bool = False) -> Tuple[bool, bool, Optional[str], Any]:
+        """返回 (是否成功, 失败是否可重试, 错误信息, 响应 JSON)"""
+        if url in self._transports or not url.startswith(("http://", "https://")):
+            return await self._call(url, payload)
+
+        semaphore, stats = self._get_destination(url)
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._metrics["bytes_raw"] += len(data)
+        headers = None
+        if compress and len(data) >= GZIP_MIN_BYTES:
+            data = gzip.compress(data, compresslevel=5)
+            headers = {"Content-Encoding": "gzip"}
+        self._metrics["bytes_sent"] += len(data)
+
+        ok, retryable, error, body = False, True, None, None
+        async with semaphore:
+            self._metrics["in_flight"] += 1
+            started = time.perf_counter()
+            try:
+                async with self._get_session().post(url, data=data, headers=headers) as resp:
+                    ok = resp.ok
+                    if ok:
+                        body = await resp.json(content_type=None)
+                    else:
+                        error = f"HTTP {resp.status}"
+                        retryable = resp.status >= 500 or resp.status in RETRYABLE_STATUS
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e.__class__.__name__
+            except ValueError:
+                # 响应不是 JSON 不影响投递结果
+                pass
+            finally:
+                self._metrics["in_flight"] -= 1
+                stats["latency_ms"] = (time.perf_counter() - started) * 1000
+        return ok, retryable, error, body
+
+    async def _call(self, url: str, payload: Any) -> Tuple[bool, bool, Optional[str], Any]:
+        """经注册的 transport 投递，返回值与 _post 相同"""
+        transport = self._transports.get(url)
+        if transport is None:
+            # 例如进程以其他模式重启后留在日志中的进程内事件，重试耗尽后进入死信，可重放
+            return False, True, "no transport", None
+
+        semaphore, stats = self._get_destination(url)
+        async with semaphore:
+            self._metrics["in_flight"] += 1
+            started = time.perf_counter()
+            try:
+                body = await asyncio.wait_for(transport(payload), self._timeout.total)
+                return True, True, None, body
+            except asyncio.TimeoutError:
+                return False, True, "TimeoutError", None
+            except Exception as e:
+                return False, True, f"{e.__class__.__name__}: {e}", None
+            finally:
+                self._metrics["in_flight"] -= 1
+                stats["latency_ms"] = (time.perf_counter() - started) * 1000
+
+    async def _deliver(self, item: OutboxItem):
+        item.attempt += 1
+        ok, retryable, error, _ = await self._post(item.url, item.payload)
+        if ok:
+            await self._run_journal(self._journal.ack, [item.event_id])
+            self._record_delivered(item.url, 1)
+        else:
+            await self._fail(item, retryable, error)
+
+    async def _deliver_batch(self, url: str, items: List[OutboxItem]):
+        try:
+            await self._send_batch(url, items)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 批量回调发送异常: {url} - {e}")
+        finally:
+            for item in items:
+                self._queued.discard(item.event_id)
+
+    async def _send_batch(self, url: str, items: List[OutboxItem]):
+        items, superseded = coalesce(items)
+        if superseded:
+            # 已被同一 trigger 更新的进度取代，无需发送
+            await self._run_journal(self._journal.ack, [item.event_id for item in superseded])
+            self._metrics["coalesced"] += len(superseded)
+
+        for item in items:
+            item.attempt += 1
+        ok, retryable, error, body = await self._post(
+            url, {"events": [item.payload for item in items]}, self._batch_urls[url]["gzip"]
+        )
+        self._metrics["batches"] += 1
+        self._destinations[url]["batches"] += 1
+        if not ok:
+            for item in items:
+                await self._fail(item, retryable, error)
+            return
+
+        results = body.get("results") if isinstance(body, dict) else None
+        if not isinstance(results, list) or len(results) != len(items):
+            results = ["success"] * len(items)
+        delivered = [item for item, status in zip(items, results) if status != "error"]
+        if delivered:
+            await self._run_journal(self._journal.ack, [item.event_id for item in delivered])
+            self._record_delivered(url, len(delivered))
+        for item, status in zip(items, results):
+            if status == "error":
+                await self._fail(item, True, "event error")
+
+    def _record_delivered(self, url: str, count: int):
+        self._metrics["delivered"] += count
+        self._destinations[url]["delivered"] += count
+
+    async def _fail(self, item: OutboxItem, retryable: bool, error: Optional[str]):
+        if retryable and item.attempt <= self._max_retry:
+            self._metrics["retried"] += 1
+            delay = min(2 ** item.attempt, self._max_backoff) * (0.5 + random.random() / 2)
+            await self._run_journal(self._journal.reschedule, item.event_id, item.attempt, time.time() + delay, error)
+            logger.warning(f"🔁 回调发送失败（{error}），{delay:.1f}s 后重试: {item.url} #{item.event_id}")
+            return
+
+        await self._run_journal(self._journal.bury, item.event_id, item.attempt, error)
+        self._metrics["dead"] += 1
+        self._destinations[item.url]["dead"] += 1
+        logger.error(f"❌ 回调发送失败，已移入死信: {item.url} #{item.event_id} - {error}")
+
+    async def _report(self):
+        last_enqueued = -1
+        while True:
+            await asyncio.sleep(OUTBOX_STATS_INTERVAL)
+            if self._metrics["enqueued"] == last_enqueued:
+                continue
+            last_enqueued = self._metrics["enqueued"]
+            status = self.get_status()
+            status.pop("destinations")
+            status["journal_pending"] = await self._run_journal(self._journal.pending_count)
+            status["dead_letters"] = await self._run_journal(self._journal.dead_count)
+            logger.info(f"📮 回调发件箱状态: {status}")
+
+    def get_status(self):
+        return {
+            "workers": self._workers,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self._queue_size,
+            "in_memory": len(self._queued),
+            "buffered": sum(len(items) for items in self._buffers.values()),
+            **self._metrics,
+            "destinations": self._destinations,
+        }
+
+
+outbox = Outbox(
+    journal,
+    workers=OUTBOX_WORKERS,
+    queue_size=OUTBOX_QUEUE_SIZE,
+    per_destination=OUTBOX_PER_DESTINATION,
+    max_retry=OUTBOX_MAX_RETRY,
+    max_backoff=OUTBOX_MAX_BACKOFF,
+    timeout=OUTBOX_TIMEOUT,
+    max_batch=OUTBOX_MAX_BATCH,
+    linger_ms=OUTBOX_LINGER_MS,
+)
@@ -40,11 +40,17 @@ midjourney_task = Table(
     Column("result_url", Text, nullable=True),
     Column("attachments", Text, nullable=True),
     Column("prompts", Text, nullable=True),
+    Column("preview_url", Text, nullable=True),
+    Column("progress", Integer, default=0),
+    Column("app_key", String(64), nullable=False, default=""),
+    Column("callback_url", String(512), nullable=False, default=""),
+    Column("callback_images", String(16), nullable=False, default=""),
     Column("created_at", DateTime, default=func.now()),
     Column("updated_at", DateTime, default=func.now(), onupdate=func.now()),
     # 索引
     Index("unq_task_id", "task_id", unique=True),
     Index("idx_trigger_id", "trigger_id"),
+    Index("idx_app_key_created", "app_key", "created_at"),
 )
 
 # 定义 user_info 表结构
@@ -56,6 +62,7 @@ user_info = Table(
     Column("app_key", String(64), nullable=False, default=""),
     Column("token_total", Integer, default=0),
     Column("token_use", Integer, default=0),
+    Column("callback_url", String(512), nullable=False, default=""),
     Column("created_at", DateTime, default=func.now()),
     Column("updated_at", DateTime, default=func.now(), onupdate=func.now()),
     # 索引
@@ -63,6 +70,28 @@ user_info = Table(
     Index("uiq_app_key", "app_key", unique=True),
 )
 
+# 定义 image_phash 表结构：切图的 64 位 dHash，拆成 4 段 16 位分别建索引（多索引哈希）
+image_phash = Table(
+    "image_phash",
+    metadata,
+    Column("id", BigInteger, primary_key=True, autoincrement=True),
+    Column("task_id", String(64), nullable=False, default=""),
+    Column("image_index", Integer, default=0),
+    Column("image_url", Text, nullable=True),
+    Column("phash", String(16), nullable=False, default=""),
+    Column("chunk0", Integer, nullable=False, default=0),
+    Column("chunk1", Integer, nullable=False, default=0),
+    Column("chunk2", Integer, nullable=False, default=0),
+    Column("chunk3", Integer, nullable=False, default=0),
+    Column("created_at", DateTime, default=func.now()),
+    # 索引
+    Index("uiq_task_image", "task_id", "image_index", unique=True),
+    Index("idx_chunk0", "chunk0"),
+    Index("idx_chunk1", "chunk1"),
+    Index("idx_chunk2", "chunk2"),
+    Index("idx_chunk3", "chunk3"),
+)
+
 
 async def connect_db():
     """连接数据库"""
@@ -3,7 +3,9 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 from loguru import logger
 
-from .database import database, midjourney_task, user_info
+from sqlalchemy import or_, select
+
+from .database import database, midjourney_task, user_info, image_phash
 
 
 class MidjourneyTaskOperations:
@@ -22,7 +24,10 @@ class MidjourneyTaskOperations:
         msg_hash: str = "",
         zoom_out: int = 0,
         direction: str = "",
-        task_status: str = "NOT_START"
+        task_status: str = "NOT_START",
+        app_key: str = "",
+        callback_url: str = "",
+        callback_images: str = ""
     ) -> int:
         """创建新任务"""
         try:
@@ -39,6 +44,9 @@ class MidjourneyTaskOperations:
                 task_type=task_type,
                 task_status=task_status,
                 prompts=prompts,
+                app_key=app_key,
+                callback_url=callback_url or "",
+                callback_images=callback_images or "",
                 created_at=datetime.now(),
                 updated_at=datetime.now()
             )
@@ -89,6 +97,54 @@ class MidjourneyTaskOperations:
             logger.error(f"查询任务失败: {e}")
             return None
         
+    @staticmethod
+    async def get_tasks_by_trigger_ids_status(
+        trigger_ids: List[str], task_status: str
+    ) -> Optional[Dict[str, List[Dict]]]:
+        """
+        一次查询多个trigger_id指定状态的任务，查询失败返回 None
+
+        upscale / variation 与父任务共用 trigger_id，同一trigger_id可能有多条，按创建从新到旧排列。
+        """
+        try:
+            query = midjourney_task.select().where(
+                midjourney_task.c.trigger_id.in_(trigger_ids)
+            ).where(midjourney_task.c.task_status == task_status).order_by(midjourney_task.c.id.desc())
+            results = await database.fetch_all(query)
+            tasks: Dict[str, List[Dict]] = {}
+            for row in results:
+                tasks.setdefault(row["trigger_id"], []).append(dict(row))
+            return tasks
+        except Exception as e:
+            logger.error(f"批量查询任务失败: {e}")
+            return None
+
+    @staticmethod
+    async def get_tasks_by_trigger_ids_msg_ids(trigger_ids: List[str], msg_ids: List[int]) -> Optional[List[Dict]]:
+        """批量查询已写入结果消息的任务，用于识别重复投递的回调；查询失败返回 None"""
+        try:
+            query = midjourney_task.select().where(
+                midjourney_task.c.trigger_id.in_(trigger_ids)
+            ).where(midjourney_task.c.msg_id.in_(msg_ids))
+            results = await database.fetch_all(query)
+            return [dict(row) for row in results]
+        except Exception as e:
+            logger.error(f"批量查询任务失败: {e}")
+            return None
+
+    @staticmethod
+    async def get_task_by_trigger_id_msg_id(trigger_id: str, msg_id: int) -> Optional[Dict]:
+        """根据trigger_id和结果消息ID获取任务，用于识别重复投递的回调"""
+        try:
+            query = midjourney_task.select().where(midjourney_task.c.trigger_id == trigger_id).where(midjourney_task.c.msg_id == msg_id)
+            result = await database.fetch_one(query)
+            if result:
+                return dict(result)
+            return None
+        except Exception as e:
+            logger.error(f"查询任务失败: {e}")
+            return None
+
     @staticmethod
     async def get_task_by_msg_id(msg_id: int) -> Optional[Dict]:
         """根据msg_id获取任务"""
@@ -136,6 +192,32 @@ class MidjourneyTaskOperations:
             logger.error(f"更新任务状态失败: {e}")
             return False
 
+    @staticmethod
+    def _result_values(
+        task_status: str,
+        result_url: Optional[str] = None,
+        attachments: Optional[List[Dict]] = None,
+        msg_id: Optional[int] = None,
+        msg_hash: Optional[str] = None
+    ) -> Dict[str, Any]:
+        update_data = {
+            "task_status": task_status,
+            "updated_at": datetime.now()
+        }
+        
+        if result_url:
+            update_data["result_url"] = result_url
+        
+        if attachments:
+            update_data["attachments"] = json.dumps(attachments, ensure_ascii=False)
+        
+        if msg_id:
+            update_data["msg_id"] = msg_id
+            
+        if msg_hash:
+            update_data["msg_hash"] = msg_hash
+        return update_data
+
     @staticmethod
     async def update_task_result(
         task_id: str,
@@ -147,22 +229,9 @@ class MidjourneyTaskOperations:
     ) -> bool:
         """更新任务结果"""
         try:
-            update_data = {
-                "task_status": task_status,
-                "updated_at": datetime.now()
-            }
-            
-            if result_url:
-                update_data["result_url"] = result_url
-            
-            if attachments:
-                update_data["attachments"] = json.dumps(attachments, ensure_ascii=False)
-            
-            if msg_id:
-                update_data["msg_id"] = msg_id
-                
-            if msg_hash:
-                update_data["msg_hash"] = msg_hash
+            update_data = MidjourneyTaskOperations._result_values(
+                task_status, result_url, attachments, msg_id, msg_hash
+            )
 
             query = midjourney_task.update().where(
                 midjourney_task.c.task_id == task_id
@@ -175,6 +244,72 @@ class MidjourneyTaskOperations:
             logger.error(f"更新任务结果失败: {e}")
             return False
 
+    @staticmethod
+    async def update_task_results(updates: List[Dict[str, Any]]) -> bool:
+        """在一个事务中批量更新任务结果，每项参数与 update_task_result 相同，任一失败则全部回滚"""
+        try:
+            async with database.transaction():
+                for update in updates:
+                    values = dict(update)
+                    task_id = values.pop("task_id")
+                    await database.execute(
+                        midjourney_task.update().where(
+                            midjourney_task.c.task_id == task_id
+                        ).values(**MidjourneyTaskOperations._result_values(**values))
+                    )
+            logger.info(f"批量更新任务结果成功，数量: {len(updates)}")
+            return True
+        except Exception as e:
+            logger.error(f"批量更新任务结果失败: {e}")
+            return False
+
+    @staticmethod
+    async def update_task_preview(task_id: str, preview_url: str) -> bool:
+        """更新任务预览图地址"""
+        try:
+            query = midjourney_task.update().where(
+                midjourney_task.c.task_id == task_id
+            ).values(
+                preview_url=preview_url
+            )
+            result = await database.execute(query)
+            return result > 0
+        except Exception as e:
+            logger.error(f"更新任务预览图失败: {e}")
+            return False
+
+    @staticmethod
+    async def update_task_progress(task_id: str, progress: int, preview_url: Optional[str]) -> bool:
+        """更新未完成任务的进度与中间预览图"""
+        try:
+            values = {"progress": progress, "updated_at": datetime.now()}
+            if preview_url:
+                values["preview_url"] = preview_url
+            query = midjourney_task.update().where(
+                (midjourney_task.c.task_id == task_id) &
+                (midjourney_task.c.task_status == "SUBMITTED")
+            ).values(**values)
+            result = await database.execute(query)
+            return result > 0
+        except Exception as e:
+            logger.error(f"更新任务进度失败: {e}")
+            return False
+
+    @staticmethod
+    async def update_task_attachments(task_id: str, attachments: List[Dict]) -> bool:
+        """更新任务附件信息（如刷新后的 Discord 附件地址）"""
+        try:
+            query = midjourney_task.update().where(
+                midjourney_task.c.task_id == task_id
+            ).values(
+                attachments=json.dumps(attachments, ensure_ascii=False)
+            )
+            result = await database.execute(query)
+            return result > 0
+        except Exception as e:
+            logger.error(f"更新任务附件失败: {e}")
+            return False
+
     @staticmethod
     async def get_tasks_by_status(task_status: str, limit: int = 100) -> List[Dict]:
         """根据状态获取任务列表"""
@@ -201,6 +336,32 @@ class MidjourneyTaskOperations:
             logger.error(f"删除任务失败: {e}")
             return False
 
+    @staticmethod
+    async def get_user_tasks(
+        app_key: str,
+        task_ids: Optional[List[str]] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        limit: int = 1000
+    ) -> List[Dict]:
+        """按 app_key 查询已完成的任务，可限定 task_id 列表或创建时间范围"""
+        try:
+            condition = (midjourney_task.c.app_key == app_key) & (midjourney_task.c.task_status == "SUCCESS")
+            if task_ids:
+                condition &= midjourney_task.c.task_id.in_(task_ids)
+            if start_time:
+                condition &= midjourney_task.c.created_at >= start_time
+            if end_time:
+                condition &= midjourney_task.c.created_at < end_time
+            query = midjourney_task.select().where(condition).order_by(
+                midjourney_task.c.created_at
+            ).limit(limit)
+            results = await database.fetch_all(query)
+            return [dict(result) for result in results]
+        except Exception as e:
+            logger.error(f"查询用户任务失败: {e}")
+            return []
+
     @staticmethod
     async def get_all_tasks(limit: int = 100, offset: int = 0) -> List[Dict]:
         """获取所有任务"""
@@ -302,6 +463,98 @@ class UserInfoOperations:
             return False
 
 
+# 4 段等值召回能保证不漏掉的最大汉明距离
+MAX_SIMILAR_DISTANCE = 3
+# 候选按主键分页读取的每页行数
+SIMILAR_PAGE_SIZE = 1000
+
+
+def hash_chunks(value: int) -> List[int]:
+    """64 位哈希拆成 4 段 16 位，高位在前"""
+    return [(value >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+class ImageHashOperations:
+    """切图感知哈希数据库操作类"""
+
+    @staticmethod
+    async def save_hashes(task_id: str, image_urls: List[str], hashes: List[int]) -> bool:
+        """保存任务四张切图的 dHash，image_index 从 1 开始"""
+        try:
+            async with database.transaction():
+                await database.execute(image_phash.delete().where(image_phash.c.task_id == task_id))
+                await database.execute_many(image_phash.insert(), [
+                    {
+                        "task_id": task_id,
+                        "image_index": index,
+                        "image_url": url,
+                        "phash": f"{value:016x}",
+                        **{f"chunk{i}": chunk for i, chunk in enumerate(hash_chunks(value))},
+                        "created_at": datetime.now(),
+                    }
+                    for index, (url, value) in enumerate(zip(image_urls, hashes), start=1)
+                ])
+            return True
+        except Exception as e:
+            logger.error(f"保存图片哈希失败: {e}")
+            return False
+
+    @staticmethod
+    def _user_hashes(app_key: str):
+        """只包含 app_key 用户任务的切图哈希查询"""
+        return select(image_phash).select_from(
+            image_phash.join(midjourney_task, midjourney_task.c.task_id == image_phash.c.task_id)
+        ).where(midjourney_task.c.app_key == app_key)
+
+    @staticmethod
+    async def get_hash(app_key: str, task_id: str, image_index: int) -> Optional[Dict]:
+        try:
+            query = ImageHashOperations._user_hashes(app_key).where(
+                (image_phash.c.task_id == task_id) & (image_phash.c.image_index == image_index)
+            )
+            result = await database.fetch_one(query)
+            return dict(result) if result else None
+        except Exception as e:
+            logger.error(f"查询图片哈希失败: {e}")
+            return None
+
+    @staticmethod
+    async def find_similar(app_key: str, value: int, max_distance: int) -> Optional[List[Dict]]:
+        """
+        在 app_key 用户的任务中查找汉明距离不超过 max_distance 的切图，结果带 distance 字段；查询失败返回 None
+
+        汉明距离不超过 3 的两个哈希，4 段中至少有一段完全相同（抽屉原理），
+        因此召回只走 4 个等值索引，不扫全表。纯色、近空白图片的某段可能命中大量行，
+        候选按主键分页读取全部，每页只保留精确距离满足条件的行，不截断也不整体载入内存。
+        """
+        try:
+            chunks = hash_chunks(value)
+            matched = or_(
+                image_phash.c.chunk0 == chunks[0],
+                image_phash.c.chunk1 == chunks[1],
+                image_phash.c.chunk2 == chunks[2],
+                image_phash.c.chunk3 == chunks[3],
+            )
+            matches = []
+            last_id = 0
+            while True:
+                query = ImageHashOperations._user_hashes(app_key).where(matched).where(
+                    image_phash.c.id > last_id
+                ).order_by(image_phash.c.id).limit(SIMILAR_PAGE_SIZE)
+                rows = await database.fetch_all(query)
+                for row in rows:
+                    distance = bin(value ^ int(row["phash"], 16)).count("1")
+                    if distance <= max_distance:
+                        matches.append({**dict(row), "distance": distance})
+                if len(rows) < SIMILAR_PAGE_SIZE:
+                    return matches
+                last_id = rows[-1]["id"]
+        except Exception as e:
+            logger.error(f"查询相似图片失败: {e}")
+            return None
+
+
 # 创建操作实例
 db_ops = MidjourneyTaskOperations()
-user_ops = UserInfoOperations() 
\ No newline at end of file
+user_ops = UserInfoOperations()
+hash_ops = ImageHashOperations() 
\ No newline at end of file
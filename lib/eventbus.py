@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import struct
+import uuid
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# bot -> API 事件通道，形如 unix:/tmp/mj_eventbus.sock 或 tcp://127.0.0.1:8063
+EVENTBUS_ADDRESS = getenv("EVENTBUS_ADDRESS")
+EVENTBUS_TOKEN = getenv("EVENTBUS_TOKEN") or ""
+EVENTBUS_MAX_BATCH = int(getenv("EVENTBUS_MAX_BATCH") or 64)
+EVENTBUS_LINGER_MS = int(getenv("EVENTBUS_LINGER_MS") or 5)
+# 发件箱中事件通道的目标地址，事件写入发件箱日志后经通道投递
+EVENTBUS_DESTINATION = "eventbus://api"
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+Handler = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """返回 ("unix", path) 或 ("tcp", (host, port))"""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.replace("tcp://", "", 1).rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"frame too large: {size}")
+    return json.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    payload = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    writer.write(HEADER.pack(len(payload)) + payload)
+
+
+class EventBusServer:
+    """
+    API 侧事件通道
+
+    每个连接先发送 hello（client_id + token），之后发送批量事件，
+    服务端按顺序逐个处理后回复 ack，ack 的 results 与 events 顺序一致，处理失败的事件为 "error"，
+    由 bot 发件箱稍后重新投递；处理函数需幂等。
+    """
+
+    def __init__(self, address: str, handler: Handler, token: str = "") -> None:
+        self.address = address
+        self._handler = handler
+        self._token = token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients = set()
+        self._metrics = {"connections": 0, "batches": 0, "events": 0, "errors": 0}
+
+    async def start(self):
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            self._server = await asyncio.start_unix_server(self._serve, path=target)
+        else:
+            self._server = await asyncio.start_server(self._serve, host=target[0], port=target[1])
+        logger.info(f"📡 事件通道已监听: {self.address}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._metrics["connections"] += 1
+        client_id = None
+        try:
+            hello = await read_frame(reader)
+            if hello.get("type") != "hello" or hello.get("token", "") != self._token:
+                logger.warning("⚠️ 事件通道握手失败，关闭连接")
+                return
+            client_id = hello["client_id"]
+            self._clients.add(client_id)
+            write_frame(writer, {"type": "ready"})
+            await writer.drain()
+            logger.info(f"🔗 事件通道客户端已连接: {client_id}")
+
+            while True:
+                message = await read_frame(reader)
+                if message.get("type") != "batch":
+                    continue
+                self._metrics["batches"] += 1
+                results = [await self._dispatch(event) for event in message.get("events", [])]
+                write_frame(writer, {"type": "ack", "seq": message.get("seq"), "results": results})
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self._metrics["errors"] += 1
+            logger.error(f"❌ 事件通道连接异常: {client_id} - {e}")
+        finally:
+            self._clients.discard(client_id)
+            writer.close()
+
+    async def _dispatch(self, event: Dict[str, Any]) -> str:
+        self._metrics["events"] += 1
+        try:
+            await self._handler(event["kind"], event["data"])
+            return "success"
+        except Exception as e:
+            self._metrics["errors"] += 1
+            logger.error(f"❌ 事件处理失败，等待重新投递: {event.get('kind')} - {e}")
+            return "error"
+
+    def get_status(self):
+        return {"address": self.address, "clients": len(self._clients), **self._metrics}
+
+
+class EventBusClient:
+    """
+    bot 侧事件通道
+
+    作为回调发件箱的投递方式：事件先写入发件箱日志，由发件箱合并为批量后调用 send()，
+    send() 写出一帧并等待该帧的 ack，返回每个事件的处理结果。
+    通道本身不缓存事件，连接断开时等待中的批次以异常结束，由发件箱按退避重试。
+    """
+
+    def __init__(self, address: str, token: str = "") -> None:
+        self.address = address
+        self._token = token
+        self._client_id = uuid.uuid4().hex
+        self._seq = 0
+        self._waiters: Dict[int, asyncio.Future] = {}  # 批次 seq -> 等待 ack 的 future
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._metrics = {"batches": 0, "events": 0, "failed": 0, "disconnects": 0}
+
+    async def send(self, payload: Dict[str, Any]) -> Dict[str, List[str]]:
+        """投递发件箱的批量请求体 {"events": [{"kind", "data"}]}，返回 {"results": [...]}"""
+        events = payload["events"]
+        writer = await self._connect()
+        self._seq += 1
+        seq = self._seq
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[seq] = future
+        try:
+            write_frame(writer, {"type": "batch", "seq": seq, "events": events})
+            await writer.drain()
+            results = await future
+        finally:
+            self._waiters.pop(seq, None)
+        self._metrics["batches"] += 1
+        self._metrics["events"] += len(events)
+        self._metrics["failed"] += sum(1 for result in results if result == "error")
+        return {"results": results}
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is not None:
+                return self._writer
+            kind, target = parse_address(self.address)
+            if kind == "unix":
+                reader, writer = await asyncio.open_unix_connection(target)
+            else:
+                reader, writer = await asyncio.open_connection(target[0], target[1])
+            try:
+                write_frame(writer, {"type": "hello", "client_id": self._client_id, "token": self._token})
+                await writer.drain()
+                if (await read_frame(reader)).get("type") != "ready":
+                    raise ConnectionError("eventbus handshake failed")
+            except BaseException:
+                writer.close()
+                raise
+            self._writer = writer
+            self._reader_task = asyncio.get_running_loop().create_task(self._ack_loop(reader, writer))
+            logger.info(f"🔗 事件通道已连接: {self.address}")
+            return writer
+
+    async def _ack_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        error: BaseException = ConnectionError("eventbus connection closed")
+        try:
+            while True:
+                message = await read_frame(reader)
+                future = self._waiters.get(message.get("seq"))
+                if message.get("type") == "ack" and future is not None and not future.done():
+                    future.set_result(message.get("results") or [])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = ConnectionError(f"eventbus connection lost: {e!r}")
+            logger.warning(f"⚠️ 事件通道断开，未确认的事件由发件箱重新投递: {e!r}")
+        finally:
+            self._writer = None
+            self._metrics["disconnects"] += 1
+            writer.close()
+            for future in self._waiters.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+
+    def get_status(self):
+        return {
+            "address": self.address,
+            "connected": self._writer is not None,
+            "in_flight": len(self._waiters),
+            **self._metrics,
+        }
+
+
+eventbus_client = EventBusClient(EVENTBUS_ADDRESS, token=EVENTBUS_TOKEN) if EVENTBUS_ADDRESS else None
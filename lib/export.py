@@ -0,0 +1,120 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+from os import getenv
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiofiles
+from loguru import logger
+
+from lib.media_cache import media_cache
+from lib.storage import storage
+
+# 单次导出的最大任务数
+EXPORT_MAX_TASKS = int(getenv("EXPORT_MAX_TASKS") or 1000)
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    zipfile 的只写输出流
+
+    不可 seek，zipfile 会改用数据描述符（data descriptor）记录大小与 CRC，
+    写入的数据暂存在缓冲区中，每写完一块由 drain() 取走交给响应，内存占用恒定。
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def _read_file(path: str) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            chunk = await f.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _read_cached(path: str) -> AsyncIterator[bytes]:
+    """读取附件缓存文件，结束后释放缓存引用"""
+    try:
+        async for chunk in _read_file(path):
+            yield chunk
+    finally:
+        media_cache.release(path)
+
+
+def _task_entries(task: Dict) -> List[Tuple[str, Optional[str]]]:
+    """任务结果对应的 (压缩包内文件名, 存储 key)，key 为 None 表示需经附件缓存读取"""
+    task_id = task["task_id"]
+    urls = [url for url in (task.get("result_url") or "").split("||") if url]
+    entries = []
+    for index, url in enumerate(urls, start=1):
+        key = storage.key_from_url(url)
+        if key is not None:
+            entries.append((f"{task_id}/{os.path.basename(key)}", key))
+        else:
+            entries.append((f"{task_id}/{index}.png", None))
+    return entries
+
+
+async def _open_entry(task: Dict, key: Optional[str]) -> AsyncIterator[bytes]:
+    if key is not None:
+        return storage.stream(key, EXPORT_CHUNK_SIZE)
+    path = await media_cache.acquire(task)
+    if path is None:
+        raise FileNotFoundError(f"任务缺少附件: {task['task_id']}")
+    return _read_cached(path)
+
+
+async def stream_zip(tasks: List[Dict]) -> AsyncIterator[bytes]:
+    """边读边写 ZIP，逐块产出，不生成临时文件"""
+    output = _StreamBuffer()
+    archive = zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    exported = 0
+    for task in tasks:
+        created_at = task.get("created_at") or datetime.now()
+        for name, key in _task_entries(task):
+            # 先读到第一块再写文件头，文件不存在时跳过而不是留下半个条目
+            try:
+                chunks = await _open_entry(task, key)
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = b""
+            except Exception as e:
+                logger.warning(f"⚠️ 导出跳过文件: {name} - {e}")
+                continue
+
+            info = zipfile.ZipInfo(name, date_time=created_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, "w") as dest:
+                dest.write(first)
+                yield output.drain()
+                async for chunk in chunks:
+                    dest.write(chunk)
+                    yield output.drain()
+            yield output.drain()
+            exported += 1
+
+    archive.close()
+    yield output.drain()
+    logger.info(f"📦 导出完成 - 任务: {len(tasks)}, 文件: {exported}")
@@ -0,0 +1,318 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from os import getenv
+from typing import List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+from PIL import Image, ImageOps
+
+Region = Tuple[int, int, int, int]
+
+# 四宫格位置编号：左上、右上、左下、右下
+QUADRANT_LABELS = ['1', '2', '3', '4']
+
+# dHash 尺寸：缩放为 9x8 灰度图，比较相邻像素得到 64 位
+HASH_SIZE = 8
+
+
+class SplitResult(NamedTuple):
+    paths: List[str]   # 四张切图的本地路径
+    hashes: List[int]  # 对应的 64 位 dHash
+
+
+def dhash(img: Image.Image) -> int:
+    """差值哈希：缩放为 (HASH_SIZE+1) x HASH_SIZE 灰度图，每行相邻像素比较亮度"""
+    small = img.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).convert("L")
+    try:
+        pixels = small.tobytes()
+    finally:
+        small.close()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def quadrant_regions(width: int, height: int) -> List[Region]:
+    """四宫格四个区域的坐标 (left, top, right, bottom)"""
+    single_width = width // 2
+    single_height = height // 2
+    return [
+        (0, 0, single_width, single_height),                    # 左上
+        (single_width, 0, width, single_height),                # 右上
+        (0, single_height, single_width, height),               # 左下
+        (single_width, single_height, width, height)            # 右下
+    ]
+
+
+def quadrant_paths(local_path: str, out_dir: str) -> List[str]:
+    base_name, ext = os.path.splitext(os.path.basename(local_path))
+    return [os.path.join(out_dir, f"{base_name}_{label}{ext}") for label in QUADRANT_LABELS]
+
+
+def encode_region(img: Image.Image, region: Region, output_path: str, compress_level: int) -> int:
+    """裁剪并编码单个区域，返回该区域的 dHash（thread 模式下四个区域在线程池中并行调用）"""
+    cropped_img = img.crop(region)
+    try:
+        value = dhash(cropped_img)
+        cropped_img.save(output_path, compress_level=compress_level)
+    finally:
+        cropped_img.close()
+    return value
+
+
+def split_grid(local_path: str, out_dir: str, compress_level: int = 6) -> SplitResult:
+    """将 discord 的四宫格图片切分为四张图，返回切图的本地路径与哈希（进程池任务）"""
+    outputs = quadrant_paths(local_path, out_dir)
+    with Image.open(local_path) as img:
+        img.load()
+        hashes = [
+            encode_region(img, region, output_path, compress_level)
+            for region, output_path in zip(quadrant_regions(*img.size), outputs)
+        ]
+    return SplitResult(outputs, hashes)
+
+
+def decoded_size(local_path: str) -> int:
+    """读取文件头估算解码后的内存大小（字节），不解码像素"""
+    with Image.open(local_path) as img:
+        width, height = img.size
+        return width * height * len(img.getbands())
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        return libc if hasattr(libc, "malloc_trim") else None
+    except (OSError, TypeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def trim_memory():
+    """
+    将空闲堆内存归还操作系统
+
+    多线程解码时 glibc 会为每个线程保留 arena，释放后的大块内存不会立即归还，
+    RSS 只涨不跌，这里主动调用 malloc_trim。
+    """
+    if _libc is not None:
+        _libc.malloc_trim(0)
+
+
+class PixelBudget:
+    """
+    全局解码内存预算（字节）
+
+    每张四宫格解码前按预估内存申请额度，额度不足时等待，
+    保证并发完成的任务不会同时把多张大图解码进内存。
+    单张超过总额度的图片按总额度计，独占执行。
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._used = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, amount: int) -> int:
+        amount = min(amount, self._limit)
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self._used + amount <= self._limit)
+            self._used += amount
+        return amount
+
+    async def release(self, amount: int):
+        cond = self._condition()
+        async with cond:
+            self._used -= amount
+            cond.notify_all()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+
+def normalize_image(src, output_path: str, max_edge: int, image_format: str, quality: int) -> int:
+    """
+    上传前归一化参考图：按 EXIF 方向摆正，最长边缩放到 max_edge，重新编码为 JPEG/WebP，
+    不写入 EXIF / ICC 等元数据。src 为路径或文件对象，返回输出文件大小。
+    """
+    with Image.open(src) as img:
+        # JPEG 可在解码时按 1/2、1/4、1/8 缩放，大图只解码需要的分辨率
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image_format == "jpeg" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB" if image_format == "jpeg" or "A" not in img.getbands() else "RGBA")
+        try:
+            if image_format == "webp":
+                img.save(output_path, "WEBP", quality=quality, method=4)
+            else:
+                img.save(output_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        finally:
+            img.close()
+    return os.path.getsize(output_path)
+
+
+def _load_image(local_path: str) -> Image.Image:
+    img = Image.open(local_path)
+    img.load()
+    return img
+
+
+class SplitPool:
+    """
+    切图编码池
+
+    - thread: 解码一次，四个区域在线程池中并行裁剪与编码
+    - process: 每张四宫格交给一个子进程完成解码与编码，多核并行
+    输入队列有界，队列满时 split() 会等待，从而对后处理 worker 形成背压。
+    解码前按预估内存申请 PixelBudget，限制并发解码的峰值内存。
+    """
+
+    def __init__(
+        self, kind: str, workers: int, queue_size: int, compress_level: int, pixel_budget: int
+    ) -> None:
+        self._kind = kind
+        self._workers = workers
+        self._queue_size = queue_size
+        self._compress_level = compress_level
+        self._budget = PixelBudget(pixel_budget)
+        self._executor: Optional[Executor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._metrics = {"images": 0, "failures": 0, "busy": 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        if self._kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="split")
+        self._queue = asyncio.Queue(self._queue_size)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._dispatch()) for _ in range(self._workers)]
+        logger.info(f"🖼️ 切图编码池已启动 - 类型: {self._kind}, worker: {self._workers}, 队列长度: {self._queue_size}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def split(self, local_path: str, out_dir: str) -> SplitResult:
+        """切分四宫格，队列已满时等待"""
+        if not self._tasks:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((local_path, out_dir, future))
+        return await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            local_path, out_dir, future = await self._queue.get()
+            self._metrics["busy"] += 1
+            reserved = 0
+            try:
+                reserved = await self._budget.acquire(await self._memory_cost(local_path))
+                if self._kind == "process":
+                    outputs = await loop.run_in_executor(
+                        self._executor, split_grid, local_path, out_dir, self._compress_level
+                    )
+                else:
+                    outputs = await self._split_in_threads(local_path, out_dir)
+                self._metrics["images"] += 1
+                if not future.done():
+                    future.set_result(outputs)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self._metrics["failures"] += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                if reserved:
+                    await self._budget.release(reserved)
+                    trim_memory()
+                self._metrics["busy"] -= 1
+                self._queue.task_done()
+
+    async def _memory_cost(self, local_path: str) -> int:
+        """
+        预估切图峰值内存
+
+        PNG 为逐行压缩，Pillow 无法只解码部分区域，只能整图解码：
+        thread 模式解码后同时持有整图与四个裁剪块（约 2 倍），
+        process 模式在子进程中逐块裁剪编码（约 1.25 倍）。
+        """
+        loop = asyncio.get_running_loop()
+        size = await loop.run_in_executor(None, decoded_size, local_path)
+        return size * 5 // 4 if self._kind == "process" else size * 2
+
+    async def _split_in_threads(self, local_path: str, out_dir: str) -> SplitResult:
+        loop = asyncio.get_running_loop()
+        img = await loop.run_in_executor(self._executor, _load_image, local_path)
+        outputs = quadrant_paths(local_path, out_dir)
+        try:
+            # 裁剪、哈希与编码都在线程池中完成（Pillow 处理像素时释放 GIL），不占用事件循环；
+            # 等四个区域都结束后再释放整图像素，避免其他线程仍在读取
+            hashes = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, encode_region, img, region, output_path, self._compress_level)
+                for region, output_path in zip(quadrant_regions(*img.size), outputs)
+            ), return_exceptions=True)
+        finally:
+            img.close()
+            del img
+        for value in hashes:
+            if isinstance(value, BaseException):
+                raise value
+        return SplitResult(outputs, list(hashes))
+
+    def get_status(self):
+        return {
+            "kind": self._kind,
+            "workers": self._workers,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self._queue_size,
+            "pixel_budget_used": self._budget.used,
+            "pixel_budget_limit": self._budget.limit,
+            **self._metrics,
+        }
+
+
+split_pool = SplitPool(
+    kind=getenv("SPLIT_POOL_KIND") or "thread",
+    workers=int(getenv("SPLIT_POOL_WORKERS") or os.cpu_count() or 2),
+    queue_size=int(getenv("SPLIT_QUEUE_SIZE") or 16),
+    compress_level=int(getenv("SPLIT_COMPRESS_LEVEL") or 6),
+    pixel_budget=int(getenv("SPLIT_PIXEL_BUDGET_MB") or 256) * 1024 * 1024,
+)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+from exceptions import DownloadError
+from lib.api import discord
+from lib.db_operations import db_ops
+from util.download import downloader
+
+KEY_PATTERN = re.compile(r"^[\w-]+$")
+
+# 附件代理对外地址前缀，如 http://127.0.0.1:8062/media ；为空时结果地址仍为 Discord 原始地址
+MEDIA_PUBLIC_BASE_URL = getenv("MEDIA_PUBLIC_BASE_URL")
+
+
+def attachment_expires_at(url: str) -> Optional[int]:
+    """Discord 附件地址的 ex 参数为十六进制过期时间戳，无该参数返回 None"""
+    ex = parse_qs(urlparse(url).query).get("ex")
+    if not ex:
+        return None
+    try:
+        return int(ex[0], 16)
+    except ValueError:
+        return None
+
+
+def attachment_expired(url: str, margin: int = 60) -> bool:
+    expires_at = attachment_expires_at(url)
+    return expires_at is not None and expires_at - margin <= time.time()
+
+
+class MediaCache:
+    """
+    Discord 附件本地磁盘缓存
+
+    - 首次访问时从 Discord CDN 拉取并落盘，之后直接从本地提供
+    - 同一 key 并发未命中时只拉取一次（single-flight）
+    - 按访问顺序 LRU 淘汰，总大小不超过 max_bytes
+    - acquire 与 release 成对调用，淘汰时仍在读取的文件延迟到最后一个读取结束后删除
+    - 签名地址过期或拉取失败时，通过 Discord 接口刷新 attachments 中的地址
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # 文件名 -> 大小
+        self._total = 0
+        self._loaded = False
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._readers: Dict[str, int] = {}  # 文件名 -> 正在读取的引用数
+        self._doomed: Set[str] = set()  # 已淘汰、等待读取结束后删除的文件名
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+
+    def _load(self):
+        """启动后首次使用时扫描缓存目录"""
+        if self._loaded:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total += size
+        self._loaded = True
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    async def acquire(self, task: Dict) -> Optional[str]:
+        """
+        返回任务首个附件的本地缓存路径并持有一个读取引用，无附件返回 None
+
+        返回路径后调用方必须在读取结束时调用 release(path)，在此之前文件不会被淘汰删除。
+        """
+        self._load()
+        task_id = task.get("task_id", "")
+        attachments: List[Dict] = json.loads(task.get("attachments") or "[]")
+        if not attachments or not KEY_PATTERN.match(task_id):
+            return None
+
+        ext = os.path.splitext(attachments[0].get("filename") or "")[1] or ".png"
+        name = f"{task_id}{ext}"
+        if name in self._entries:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(name)
+        else:
+            # 等待其他请求拉取完成后可能已被再次淘汰，此时重新拉取
+            while name not in self._entries:
+                await self._fetch_once(task_id, attachments, name)
+        self._readers[name] = self._readers.get(name, 0) + 1
+        return self._path(name)
+
+    def release(self, path: str):
+        """释放 acquire 持有的读取引用，文件已被淘汰且无人读取时删除"""
+        name = os.path.basename(path)
+        count = self._readers.get(name, 0) - 1
+        if count > 0:
+            self._readers[name] = count
+            return
+        self._readers.pop(name, None)
+        if name in self._doomed:
+            self._doomed.discard(name)
+            self._remove(name)
+
+    async def _fetch_once(self, task_id: str, attachments: List[Dict], name: str):
+        future = self._inflight.get(name)
+        if future is not None:
+            await asyncio.shield(future)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[name] = future
+        try:
+            self.stats["misses"] += 1
+            path = await self._fetch(task_id, attachments, name)
+            future.set_result(path)
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时的 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(name, None)
+
+    async def _fetch(self, task_id: str, attachments: List[Dict], name: str) -> str:
+        attachment = attachments[0]
+        path = self._path(name)
+        urls = [u for u in (attachment.get("url"), attachment.get("proxy_url")) if u]
+
+        if not any(attachment_expired(u) for u in urls):
+            for url in urls:
+                try:
+                    await downloader.download(url, path, attachment.get("size"))
+                    return self._add(name, path)
+                except DownloadError as e:
+                    logger.warning(f"⚠️ 附件拉取失败，尝试刷新地址: {task_id} - {e}")
+
+        # 地址过期或失效，刷新签名后重试
+        self.stats["refreshes"] += 1
+        refreshed = await discord.refresh_attachment_urls(urls)
+        if not refreshed:
+            raise DownloadError(f"附件地址刷新失败: {task_id}")
+        for item in attachments:
+            for field in ("url", "proxy_url"):
+                if item.get(field) in refreshed:
+                    item[field] = refreshed[item[field]]
+        await db_ops.update_task_attachments(task_id, attachments)
+
+        await downloader.download(attachments[0]["url"], path, attachment.get("size"))
+        return self._add(name, path)
+
+    def _add(self, name: str, path: str) -> str:
+        size = os.path.getsize(path)
+        self._entries[name] = size
+        self._total += size
+        self._doomed.discard(name)
+        self._evict(keep=name)
+        return path
+
+    def _evict(self, keep: str):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                self._entries.move_to_end(name)
+                continue
+            self._entries.pop(name)
+            self._total -= size
+            self.stats["evictions"] += 1
+            if self._readers.get(name):
+                self._doomed.add(name)
+            else:
+                self._remove(name)
+
+    def _remove(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def get_status(self):
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "readers": sum(self._readers.values()),
+            "pending_deletes": len(self._doomed),
+            **self.stats,
+        }
+
+
+media_cache = MediaCache(
+    cache_dir=getenv("MEDIA_CACHE_DIR") or "media_cache",
+    max_bytes=int(getenv("MEDIA_CACHE_MAX_MB") or 2048) * 1024 * 1024,
+)
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import time
+from os import getenv
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from loguru import logger
+
+from lib.db_operations import db_ops, hash_ops
+from lib.image import SplitResult, split_pool
+from lib.storage import storage, STORAGE_LOCAL_DIR
+from lib.webhook import webhook
+from util.download import downloader
+
+# 需要切分四宫格的任务类型
+SPLIT_TASK_TYPES = ("generate", "variation")
+
+# 预览图最长边与格式（Discord 媒体代理支持 width / height / format 参数）
+PREVIEW_MAX_EDGE = int(getenv("PREVIEW_MAX_EDGE") or 512)
+PREVIEW_FORMAT = getenv("PREVIEW_FORMAT") or "webp"
+PREVIEW_CONCURRENCY = int(getenv("PREVIEW_CONCURRENCY") or 8)
+
+# 成功回调默认附带的图片（任务未指定 callback_images 时使用）：quadrants / 1-4 / preview，为空时不附带
+WEBHOOK_IMAGES = getenv("WEBHOOK_IMAGES") or ""
+
+
+async def download_and_split_file(
+        task_id: str, file_url: str, download_dir: str, expected_size: Optional[int] = None
+) -> SplitResult:
+    """下载文件到本地并切分为四张图，返回切图的本地路径与感知哈希"""
+    # 按任务命名，多个 worker 并行下载时互不覆盖；同一任务重试时续传未完成的 .part
+    local_path = os.path.join(download_dir, f"{task_id}.png")
+
+    # 下载文件（断点续传 + 大小校验）
+    logger.info(f"⬇️ 开始下载: {file_url}")
+    await downloader.download(file_url, local_path, expected_size)
+
+    # 切图为 CPU 密集操作，交给切图编码池
+    try:
+        return await split_pool.split(local_path, download_dir)
+    finally:
+        # 对象存储后端只保存切图，本地的四宫格原图用完即删，避免磁盘持续增长
+        if storage.name != "local":
+            try:
+                os.remove(local_path)
+            except FileNotFoundError:
+                pass
+
+
+async def store_split_files(local_paths: List[str]) -> List[str]:
+    """将切图保存到存储后端，返回公开地址"""
+    return list(await asyncio.gather(*(
+        storage.put_file(os.path.basename(path), path, content_type="image/png", move=True)
+        for path in local_paths
+    )))
+
+
+def callback_files(task_id: str, urls: List[str], mode: str) -> List[Tuple[str, str, str]]:
+    """按 callback_images 选择成功回调附带的图片，返回 [(表单字段名, 存储 key, content_type)]"""
+    if mode == "preview":
+        return [("preview", f"previews/{task_id}.{PREVIEW_FORMAT}", f"image/{PREVIEW_FORMAT}")]
+
+    files = [
+        (f"image_{index}", storage.key_from_url(url), "image/png")
+        for index, url in enumerate(urls, start=1)
+        if mode in ("quadrants", str(index))
+    ]
+    return [file for file in files if file[1]]
+
+
+def preview_url(attachment: Dict, max_edge: int = PREVIEW_MAX_EDGE) -> Optional[str]:
+    """在附件的 media.discordapp.net 地址上追加缩放参数，保留原有签名参数"""
+    proxy_url = attachment.get("proxy_url")
+    if not proxy_url:
+        return None
+
+    width, height = attachment.get("width") or 0, attachment.get("height") or 0
+    if width and height:
+        scale = min(max_edge / max(width, height), 1)
+        width, height = max(int(width * scale), 1), max(int(height * scale), 1)
+    else:
+        width = height = max_edge
+
+    parts = urlparse(proxy_url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in ("width", "height", "format")]
+    query += [("format", PREVIEW_FORMAT), ("width", str(width)), ("height", str(height))]
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+async def fetch_preview(task_id: str, attachment: Dict) -> Optional[str]:
+    """拉取小尺寸预览图并保存到存储，返回预览图地址"""
+    url = preview_url(attachment)
+    if not url:
+        return None
+
+    key = f"previews/{task_id}.{PREVIEW_FORMAT}"
+    local_path = os.path.join(STORAGE_LOCAL_DIR, key)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    await downloader.download(url, local_path)
+    return await storage.put_file(key, local_path, content_type=f"image/{PREVIEW_FORMAT}", move=True)
+
+
+class PostProcessQueue:
+    """
+    结果图后处理队列
+
+    /midjourney/result 只负责把结果写入数据库（状态 PROCESSING）并投递 task_id，
+    由后台 worker 完成下载、切图、存储并更新任务，产物就绪后才标记 SUCCESS。
+    PROCESSING 状态持久化在数据库中，队列已满或服务重启时由定时扫描重新投递。
+    """
+
+    def __init__(self, workers: int, queue_size: int, max_retry: int, rescan_interval: int) -> None:
+        self._workers = workers
+        self._queue_size = queue_size
+        self._max_retry = max_retry
+        self._rescan_interval = rescan_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[str] = set()  # 已入队或处理中的 task_id
+        self._attempts: Dict[str, int] = {}
+        self._retrying: Set[str] = set()  # 等待退避重试的 task_id
+        self._preview_semaphore: Optional[asyncio.Semaphore] = None
+        self._preview_tasks: Set[asyncio.Task] = set()
+        self._metrics = {
+            "submitted": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "hash_failures": 0,
+            "rejected": 0,
+            "processing_seconds": 0.0,
+            "previews": 0,
+            "preview_failures": 0,
+            "preview_seconds": 0.0,
+        }
+
+    def start(self):
+        """启动 worker 与定时扫描，需在事件循环中调用"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self._queue_size)
+        split_pool.start()
+        loop = asyncio.get_running_loop()
+        for i in range(self._workers):
+            self._tasks.append(loop.create_task(self._worker(i)))
+        self._tasks.append(loop.create_task(self._periodic_rescan()))
+        logger.info(f"🛠️ 后处理队列已启动 - worker: {self._workers}, 队列长度: {self._queue_size}")
+
+    async def stop(self):
+        await split_pool.stop()
+        for task in list(self._preview_tasks):
+            task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, task_id: str) -> bool:
+        """投递任务，队列已满时返回 False（任务仍为 PROCESSING，等待定时扫描）"""
+        if task_id in self._pending:
+            return True
+        if self._queue is None:
+            logger.warning(f"⚠️ 后处理队列未启动，等待扫描: {task_id}")
+            return False
+        try:
+            self._queue.put_nowait(task_id)
+        except asyncio.QueueFull:
+            self._metrics["rejected"] += 1
+            logger.warning(f"⚠️ 后处理队列已满，等待扫描: {task_id}")
+            return False
+        self._pending.add(task_id)
+        self._metrics["submitted"] += 1
+        return True
+
+    def submit_preview(self, task_id: str, attachment: Dict):
+        """
+        立即拉取预览图，不经过后处理队列
+
+        预览图只有几十 KB，与四宫格下载切图并行，任务完成后很快即可展示。
+        """
+        if self._preview_semaphore is None:
+            self._preview_semaphore = asyncio.Semaphore(PREVIEW_CONCURRENCY)
+        task = asyncio.get_running_loop().create_task(self._preview(task_id, attachment))
+        self._preview_tasks.add(task)
+        task.add_done_callback(self._preview_tasks.discard)
+
+    async def _preview(self, task_id: str, attachment: Dict):
+        started = time.perf_counter()
+        try:
+            async with self._preview_semaphore:
+                url = await fetch_preview(task_id, attachment)
+            if url:
+                await db_ops.update_task_preview(task_id, url)
+                self._metrics["previews"] += 1
+                logger.info(f"🖼️ 预览图已就绪: {task_id} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+        except Exception as e:
+            self._metrics["preview_failures"] += 1
+            logger.warning(f"⚠️ 预览图拉取失败: {task_id} - {e}")
+        finally:
+            self._metrics["preview_seconds"] += time.perf_counter() - started
+
+    async def _worker(self, index: int):
+        while True:
+            task_id = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                await self._process(task_id)
+                self._attempts.pop(task_id, None)
+                self._metrics["succeeded"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 后处理失败: {task_id} - {e}")
+                await self._on_failure(task_id)
+            finally:
+                self._metrics["processing_seconds"] += time.perf_counter() - started
+                self._pending.discard(task_id)
+                self._queue.task_done()
+
+    async def _process(self, task_id: str):
+        task = await db_ops.get_task_by_task_id(task_id)
+        if not task or task.get("task_status") != "PROCESSING":
+            return
+
+        attachments = json.loads(task.get("attachments") or "[]")
+        if not attachments:
+            raise ValueError("任务缺少 attachments")
+        attachment = attachments[0]
+
+        result = await download_and_split_file(
+            task_id, attachment.get("url"), STORAGE_LOCAL_DIR, attachment.get("size")
+        )
+        urls = await store_split_files(result.paths)
+        # db_ops 出错时只返回 False，需抛出异常交给重试，否则任务标记成功后永远查不到相似图
+        if not await hash_ops.save_hashes(task_id, urls, result.hashes):
+            self._metrics["hash_failures"] += 1
+            raise RuntimeError("保存切图哈希失败")
+
+        if not await db_ops.update_task_results([
+            dict(task_id=task_id, task_status="SUCCESS", result_url="||".join(urls))
+        ]):
+            raise RuntimeError("写入任务结果失败")
+        mode = task.get("callback_images") or WEBHOOK_IMAGES
+        webhook.notify(
+            task, "SUCCESS",
+            files=callback_files(task_id, urls, mode) if mode else None,
+            result_url="||".join(urls), msg_id=str(task.get("msg_id")), msg_hash=task.get("msg_hash"),
+        )
+        logger.info(f"✅ 后处理完成: {task_id}")
+
+    async def _on_failure(self, task_id: str):
+        attempt = self._attempts.get(task_id, 0) + 1
+        self._attempts[task_id] = attempt
+        if attempt <= self._max_retry:
+            self._metrics["retried"] += 1
+            delay = min(2 ** attempt, 60)
+            logger.warning(f"🔁 后处理将在 {delay}s 后重试（第 {attempt} 次）: {task_id}")
+            self._retrying.add(task_id)
+            asyncio.get_running_loop().call_later(delay, self._retry, task_id)
+            return
+
+        self._attempts.pop(task_id, None)
+        self._metrics["failed"] += 1
+        await db_ops.update_task_status_by_task_id(task_id, "FAILURE")
+        webhook.notify(await db_ops.get_task_by_task_id(task_id), "FAILURE")
+
+    def _retry(self, task_id: str):
+        self._retrying.discard(task_id)
+        self.submit(task_id)
+
+    async def _periodic_rescan(self):
+        """定期扫描数据库中未处理的 PROCESSING 任务"""
+        while True:
+            try:
+                await self.rescan()
+                await asyncio.sleep(self._rescan_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ 后处理扫描异常: {e}")
+                await asyncio.sleep(self._rescan_interval)
+
+    async def rescan(self):
+        tasks = await db_ops.get_tasks_by_status("PROCESSING", self._queue_size)
+        for task in tasks:
+            task_id = task.get("task_id")
+            if task_id in self._pending or task_id in self._retrying:
+                continue
+            if not self.submit(task_id):
+                break
+
+    def get_status(self):
+        return {
+            "workers": self._workers,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self._queue_size,
+            "pending": len(self._pending),
+            **self._metrics,
+            "split_pool": split_pool.get_status(),
+        }
+
+
+postprocess = PostProcessQueue(
+    workers=int(getenv("POSTPROCESS_WORKERS") or 2),
+    queue_size=int(getenv("POSTPROCESS_QUEUE_SIZE") or 100),
+    max_retry=int(getenv("POSTPROCESS_MAX_RETRY") or 3),
+    rescan_interval=int(getenv("POSTPROCESS_RESCAN_INTERVAL") or 60),
+)
@@ -0,0 +1,132 @@
+import asyncio
+import re
+import time
+from os import getenv
+from typing import Dict, List, Optional, Set
+
+from loguru import logger
+
+from lib.db_operations import db_ops
+from util.cache import TTLCache
+
+# Midjourney 生成中的消息内容形如 "**<#123#>prompt** - <@id> (31%) (fast)"
+PROGRESS_PATTERN = re.compile(r"\((\d{1,3})%\)")
+
+
+def parse_progress(content: str) -> Optional[int]:
+    match = PROGRESS_PATTERN.search(content or "")
+    if not match:
+        return None
+    return min(int(match.group(1)), 100)
+
+
+class ProgressTracker:
+    """
+    任务生成进度
+
+    generating 回调频繁到达，进度与最新中间图只写入有界内存表，
+    由后台定时把有变化的任务合并写入数据库，每个任务每个周期最多一次写入。
+
+    upscale / variation 子任务与父任务共用 trigger_id，各自有一条生成中的消息，
+    因此进度按任务记录：生成中的消息首次出现时绑定到该 trigger_id 下尚未绑定的最早提交的任务。
+    """
+
+    def __init__(self, maxsize: int, ttl: int, flush_interval: float) -> None:
+        self._entries: TTLCache[str, Dict] = TTLCache(maxsize=maxsize, ttl=ttl)  # task_id -> 进度
+        self._messages: TTLCache[int, str] = TTLCache(maxsize=maxsize, ttl=ttl)  # 生成中的消息 ID -> task_id
+        self._dirty: Set[str] = set()
+        self._flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = {"events": 0, "unbound": 0, "flushes": 0, "writes": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._periodic_flush())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _bind(self, trigger_id: str, msg_id: int) -> Optional[str]:
+        """生成中的消息对应的任务，找不到可绑定的任务时返回 None"""
+        task_id = self._messages.get(msg_id)
+        if task_id is not None:
+            return task_id
+        tasks = await db_ops.get_tasks_by_trigger_ids_status([trigger_id], "SUBMITTED")
+        # 查询期间同一消息的其他事件可能已完成绑定
+        task_id = self._messages.get(msg_id)
+        if task_id is not None or not tasks:
+            return task_id
+        bound = {value for _, value, _ in self._messages.items()}
+        for task in reversed(tasks.get(trigger_id, [])):
+            if task["task_id"] not in bound:
+                self._messages.set(msg_id, task["task_id"])
+                return task["task_id"]
+        return None
+
+    async def update(self, trigger_id: str, msg_id: int, content: str, attachments: List[Dict]) -> Optional[Dict]:
+        """记录一次 generating 回调，返回该任务的最新进度"""
+        self._metrics["events"] += 1
+        task_id = await self._bind(trigger_id, msg_id)
+        if task_id is None:
+            self._metrics["unbound"] += 1
+            return None
+        entry = dict(self._entries.get(task_id) or {"progress": 0, "preview_url": None})
+        progress = parse_progress(content)
+        if progress is not None:
+            entry["progress"] = max(entry["progress"], progress)
+        if attachments:
+            attachment = attachments[0]
+            entry["preview_url"] = attachment.get("proxy_url") or attachment.get("url")
+        entry["updated_at"] = time.time()
+        self._entries.set(task_id, entry)
+        self._dirty.add(task_id)
+        return entry
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        return self._entries.get(task_id)
+
+    def finish(self, task_id: str):
+        """任务结束后丢弃进度，结果以数据库为准"""
+        self._entries.pop(task_id)
+        self._dirty.discard(task_id)
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        self._metrics["flushes"] += 1
+        for task_id in dirty:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                continue
+            if await db_ops.update_task_progress(task_id, entry["progress"], entry["preview_url"]):
+                self._metrics["writes"] += 1
+
+    async def _periodic_flush(self):
+        while True:
+            try:
+                await asyncio.sleep(self._flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ 进度写入异常: {e}")
+
+    def get_status(self):
+        return {
+            "entries": len(self._entries),
+            "messages": len(self._messages),
+            "dirty": len(self._dirty),
+            **self._metrics,
+        }
+
+
+progress_tracker = ProgressTracker(
+    maxsize=int(getenv("PROGRESS_MAX_ENTRIES") or 10000),
+    ttl=int(getenv("PROGRESS_TTL") or 600),
+    flush_interval=float(getenv("PROGRESS_FLUSH_INTERVAL") or 5),
+)
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from os import getenv
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import aiofiles
+import aiohttp
+from loguru import logger
+from PIL import Image
+
+from exceptions import RequestParamsError
+from lib.api import discord
+from lib.media_cache import attachment_expired, attachment_expires_at
+from lib.upload import (
+    UPLOAD_DEDUP_EXPIRE_MARGIN,
+    UPLOAD_EXT,
+    UPLOAD_MAX_BYTES,
+    normalize_upload,
+    open_file_stream,
+    upload_dedup,
+)
+from util.cache import TTLCache
+from util.net import PublicResolver, UnsafeAddressError, check_public_url
+
+# 是否在提交 /imagine 前把外部 picurl 转存到 Discord
+REHOST_PICURL = (getenv("REHOST_PICURL") or "false").lower() in ("1", "true", "yes")
+REHOST_DIR = getenv("REHOST_DIR") or "rehost"
+REHOST_TIMEOUT = float(getenv("REHOST_TIMEOUT") or 20)
+REHOST_CONCURRENCY = int(getenv("REHOST_CONCURRENCY") or 8)
+REHOST_MAX_REDIRECTS = 5
+REHOST_CHUNK_SIZE = 64 * 1024
+
+DISCORD_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+
+
+def _inspect_image(path: str) -> Tuple[str, str]:
+    """校验图片并返回 (格式扩展名, 内容 SHA-256)"""
+    with Image.open(path) as img:
+        img.verify()
+        ext = (img.format or "png").lower()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return ext, digest.hexdigest()
+
+
+def split_prompt_picurl(prompt: str, picurl: Optional[str]) -> Tuple[str, Optional[str]]:
+    """与 prompt_handler 一致：未传 picurl 时，prompt 开头的链接视为 picurl"""
+    if not picurl and prompt.startswith(("http://", "https://")):
+        picurl, _, prompt = prompt.partition(" ")
+    return prompt, picurl
+
+
+class PicurlRehoster:
+    """
+    外部参考图转存
+
+    /imagine 提交前并发拉取 picurl 并校验为图片，通过 upload_attachment + send_attachment_message
+    转存为 Discord 附件地址，避免 Midjourney 访问慢速或不稳定的第三方地址导致任务失败。
+    转存结果按源地址缓存，内容哈希与 /upload 去重缓存共用。
+    只拉取公网地址（每次重定向都重新检查），边下载边计数，超过 UPLOAD_MAX_BYTES 立即中止。
+    """
+
+    def __init__(self, work_dir: str, timeout: float, concurrency: int) -> None:
+        self.work_dir = work_dir
+        self.timeout = timeout
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._urls: TTLCache[str, str] = TTLCache(maxsize=10000)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._metrics = {"rehosted": 0, "url_hits": 0, "hash_hits": 0, "failures": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(resolver=PublicResolver()),
+                # 与 downloader 一致读取 HTTP(S)_PROXY 环境变量，内网代理需加入 SSRF_ALLOWLIST
+                trust_env=True,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def rehost_picurl(self, picurl: str) -> str:
+        """picurl 中可能有多个以空格分隔的链接，并发转存后按原顺序拼接"""
+        urls = picurl.split()
+        return " ".join(await asyncio.gather(*(self.rehost(url) for url in urls)))
+
+    async def rehost(self, url: str) -> str:
+        if urlparse(url).hostname in DISCORD_HOSTS and not attachment_expired(url, UPLOAD_DEDUP_EXPIRE_MARGIN):
+            return url
+
+        cached = self._urls.get(url)
+        if cached:
+            self._metrics["url_hits"] += 1
+            return cached
+
+        # 同一地址并发请求只转存一次
+        future = self._inflight.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            result = await self._rehost(url)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+    async def _rehost(self, url: str) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        os.makedirs(self.work_dir, exist_ok=True)
+        path = os.path.join(self.work_dir, uuid.uuid4().hex)
+        started = time.perf_counter()
+        try:
+            async with self._semaphore:
+                picurl = await asyncio.wait_for(self._fetch_and_upload(url, path), self.timeout)
+        except asyncio.TimeoutError:
+            self._metrics["failures"] += 1
+            raise RequestParamsError(f"picurl fetch timeout: {url}")
+        except RequestParamsError:
+            self._metrics["failures"] += 1
+            raise
+        except Exception as e:
+            self._metrics["failures"] += 1
+            logger.warning(f"⚠️ 参考图转存失败: {url} - {e}")
+            raise RequestParamsError(f"picurl unavailable: {url}")
+        finally:
+            # 超时取消时下载到一半的临时文件也需要清理
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self._cache_url(url, picurl)
+        logger.info(f"🔁 参考图已转存: {url} -> {picurl} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+        return picurl
+
+    async def _download(self, url: str, path: str) -> int:
+        """下载到 path 并返回大小，手动跟随重定向以便逐跳检查地址"""
+        source = url
+        for _ in range(REHOST_MAX_REDIRECTS + 1):
+            try:
+                await check_public_url(url)
+                async with self._get_session().get(url, allow_redirects=False) as resp:
+                    location = resp.headers.get("Location")
+                    if resp.status in (301, 302, 303, 307, 308) and location:
+                        url = urljoin(str(resp.url), location)
+                        continue
+                    if resp.status != 200:
+                        raise RequestParamsError(f"picurl unavailable: HTTP {resp.status} {source}")
+                    if resp.content_length and resp.content_length > UPLOAD_MAX_BYTES:
+                        raise RequestParamsError(f"picurl too large: {resp.content_length} bytes")
+
+                    size = 0
+                    async with aiofiles.open(path, "wb") as f:
+                        async for chunk in resp.content.iter_chunked(REHOST_CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > UPLOAD_MAX_BYTES:
+                                raise RequestParamsError(f"picurl too large: over {UPLOAD_MAX_BYTES} bytes")
+                            await f.write(chunk)
+                    return size
+            except UnsafeAddressError as e:
+                raise RequestParamsError(f"picurl not allowed: {e}")
+            except aiohttp.ClientConnectorError as e:
+                if isinstance(e.os_error, UnsafeAddressError):
+                    raise RequestParamsError(f"picurl not allowed: {e.os_error}")
+                raise
+        raise RequestParamsError(f"picurl too many redirects: {source}")
+
+    async def _fetch_and_upload(self, url: str, path: str) -> str:
+        size = await self._download(url, path)
+
+        loop = asyncio.get_running_loop()
+        try:
+            ext, digest = await loop.run_in_executor(None, _inspect_image, path)
+        except Exception:
+            raise RequestParamsError(f"picurl is not a valid image: {url}")
+
+        picurl = upload_dedup.get(digest)
+        if picurl:
+            self._metrics["hash_hits"] += 1
+            return picurl
+
+        filename = f"{digest[:16]}.{ext}"
+        body_path = path
+        normalized = await normalize_upload(path, size)
+        if normalized:
+            body_path, size = normalized
+            filename = f"{digest[:16]}.{UPLOAD_EXT}"
+        try:
+            attachment = await discord.upload_attachment(filename, size, open_file_stream(body_path))
+        finally:
+            if body_path != path:
+                os.remove(body_path)
+        if not (attachment and attachment.get("upload_filename")):
+            raise RuntimeError("upload attachment failed")
+        upload_dedup.set_upload(digest, attachment["upload_filename"])
+
+        picurl = await discord.send_attachment_message(attachment["upload_filename"])
+        if not picurl:
+            raise RuntimeError("send attachment message failed")
+        upload_dedup.set_message(attachment["upload_filename"], picurl)
+        self._metrics["rehosted"] += 1
+        return picurl
+
+    def _cache_url(self, url: str, picurl: str):
+        expires_at = attachment_expires_at(picurl)
+        ttl = None if expires_at is None else expires_at - UPLOAD_DEDUP_EXPIRE_MARGIN - time.time()
+        if ttl is None or ttl > 0:
+            self._urls.set(url, picurl, ttl)
+
+    def get_status(self):
+        return {
+            "enabled": REHOST_PICURL,
+            "cached": len(self._urls),
+            "inflight": len(self._inflight),
+            **self._metrics,
+        }
+
+
+rehoster = PicurlRehoster(work_dir=REHOST_DIR, timeout=REHOST_TIMEOUT, concurrency=REHOST_CONCURRENCY)
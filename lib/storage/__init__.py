@@ -0,0 +1,47 @@
+from os import getenv
+
+from exceptions import MissRequiredVariableError
+from lib.storage.base import BaseStorage
+from lib.storage.local import LocalStorage
+from lib.storage.s3 import S3Storage
+
+# 存储后端: local / s3
+STORAGE_BACKEND = getenv("STORAGE_BACKEND", "local").lower()
+# 本地存储目录，同时也是下载、切图的工作目录
+STORAGE_LOCAL_DIR = getenv("STORAGE_LOCAL_DIR", "downloads")
+STORAGE_PUBLIC_BASE_URL = getenv("STORAGE_PUBLIC_BASE_URL", "http://v2v.jifeng.online:8086/downloads/")
+
+S3_ENDPOINT = getenv("S3_ENDPOINT")
+S3_BUCKET = getenv("S3_BUCKET")
+S3_ACCESS_KEY = getenv("S3_ACCESS_KEY")
+S3_SECRET_KEY = getenv("S3_SECRET_KEY")
+S3_REGION = getenv("S3_REGION", "us-east-1")
+S3_PREFIX = getenv("S3_PREFIX", "")
+S3_PUBLIC_BASE_URL = getenv("S3_PUBLIC_BASE_URL")
+S3_PRESIGN_EXPIRES = int(getenv("S3_PRESIGN_EXPIRES") or 3600)
+S3_PART_SIZE = int(getenv("S3_PART_SIZE") or 8 * 1024 * 1024)
+S3_UPLOAD_CONCURRENCY = int(getenv("S3_UPLOAD_CONCURRENCY") or 4)
+
+
+def create_storage() -> BaseStorage:
+    if STORAGE_BACKEND == "s3":
+        if not all([S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY]):
+            raise MissRequiredVariableError(
+                "Missing required environment variable: [S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY]")
+        return S3Storage(
+            endpoint=S3_ENDPOINT,
+            bucket=S3_BUCKET,
+            access_key=S3_ACCESS_KEY,
+            secret_key=S3_SECRET_KEY,
+            region=S3_REGION,
+            public_base_url=S3_PUBLIC_BASE_URL,
+            presign_expires=S3_PRESIGN_EXPIRES,
+            part_size=S3_PART_SIZE,
+            upload_concurrency=S3_UPLOAD_CONCURRENCY,
+            prefix=S3_PREFIX,
+        )
+
+    return LocalStorage(STORAGE_LOCAL_DIR, STORAGE_PUBLIC_BASE_URL)
+
+
+storage = create_storage()
@@ -0,0 +1,55 @@
+from typing import AsyncIterator, Optional
+
+
+class BaseStorage:
+    """生成图片的存储后端接口"""
+
+    name = "base"
+
+    def public_url(self, key: str) -> str:
+        """对象的公开访问地址"""
+        raise NotImplementedError
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        """由公开地址反查对象 key，不属于当前存储时返回 None"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """对象在本地磁盘上的路径，非本地存储返回 None"""
+        return None
+
+    async def put_file(
+        self, key: str, path: str, content_type: Optional[str] = None, move: bool = False
+    ) -> str:
+        """
+        保存本地文件到存储，返回公开地址
+
+        Args:
+            key: 对象 key
+            path: 本地文件路径
+            content_type: 文件类型
+            move: 保存成功后是否删除本地文件
+        """
+        raise NotImplementedError
+
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> str:
+        """保存内存数据到存储，返回公开地址"""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> Optional[int]:
+        """对象大小（字节），不存在返回 None"""
+        raise NotImplementedError
+
+    def stream(self, key: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """按块读取对象内容"""
+        raise NotImplementedError
+
+    async def presign_url(self, key: str, expires: Optional[int] = None) -> str:
+        """生成带时效的访问地址，不支持签名的后端直接返回公开地址"""
+        return self.public_url(key)
+
+    async def close(self):
+        pass
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import shutil
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+
+from lib.storage.base import BaseStorage
+
+
+class LocalStorage(BaseStorage):
+    """本地磁盘存储，文件由 API 服务的 /downloads 路径对外提供"""
+
+    name = "local"
+
+    def __init__(self, root: str, public_base_url: str):
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/") + "/"
+        os.makedirs(self.root, exist_ok=True)
+
+    def public_url(self, key: str) -> str:
+        return self.public_base_url + key
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        if not url or not url.startswith(self.public_base_url):
+            return None
+        return url[len(self.public_base_url):].split("?")[0]
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = os.path.abspath(os.path.join(self.root, key))
+        # 防止 key 中的 ../ 越出存储目录
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            return None
+        return path
+
+    async def put_file(
+        self, key: str, path: str, content_type: Optional[str] = None, move: bool = False
+    ) -> str:
+        target = self.local_path(key)
+        if target is None:
+            raise ValueError(f"invalid storage key: {key}")
+
+        if os.path.abspath(path) != target:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if move:
+                await aiofiles.os.replace(path, target)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, shutil.copyfile, path, target)
+        return self.public_url(key)
+
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> str:
+        target = self.local_path(key)
+        if target is None:
+            raise ValueError(f"invalid storage key: {key}")
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        async with aiofiles.open(target, "wb") as f:
+            await f.write(data)
+        return self.public_url(key)
+
+    async def exists(self, key: str) -> bool:
+        path = self.local_path(key)
+        return path is not None and await aiofiles.os.path.isfile(path)
+
+    async def size(self, key: str) -> Optional[int]:
+        if not await self.exists(key):
+            return None
+        return (await aiofiles.os.stat(self.local_path(key))).st_size
+
+    async def stream(self, key: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+from xml.etree import ElementTree
+
+import aiofiles
+import aiohttp
+from loguru import logger
+from yarl import URL
+
+from lib.storage.base import BaseStorage
+
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 分片最小 5MB（最后一片除外）
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3Storage(BaseStorage):
+    """
+    S3 兼容对象存储（AWS S3 / MinIO / OSS 等）
+
+    使用 path-style 地址与 SigV4 签名，直接基于 aiohttp 实现，
+    大文件走异步分片上传。
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        public_base_url: Optional[str] = None,
+        presign_expires: int = 3600,
+        part_size: int = 8 * 1024 * 1024,
+        upload_concurrency: int = 4,
+        prefix: str = "",
+    ):
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.public_base_url = (public_base_url or f"{self.endpoint}/{bucket}").rstrip("/") + "/"
+        self.presign_expires = presign_expires
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.upload_concurrency = upload_concurrency
+        self.prefix = prefix.strip("/")
+        self._host = urlparse(self.endpoint).netloc
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    # ---------- 签名 ----------
+
+    def _object_path(self, key: str) -> str:
+        if self.prefix:
+            key = f"{self.prefix}/{key}"
+        return f"/{self.bucket}/{key}"
+
+    def _signing_key(self, date: str) -> bytes:
+        key = _hmac(("AWS4" + self.secret_key).encode("utf-8"), date)
+        key = _hmac(key, self.region)
+        key = _hmac(key, "s3")
+        return _hmac(key, "aws4_request")
+
+    def _signature(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        headers: Dict[str, str],
+        payload_hash: str,
+        now: datetime,
+    ) -> Tuple[str, str, str]:
+        """返回 (credential_scope, signed_headers, signature)"""
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        scope = f"{date}/{self.region}/s3/aws4_request"
+
+        canonical_query = "&".join(
+            f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items())
+        )
+        lower_headers = {k.lower(): v.strip() for k, v in headers.items()}
+        signed_headers = ";".join(sorted(lower_headers))
+        canonical_headers = "".join(f"{k}:{lower_headers[k]}\n" for k in sorted(lower_headers))
+        canonical_request = "\n".join([
+            method,
+            _quote(path, safe="/-_.~"),
+            canonical_query,
+            canonical_headers,
+            signed_headers,
+            payload_hash,
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signature = hmac.new(
+            self._signing_key(date), string_to_sign.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+        return scope, signed_headers, signature
+
+    def _url(self, path: str, query: Dict[str, str]) -> URL:
+        url = self.endpoint + _quote(path, safe="/-_.~")
+        if query:
+            url += "?" + "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+        return URL(url, encoded=True)
+
+    async def _request(
+        self,
+        method: str,
+        key: str,
+        query: Optional[Dict[str, str]] = None,
+        data=None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> aiohttp.ClientResponse:
+        query = query or {}
+        path = self._object_path(key)
+        now = datetime.now(timezone.utc)
+
+        if isinstance(data, (bytes, bytearray)):
+            payload_hash = hashlib.sha256(data).hexdigest()
+        elif data is None:
+            payload_hash = hashlib.sha256(b"").hexdigest()
+        else:
+            payload_hash = UNSIGNED_PAYLOAD
+
+        sign_headers = {
+            "host": self._host,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+        }
+        if headers:
+            sign_headers.update(headers)
+
+        scope, signed_headers, signature = self._signature(
+            method, path, query, sign_headers, payload_hash, now
+        )
+        sign_headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        # host 由 aiohttp 自动填写
+        sign_headers.pop("host")
+
+        session = await self._get_session()
+        return await session.request(method, self._url(path, query), data=data, headers=sign_headers)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=300),
+                connector=aiohttp.TCPConnector(limit_per_host=self.upload_concurrency * 2),
+            )
+        return self._session
+
+    # ---------- 接口实现 ----------
+
+    def public_url(self, key: str) -> str:
+        if self.prefix:
+            key = f"{self.prefix}/{key}"
+        return self.public_base_url + key
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        if not url or not url.startswith(self.public_base_url):
+            return None
+        key = url[len(self.public_base_url):].split("?")[0]
+        if self.prefix:
+            if not key.startswith(self.prefix + "/"):
+                return None
+            key = key[len(self.prefix) + 1:]
+        return key
+
+    async def presign_url(self, key: str, expires: Optional[int] = None) -> str:
+        """生成 SigV4 预签名 GET 地址"""
+        now = datetime.now(timezone.utc)
+        path = self._object_path(key)
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(expires or self.presign_expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+        _, _, signature = self._signature(
+            "GET", path, query, {"host": self._host}, UNSIGNED_PAYLOAD, now
+        )
+        query["X-Amz-Signature"] = signature
+        return str(self._url(path, query))
+
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> str:
+        headers = {"content-type": content_type} if content_type else None
+        async with await self._request("PUT", key, data=data, headers=headers) as resp:
+            if resp.status != 200:
+                raise IOError(f"S3 上传失败: {key} HTTP {resp.status} {await resp.text()}")
+        return self.public_url(key)
+
+    async def put_file(
+        self, key: str, path: str, content_type: Optional[str] = None, move: bool = False
+    ) -> str:
+        file_size = os.path.getsize(path)
+        if file_size <= self.part_size:
+            async with aiofiles.open(path, "rb") as f:
+                data = await f.read()
+            url = await self.put_bytes(key, data, content_type)
+        else:
+            url = await self._multipart_upload(key, path, file_size, content_type)
+
+        if move:
+            os.remove(path)
+        return url
+
+    async def _multipart_upload(
+        self, key: str, path: str, file_size: int, content_type: Optional[str]
+    ) -> str:
+        headers = {"content-type": content_type} if content_type else None
+        async with await self._request("POST", key, query={"uploads": ""}, headers=headers) as resp:
+            if resp.status != 200:
+                raise IOError(f"S3 创建分片上传失败: {key} HTTP {resp.status}")
+            upload_id = _xml_find(await resp.text(), "UploadId")
+
+        part_count = (file_size + self.part_size - 1) // self.part_size
+        etags: List[Optional[str]] = [None] * part_count
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+        async def upload_part(number: int):
+            async with semaphore:
+                async with aiofiles.open(path, "rb") as f:
+                    await f.seek((number - 1) * self.part_size)
+                    data = await f.read(self.part_size)
+                query = {"partNumber": str(number), "uploadId": upload_id}
+                async with await self._request("PUT", key, query=query, data=data) as resp:
+                    if resp.status != 200:
+                        raise IOError(f"S3 分片上传失败: {key} part {number} HTTP {resp.status}")
+                    etags[number - 1] = resp.headers.get("ETag")
+
+        try:
+            await asyncio.gather(*(upload_part(i) for i in range(1, part_count + 1)))
+
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{i}</PartNumber><ETag>{etag}</ETag></Part>"
+                for i, etag in enumerate(etags, start=1)
+            ) + "</CompleteMultipartUpload>"
+            query = {"uploadId": upload_id}
+            async with await self._request("POST", key, query=query, data=body.encode("utf-8")) as resp:
+                text = await resp.text()
+                # S3 可能在 200 响应体中返回错误
+                if resp.status != 200 or "<Error>" in text:
+                    raise IOError(f"S3 合并分片失败: {key} HTTP {resp.status} {text}")
+        except Exception:
+            logger.warning(f"⚠️ S3 分片上传中止: {key}")
+            try:
+                async with await self._request("DELETE", key, query={"uploadId": upload_id}):
+                    pass
+            except Exception as e:
+                logger.error(f"❌ S3 中止分片上传失败: {key} - {e}")
+            raise
+
+        logger.info(f"☁️ S3 分片上传完成: {key}, 大小: {file_size}, 分片数: {part_count}")
+        return self.public_url(key)
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def size(self, key: str) -> Optional[int]:
+        async with await self._request("HEAD", key) as resp:
+            if resp.status != 200:
+                return None
+            return int(resp.headers.get("Content-Length", 0))
+
+    async def stream(self, key: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        async with await self._request("GET", key) as resp:
+            if resp.status == 404:
+                raise FileNotFoundError(key)
+            if resp.status != 200:
+                raise IOError(f"S3 读取失败: {key} HTTP {resp.status}")
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+def _xml_find(text: str, tag: str) -> str:
+    """在 S3 返回的 XML 中查找标签，忽略命名空间"""
+    root = ElementTree.fromstring(text)
+    for elem in root.iter():
+        if elem.tag.split("}")[-1] == tag:
+            return elem.text or ""
+    raise IOError(f"S3 响应缺少 {tag}: {text}")
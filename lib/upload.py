@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from os import getenv
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
+
+import aiofiles
+from fastapi import UploadFile
+from loguru import logger
+
+from exceptions import UploadTooLargeError
+from lib.api import discord
+from lib.image import normalize_image
+from lib.media_cache import attachment_expires_at
+from util.cache import TTLCache
+
+UPLOAD_MAX_BYTES = int(getenv("UPLOAD_MAX_MB") or 20) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(getenv("UPLOAD_CONCURRENCY") or 8)
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# 相同内容重复上传的去重缓存
+UPLOAD_DEDUP_MAX_ENTRIES = int(getenv("UPLOAD_DEDUP_MAX_ENTRIES") or 10000)
+UPLOAD_DEDUP_TTL = int(getenv("UPLOAD_DEDUP_TTL") or 600)
+UPLOAD_DEDUP_FILE = getenv("UPLOAD_DEDUP_FILE")
+# 附件地址距过期不足该秒数时不再复用
+UPLOAD_DEDUP_EXPIRE_MARGIN = 600
+
+# 上传前归一化：最长边、编码格式（jpeg / webp）、质量；UPLOAD_NORMALIZE=false 时原样上传
+UPLOAD_NORMALIZE = (getenv("UPLOAD_NORMALIZE") or "true").lower() in ("1", "true", "yes")
+UPLOAD_MAX_EDGE = int(getenv("UPLOAD_MAX_EDGE") or 2048)
+UPLOAD_FORMAT = (getenv("UPLOAD_FORMAT") or "jpeg").lower()
+UPLOAD_QUALITY = int(getenv("UPLOAD_QUALITY") or 90)
+UPLOAD_EXT = "jpg" if UPLOAD_FORMAT == "jpeg" else UPLOAD_FORMAT
+
+
+async def upload_file_size(file: UploadFile) -> int:
+    """上传文件的实际大小，请求未带大小时定位到临时文件末尾获取"""
+    if file.size is not None:
+        return file.size
+    loop = asyncio.get_running_loop()
+    size = await loop.run_in_executor(None, file.file.seek, 0, os.SEEK_END)
+    await file.seek(0)
+    return size
+
+
+def _hash_file(file) -> str:
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+async def upload_file_digest(file: UploadFile) -> str:
+    """上传内容的 SHA-256，在线程池中读取临时文件"""
+    return await asyncio.get_running_loop().run_in_executor(None, _hash_file, file.file)
+
+
+def open_file_stream(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """返回读取本地文件的迭代器工厂，每次调用都从头读取"""
+    async def stream() -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    return stream
+
+
+async def normalize_upload(src, size: int) -> Optional[Tuple[str, int]]:
+    """
+    在线程池中归一化图片，返回 (临时文件路径, 大小)，调用方负责删除临时文件
+
+    未开启、解码失败或结果不比原图小时返回 None，按原图上传。
+    """
+    if not UPLOAD_NORMALIZE:
+        return None
+    fd, output_path = tempfile.mkstemp(suffix=f".{UPLOAD_EXT}")
+    os.close(fd)
+    loop = asyncio.get_running_loop()
+    try:
+        if hasattr(src, "seek"):
+            src.seek(0)
+        output_size = await loop.run_in_executor(
+            None, normalize_image, src, output_path, UPLOAD_MAX_EDGE, UPLOAD_FORMAT, UPLOAD_QUALITY
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ 图片归一化失败，按原图上传: {e}")
+        output_size = None
+    finally:
+        if hasattr(src, "seek"):
+            src.seek(0)
+    if output_size is None or output_size >= size:
+        os.remove(output_path)
+        return None
+    return output_path, output_size
+
+
+def open_upload_stream(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """返回读取上传文件的迭代器工厂，每次调用都从头读取，供失败重试使用"""
+    async def stream() -> AsyncIterator[bytes]:
+        await file.seek(0)
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    return stream
+
+
+class UploadDedupCache:
+    """
+    上传内容去重缓存
+
+    内容哈希 -> 已发送消息的附件地址 picurl，有效期取地址的 ex 参数，可持久化到 JSON 文件。
+    upload_filename 只能被 /message 或 /describe 使用一次，不能返回给其他请求复用，
+    这里只记录 upload_filename -> 内容哈希（有效期 UPLOAD_DEDUP_TTL），发送消息后关联 picurl。
+    """
+
+    def __init__(self, maxsize: int, upload_ttl: int, path: Optional[str]) -> None:
+        self._filenames: TTLCache[str, str] = TTLCache(maxsize=maxsize, ttl=upload_ttl)
+        self._messages: TTLCache[str, str] = TTLCache(maxsize=maxsize)
+        self._path = path
+        self._metrics = {"hits": 0, "misses": 0}
+
+    def get(self, digest: str) -> Optional[str]:
+        """相同内容已发送过且地址未过期时返回 picurl"""
+        picurl = self._messages.get(digest)
+        if picurl:
+            self._metrics["hits"] += 1
+        else:
+            self._metrics["misses"] += 1
+        return picurl
+
+    def set_upload(self, digest: str, upload_filename: str):
+        self._filenames.set(upload_filename, digest)
+
+    def set_message(self, upload_filename: str, picurl: str):
+        """记录 upload_filename 发送后得到的附件地址"""
+        digest = self._filenames.pop(upload_filename)
+        if not digest:
+            return
+        expires_at = attachment_expires_at(picurl)
+        ttl = None if expires_at is None else expires_at - UPLOAD_DEDUP_EXPIRE_MARGIN - time.time()
+        if ttl is not None and ttl <= 0:
+            return
+        self._messages.set(digest, picurl, ttl)
+
+    def load(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                entries = json.load(f)
+            now = time.time()
+            for digest, picurl, expires_at in entries:
+                if expires_at is None:
+                    self._messages.set(digest, picurl)
+                elif expires_at > now:
+                    self._messages.set(digest, picurl, expires_at - now)
+            logger.info(f"📂 已加载上传去重缓存: {len(self._messages)} 条")
+        except Exception as e:
+            logger.warning(f"⚠️ 上传去重缓存加载失败: {e}")
+
+    def save(self):
+        if not self._path:
+            return
+        now = time.time()
+        entries = [
+            (digest, picurl, None if remaining is None else now + remaining)
+            for digest, picurl, remaining in self._messages.items()
+        ]
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self._path)
+        except Exception as e:
+            logger.warning(f"⚠️ 上传去重缓存保存失败: {e}")
+
+    def get_status(self):
+        return {
+            "pending": len(self._filenames),
+            "messages": len(self._messages),
+            **self._metrics,
+        }
+
+
+upload_dedup = UploadDedupCache(
+    maxsize=UPLOAD_DEDUP_MAX_ENTRIES,
+    upload_ttl=UPLOAD_DEDUP_TTL,
+    path=UPLOAD_DEDUP_FILE,
+)
+
+
+class AttachmentUploader:
+    """
+    Discord 附件上传
+
+    从 UploadFile 的临时文件按块读取并流式 PUT 到 upload_url，不把整张图读入内存；
+    并发上传数受信号量限制，超过大小限制的文件直接拒绝。
+    调用方开启 dedup 且相同内容命中去重缓存时直接返回 picurl，不访问 Discord。
+    上传前先缩放并重新编码，减少经代理上传到 Discord 的字节数。
+    """
+
+    def __init__(self, max_bytes: int, concurrency: int) -> None:
+        self.max_bytes = max_bytes
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._metrics = {
+            "uploads": 0,
+            "failures": 0,
+            "rejected": 0,
+            "active": 0,
+            "bytes": 0,               # 实际上传字节数
+            "original_bytes": 0,      # 归一化前字节数
+            "normalize_seconds": 0.0,
+            "upload_seconds": 0.0,
+        }
+
+    async def upload(
+        self, filename: str, file: UploadFile, dedup: bool = False
+    ) -> Optional[Dict[str, Union[str, int]]]:
+        file_size = await upload_file_size(file)
+        if file_size > self.max_bytes:
+            self._metrics["rejected"] += 1
+            raise UploadTooLargeError(
+                f"file too large: {file_size} bytes, limit {self.max_bytes} bytes"
+            )
+
+        # 未开启 dedup 时仍记录内容哈希，供之后开启 dedup 的请求复用
+        digest = await upload_file_digest(file)
+        picurl = upload_dedup.get(digest) if dedup else None
+        if picurl:
+            return {"picurl": picurl}
+
+        started = time.perf_counter()
+        normalized = await normalize_upload(file.file, file_size)
+        normalize_seconds = time.perf_counter() - started
+        if normalized:
+            body_path, body_size = normalized
+            filename = f"{os.path.splitext(filename)[0]}.{UPLOAD_EXT}"
+            body = open_file_stream(body_path)
+        else:
+            body_path, body_size = None, file_size
+            body = open_upload_stream(file)
+
+        try:
+            attachment, upload_seconds = await self._upload(filename, body_size, body)
+        finally:
+            if body_path:
+                os.remove(body_path)
+
+        if not attachment:
+            self._metrics["failures"] += 1
+            logger.warning(f"⚠️ 附件上传失败: {filename}")
+            return None
+        self._record(file_size, body_size, normalize_seconds, upload_seconds)
+        if attachment.get("upload_filename"):
+            upload_dedup.set_upload(digest, attachment["upload_filename"])
+        return attachment
+
+    async def _upload(self, filename: str, size: int, body) -> Tuple[Optional[Dict], float]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        async with self._semaphore:
+            self._metrics["active"] += 1
+            started = time.perf_counter()
+            try:
+                return await discord.upload_attachment(filename, size, body), time.perf_counter() - started
+            finally:
+                self._metrics["active"] -= 1
+
+    def _record(self, original_size: int, size: int, normalize_seconds: float, upload_seconds: float):
+        self._metrics["uploads"] += 1
+        self._metrics["bytes"] += size
+        self._metrics["original_bytes"] += original_size
+        self._metrics["normalize_seconds"] += normalize_seconds
+        self._metrics["upload_seconds"] += upload_seconds
+        if size < original_size:
+            # 按本次上传速率估算原图需要的上传时间
+            saved_seconds = upload_seconds * (original_size - size) / max(size, 1)
+            logger.info(
+                f"🗜️ 上传归一化 - {original_size / 1024:.0f}KB -> {size / 1024:.0f}KB "
+                f"(节省 {(1 - size / original_size) * 100:.0f}%), 归一化 {normalize_seconds * 1000:.0f}ms, "
+                f"上传 {upload_seconds * 1000:.0f}ms, 约节省上传 {saved_seconds * 1000:.0f}ms"
+            )
+
+    def get_status(self):
+        original = self._metrics["original_bytes"]
+        return {
+            "concurrency": self._concurrency,
+            "max_bytes": self.max_bytes,
+            **self._metrics,
+            "saved_ratio": round(1 - self._metrics["bytes"] / original, 4) if original else 0,
+            "dedup": upload_dedup.get_status(),
+        }
+
+
+uploader = AttachmentUploader(max_bytes=UPLOAD_MAX_BYTES, concurrency=UPLOAD_CONCURRENCY)
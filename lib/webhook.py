@@ -0,0 +1,287 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from os import getenv
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+from loguru import logger
+
+from lib.storage import storage
+from util.net import PublicResolver, UnsafeAddressError, check_public_url
+
+# 每个目标地址（scheme://host:port）独立的队列长度、并发上限与重试次数
+WEBHOOK_QUEUE_SIZE = int(getenv("WEBHOOK_QUEUE_SIZE") or 1000)
+WEBHOOK_CONCURRENCY = int(getenv("WEBHOOK_CONCURRENCY") or 2)
+WEBHOOK_MAX_RETRY = int(getenv("WEBHOOK_MAX_RETRY") or 5)
+WEBHOOK_TIMEOUT = float(getenv("WEBHOOK_TIMEOUT") or 10)
+# 连续失败达到阈值后熔断，冷却期内不再请求该地址，冷却结束后放行一个探测请求
+WEBHOOK_FAILURE_THRESHOLD = int(getenv("WEBHOOK_FAILURE_THRESHOLD") or 5)
+WEBHOOK_RESET_TIMEOUT = float(getenv("WEBHOOK_RESET_TIMEOUT") or 60)
+# 附带图片的回调（multipart/form-data）的请求超时（秒）与读取存储的分块大小
+WEBHOOK_IMAGE_TIMEOUT = float(getenv("WEBHOOK_IMAGE_TIMEOUT") or 120)
+WEBHOOK_IMAGE_CHUNK_SIZE = 64 * 1024
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        """距离允许下一次请求的秒数，0 表示可以立即请求"""
+        if self.state == "closed":
+            return 0
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self.state = "half_open"
+        # half_open 只放行一个探测请求
+        if self._probing:
+            return 1
+        self._probing = True
+        return 0
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，本次由关闭或半开转为熔断时返回 True"""
+        self.failures += 1
+        self._probing = False
+        if self.state != "open" and (self.state == "half_open" or self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+class Destination:
+    def __init__(self, key: str, queue_size: int, breaker: CircuitBreaker) -> None:
+        self.key = key
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.queue_size = queue_size
+        self.breaker = breaker
+        self.workers: Set[asyncio.Task] = set()
+        self.stats = {
+            "delivered": 0, "failed": 0, "dropped": 0, "retried": 0, "latency_ms": 0.0, "image_bytes": 0,
+        }
+
+
+class WebhookDispatcher:
+    """
+    按租户回调地址推送任务结果
+
+    每个目标地址有独立的有界队列、并发上限和熔断器，worker 按需创建、队列为空时退出；
+    慢速或不可用的地址只会占满自己的队列，不影响其他租户。队列已满时丢弃最旧的事件。
+    只推送到公网地址：发送前解析并检查目标主机，连接时由 PublicResolver 再次校验，不跟随重定向。
+    附带图片的事件在队列中只保存存储 key，每次发送时从存储按块读取，不在内存中缓存整张图片。
+    """
+
+    def __init__(self, queue_size: int, concurrency: int, max_retry: int, timeout: float,
+                 failure_threshold: int, reset_timeout: float) -> None:
+        self._queue_size = queue_size
+        self._concurrency = concurrency
+        self._max_retry = max_retry
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._image_timeout = aiohttp.ClientTimeout(total=WEBHOOK_IMAGE_TIMEOUT)
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._destinations: Dict[str, Destination] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._closed = False
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(
+                    limit=0, limit_per_host=self._concurrency, keepalive_timeout=60, resolver=PublicResolver()
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        self._closed = True
+        workers = [task for dest in self._destinations.values() for task in dest.workers]
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def dispatch(self, url: str, payload: Dict[str, Any], files: Optional[List[Tuple[str, str, str]]] = None):
+        """
+        投递回调事件
+
+        Args:
+            url: 回调地址
+            payload: 事件内容
+            files: 附带的图片 [(表单字段名, 存储 key, content_type)]，不为空时以 multipart/form-data 发送
+        """
+        if self._closed:
+            return
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc}"
+        dest = self._destinations.get(key)
+        if dest is None:
+            dest = self._destinations[key] = Destination(
+                key, self._queue_size, CircuitBreaker(self._failure_threshold, self._reset_timeout)
+            )
+        if len(dest.queue) >= dest.queue_size:
+            dropped = dest.queue.popleft()
+            dest.stats["dropped"] += 1
+            logger.warning(f"⚠️ 回调队列已满，丢弃最旧事件: {key} task_id={dropped['payload'].get('task_id')}")
+        dest.queue.append({"url": url, "payload": payload, "files": files, "attempt": 0})
+        self._spawn(dest)
+
+    def _spawn(self, dest: Destination):
+        while len(dest.workers) < min(self._concurrency, len(dest.queue)):
+            task = asyncio.get_running_loop().create_task(self._worker(dest))
+            dest.workers.add(task)
+            task.add_done_callback(dest.workers.discard)
+
+    async def _worker(self, dest: Destination):
+        while dest.queue:
+            wait = dest.breaker.retry_after()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            item = dest.queue.popleft()
+            item["attempt"] += 1
+            ok, error = await self._post(dest, item)
+            if ok:
+                dest.breaker.record_success()
+                dest.stats["delivered"] += 1
+                continue
+            if isinstance(error, UnsafeAddressError):
+                # 目标不是公网地址，重试无意义，也不计入熔断
+                dest.stats["failed"] += 1
+                logger.error(f"❌ 回调地址不允许访问，已放弃: {item['url']} task_id={item['payload'].get('task_id')} - {error}")
+                continue
+
+            if dest.breaker.record_failure():
+                logger.warning(f"🔌 回调地址已熔断 {self._reset_timeout:.0f}s: {dest.key}")
+            if item["attempt"] <= self._max_retry:
+                dest.stats["retried"] += 1
+                delay = min(2 ** item["attempt"], 60) * (0.5 + random.random() / 2)
+                asyncio.get_running_loop().call_later(delay, self._requeue, dest, item)
+            else:
+                dest.stats["failed"] += 1
+                logger.error(f"❌ 回调推送失败，已放弃: {item['url']} task_id={item['payload'].get('task_id')} - {error}")
+
+    def _requeue(self, dest: Destination, item: Dict[str, Any]):
+        if self._closed:
+            return
+        if len(dest.queue) >= dest.queue_size:
+            dest.stats["dropped"] += 1
+            return
+        dest.queue.append(item)
+        self._spawn(dest)
+
+    async def _post(self, dest: Destination, item: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            await check_public_url(item["url"])
+            if item["files"]:
+                data, size = await self._multipart(item)
+                request = self._get_session().post(
+                    item["url"], data=data, timeout=self._image_timeout, allow_redirects=False
+                )
+            else:
+                size = 0
+                request = self._get_session().post(item["url"], json=item["payload"], allow_redirects=False)
+            async with request as resp:
+                if 200 <= resp.status < 300:
+                    dest.stats["image_bytes"] += size
+                    return True, None
+                return False, f"HTTP {resp.status}"
+        except UnsafeAddressError as e:
+            return False, e
+        except aiohttp.ClientConnectorError as e:
+            # 连接时 PublicResolver 拒绝的地址
+            if isinstance(e.os_error, UnsafeAddressError):
+                return False, e.os_error
+            return False, e.__class__.__name__
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            return False, e.__class__.__name__
+        finally:
+            dest.stats["latency_ms"] = (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    async def _multipart(item: Dict[str, Any]) -> Tuple[aiohttp.MultipartWriter, int]:
+        """
+        组装 multipart/form-data 请求体：payload 字段为事件 JSON，其余字段为图片
+
+        图片以存储的异步分块读取作为请求体，边读边发；每次重试都重新打开。
+        存储中不存在的对象（例如尚未生成的预览图）跳过，并从 payload 的 images 中省略。
+        """
+        images = []
+        for name, key, content_type in item["files"]:
+            size = await storage.size(key)
+            if size is not None:
+                images.append((name, key, content_type, size))
+
+        writer = aiohttp.MultipartWriter("form-data")
+        payload = dict(item["payload"], images=[
+            {"field": name, "filename": os.path.basename(key), "content_type": content_type, "size": size}
+            for name, key, content_type, size in images
+        ])
+        writer.append_json(payload).set_content_disposition("form-data", name="payload")
+        for name, key, content_type, size in images:
+            part = writer.append(
+                storage.stream(key, WEBHOOK_IMAGE_CHUNK_SIZE),
+                {"Content-Type": content_type},
+            )
+            part.set_content_disposition("form-data", name=name, filename=os.path.basename(key))
+        return writer, sum(image[3] for image in images)
+
+    def notify(self, task: Optional[Dict[str, Any]], status: str,
+               files: Optional[List[Tuple[str, str, str]]] = None, **fields):
+        """任务状态变化时推送到任务的回调地址，未配置回调地址时忽略；files 见 dispatch"""
+        if not task or not task.get("callback_url"):
+            return
+        payload = {
+            "task_id": task.get("task_id"),
+            "trigger_id": task.get("trigger_id"),
+            "task_type": task.get("task_type"),
+            "status": status,
+            "timestamp": int(datetime.now().timestamp() * 1000),
+            **fields,
+        }
+        self.dispatch(task["callback_url"], payload, files)
+
+    def get_status(self):
+        return {
+            key: {
+                "state": dest.breaker.state,
+                "queued": len(dest.queue),
+                "workers": len(dest.workers),
+                **dest.stats,
+            }
+            for key, dest in self._destinations.items()
+        }
+
+
+webhook = WebhookDispatcher(
+    queue_size=WEBHOOK_QUEUE_SIZE,
+    concurrency=WEBHOOK_CONCURRENCY,
+    max_retry=WEBHOOK_MAX_RETRY,
+    timeout=WEBHOOK_TIMEOUT,
+    failure_threshold=WEBHOOK_FAILURE_THRESHOLD,
+    reset_timeout=WEBHOOK_RESET_TIMEOUT,
+)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+回调发件箱管理脚本
+用于查看 bot 回调日志中的待投递事件与死信，并重新投递死信
+
+重放只是把死信放回待投递表，由运行中的 bot 在下一轮补充时发送（bot 未运行时在下次启动后发送）。
+"""
+
+import json
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import __init__  # noqa
+from lib.api.journal import journal
+
+
+def parse_ids(args):
+    try:
+        return [int(arg) for arg in args]
+    except ValueError:
+        print("❌ 事件ID必须是整数")
+        sys.exit(1)
+
+
+def show_stats():
+    print(f"📮 日志文件: {journal.path}")
+    print(f"   待投递: {journal.pending_count()}")
+    print(f"   死信: {journal.dead_count()}")
+
+
+def list_dead_letters(limit: int):
+    letters = journal.dead_letters(limit)
+    if not letters:
+        print("✅ 没有死信")
+        return
+    for letter in letters:
+        payload = json.loads(letter["payload"])
+        failed_at = datetime.fromtimestamp(letter["failed_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"#{letter['id']} [{failed_at}] {letter['url']}")
+        print(f"   类型: {payload.get('type', '-')}, trigger_id: {payload.get('trigger_id', '-')}, "
+              f"尝试次数: {letter['attempts']}, 错误: {letter['last_error']}")
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  python manage_outbox.py stats               # 待投递与死信数量")
+        print("  python manage_outbox.py dead [limit]        # 列出死信")
+        print("  python manage_outbox.py replay [id ...]     # 重新投递死信（不传ID时全部）")
+        print("  python manage_outbox.py purge [id ...]      # 删除死信（不传ID时全部）")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    try:
+        if command == "stats":
+            show_stats()
+
+        elif command == "dead":
+            limit = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+            list_dead_letters(limit)
+
+        elif command == "replay":
+            count = journal.replay(parse_ids(sys.argv[2:]))
+            print(f"✅ 已重新放入待投递: {count} 条")
+
+        elif command == "purge":
+            count = journal.purge(parse_ids(sys.argv[2:]))
+            print(f"✅ 已删除死信: {count} 条")
+
+        else:
+            print(f"❌ 未知命令: {command}")
+
+    except Exception as e:
+        print(f"❌ 执行命令时发生错误: {e}")
+
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ from datetime import datetime
 # 导入项目模块
 from lib.database import connect_db, disconnect_db, create_tables
 from lib.db_operations import user_ops
+from util.net import UnsafeAddressError, check_public_url
 
 
 def generate_app_key(length=32):
@@ -68,6 +69,7 @@ async def get_user_info(identifier: str, by_username: bool = True):
             print(f"   总Token数: {user['token_total']}")
             print(f"   已使用Token: {user['token_use']}")
             print(f"   剩余Token: {user['token_total'] - user['token_use']}")
+            print(f"   回调地址: {user.get('callback_url') or '-'}")
             print(f"   创建时间: {user['created_at']}")
             print(f"   更新时间: {user['updated_at']}")
             return user
@@ -135,6 +137,39 @@ async def reset_user_usage(app_key: str):
         return False
 
 
+async def update_user_callback(app_key: str, callback_url: str):
+    """设置用户默认的结果回调地址，传空字符串时清除"""
+    try:
+        if callback_url and not callback_url.startswith(("http://", "https://")):
+            print(f"❌ 回调地址必须以 http:// 或 https:// 开头")
+            return False
+        if callback_url:
+            try:
+                await check_public_url(callback_url)
+            except UnsafeAddressError as e:
+                print(f"❌ 回调地址不是公网地址: {e}（内网地址需加入 SSRF_ALLOWLIST）")
+                return False
+
+        from lib.database import database, user_info
+        query = user_info.update().where(
+            user_info.c.app_key == app_key
+        ).values(
+            callback_url=callback_url,
+            updated_at=datetime.now()
+        )
+        result = await database.execute(query)
+        
+        if result > 0:
+            print(f"✅ 回调地址更新成功: {callback_url or '（已清除）'}")
+            return True
+        else:
+            print(f"❌ 回调地址更新失败")
+            return False
+    except Exception as e:
+        print(f"❌ 更新回调地址时发生错误: {e}")
+        return False
+
+
 async def main():
     """主函数"""
     if len(sys.argv) < 2:
@@ -144,6 +179,7 @@ async def main():
         print("  python manage_users.py info-key <app_key>               # 查询用户信息（按App Key）")
         print("  python manage_users.py update-tokens <app_key> <total>  # 更新Token总数")
         print("  python manage_users.py reset-usage <app_key>            # 重置使用量")
+        print("  python manage_users.py set-callback <app_key> [url]     # 设置回调地址（不传url时清除）")
         sys.exit(1)
     
     # 连接数据库
@@ -190,6 +226,14 @@ async def main():
             app_key = sys.argv[2]
             await reset_user_usage(app_key)
         
+        elif command == "set-callback":
+            if len(sys.argv) < 3:
+                print("❌ 请提供App Key")
+                return
+            app_key = sys.argv[2]
+            callback_url = sys.argv[3] if len(sys.argv) > 3 else ""
+            await update_user_callback(app_key, callback_url)
+        
         else:
             print(f"❌ 未知命令: {command}")
     
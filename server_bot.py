@@ -0,0 +1,11 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import __init__  # noqa
+from app import server
+
+api_app = server.init_app(with_bot=True)
+
+
+if __name__ == '__main__':
+    server.run("0.0.0.0", 8086, with_bot=True)
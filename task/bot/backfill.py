@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+from os import getenv
+from typing import Awaitable, Callable, Dict, Optional
+
+import discord
+from discord import Message
+from loguru import logger
+
+# 每个频道最后处理的消息 ID，重连后从这里补拉断线期间的消息
+BOT_STATE_FILE = getenv("BOT_STATE_FILE") or "bot_state.json"
+BOT_STATE_FLUSH_INTERVAL = float(getenv("BOT_STATE_FLUSH_INTERVAL") or 5)
+# 每个频道单次最多补拉的消息数与同时补拉的频道数
+BACKFILL_LIMIT = int(getenv("BOT_BACKFILL_LIMIT") or 500)
+BACKFILL_CONCURRENCY = int(getenv("BOT_BACKFILL_CONCURRENCY") or 2)
+
+
+class ChannelCursor:
+    """
+    频道消息游标
+
+    只前进不后退，变化后由后台定时写入状态文件（先写临时文件再替换），进程重启后继续使用。
+    """
+
+    def __init__(self, path: str, flush_interval: float) -> None:
+        self.path = path
+        self._flush_interval = flush_interval
+        self._last: Dict[str, int] = self._load()
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict[str, int]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return {str(key): int(value) for key, value in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"⚠️ 频道游标文件无法读取，将不补拉历史消息: {self.path} - {e}")
+            return {}
+
+    def _save(self, data: Dict[str, int]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def advance(self, channel_id: int, message_id: int):
+        key = str(channel_id)
+        if message_id > self._last.get(key, 0):
+            self._last[key] = message_id
+            self._dirty = True
+
+    def channels(self) -> Dict[int, int]:
+        return {int(key): value for key, value in self._last.items()}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._save, dict(self._last))
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"❌ 频道游标写入失败: {self.path} - {e}")
+
+
+class Backfiller:
+    """
+    断线补拉
+
+    on_ready / on_resumed 时按游标分页读取各频道之后的历史消息，交给正常的消息处理函数；
+    重复事件由 handler 的去重窗口丢弃。同一时间只运行一轮补拉。
+    """
+
+    def __init__(self, cursor: ChannelCursor, limit: int, concurrency: int) -> None:
+        self._cursor = cursor
+        self._limit = limit
+        self._concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, bot: discord.Client, replay: Callable[[Message], Awaitable[None]]):
+        """在后台补拉，不阻塞事件处理"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self.run(bot, replay))
+
+    async def run(self, bot: discord.Client, replay: Callable[[Message], Awaitable[None]]):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        await asyncio.gather(*(
+            self._channel(bot, channel_id, last_id, semaphore, replay)
+            for channel_id, last_id in self._cursor.channels().items()
+        ))
+
+    async def _channel(self, bot: discord.Client, channel_id: int, last_id: int,
+                       semaphore: asyncio.Semaphore, replay: Callable[[Message], Awaitable[None]]):
+        async with semaphore:
+            count = 0
+            try:
+                channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+                # 同一频道按时间顺序逐条处理，保证 start 先于 end
+                async for message in channel.history(
+                        limit=self._limit, after=discord.Object(id=last_id), oldest_first=True
+                ):
+                    count += 1
+                    try:
+                        await replay(message)
+                    except Exception as e:
+                        logger.error(f"❌ 补拉消息处理失败: {message.id} - {e}")
+                    self._cursor.advance(channel_id, message.id)
+            except (discord.HTTPException, discord.ClientException) as e:
+                logger.error(f"❌ 补拉频道消息失败: {channel_id} - {e}")
+                return
+
+            if count:
+                logger.info(f"🔁 已补拉频道 {channel_id} 断线期间的消息: {count} 条")
+            if count >= self._limit:
+                logger.warning(f"⚠️ 频道 {channel_id} 补拉达到上限 {self._limit} 条，之后的消息未补拉")
+
+
+cursor = ChannelCursor(BOT_STATE_FILE, BOT_STATE_FLUSH_INTERVAL)
+backfiller = Backfiller(cursor, BACKFILL_LIMIT, BACKFILL_CONCURRENCY)
@@ -1,17 +1,32 @@
 import asyncio
+import hashlib
 import re
-from typing import Dict, Union, Any
+from os import getenv
+from typing import Dict, Tuple, Union, Any
 
 from discord import Message
+from loguru import logger
 
 from app.handler import PROMPT_PREFIX, PROMPT_SUFFIX
 from lib.api.callback import queue_release, callback
+from task.bot import TriggerStatus
 from task.bot._typing import CallbackData, Attachment, Embed
+from util.cache import TTLCache
 
 TRIGGER_ID_PATTERN = f"{PROMPT_PREFIX}(\w+?){PROMPT_SUFFIX}"  # 消息 ID 正则
+GENERATING_PATTERN = re.compile(r"\(\d{1,3}%\)")  # 生成中的进度，如 "(31%)"
 
 TEMP_MAP: Dict[str, bool] = {}  # 临时存储消息流转信息
 
+# 已处理事件的去重窗口：网关 resume 后的重放、内容未变化的重复编辑
+DEDUP_SIZE = int(getenv("BOT_DEDUP_SIZE") or 10000)
+DEDUP_TTL = float(getenv("BOT_DEDUP_TTL") or 3600)
+# 同一任务生成进度回调的最小间隔（秒），0 表示不限制
+GENERATING_INTERVAL = float(getenv("BOT_GENERATING_INTERVAL") or 2)
+
+SEEN_EVENTS: TTLCache[Tuple[int, str, str], bool] = TTLCache(maxsize=DEDUP_SIZE, ttl=DEDUP_TTL)
+LAST_GENERATING: TTLCache[str, bool] = TTLCache(maxsize=DEDUP_SIZE, ttl=GENERATING_INTERVAL)
+
 
 def get_temp(trigger_id: str):
     return TEMP_MAP.get(trigger_id)
@@ -21,14 +36,45 @@ def set_temp(trigger_id: str):
     TEMP_MAP[trigger_id] = True
 
 
-def pop_temp(trigger_id: str):
-    asyncio.get_event_loop().create_task(queue_release(trigger_id))
+def pop_temp(trigger_id: str, msg_id: int):
+    asyncio.get_event_loop().create_task(queue_release(trigger_id, msg_id))
     try:
         TEMP_MAP.pop(trigger_id)
     except KeyError:
         pass
 
 
+def message_digest(message: Message) -> str:
+    """消息内容、附件与 embed 图片的摘要，区分同一条消息的不同编辑"""
+    digest = hashlib.blake2b(message.content.encode(), digest_size=8)
+    for attachment in message.attachments:
+        digest.update(f"|{attachment.id}".encode())
+    for embed in message.embeds:
+        digest.update(f"|{embed.description}|{embed.image.url}".encode())
+    return digest.hexdigest()
+
+
+def is_duplicate(trigger_id: str, trigger_status: str, message: Message) -> bool:
+    """
+    判断事件是否需要丢弃，需在 pop_temp / 回调之前调用
+
+    (消息 ID, 状态, 内容摘要) 已处理过的事件直接丢弃；
+    生成中的编辑每个任务在 GENERATING_INTERVAL 内只回调一次，被限流的编辑不记为已处理。
+    """
+    key = (message.id, trigger_status, message_digest(message))
+    if key in SEEN_EVENTS:
+        logger.debug(f"重复事件已丢弃: {trigger_id} {trigger_status} message_id={message.id}")
+        return True
+
+    if trigger_status == TriggerStatus.generating.value and GENERATING_INTERVAL > 0:
+        if trigger_id in LAST_GENERATING:
+            return True
+        LAST_GENERATING.set(trigger_id, True)
+
+    SEEN_EVENTS.set(key, True)
+    return False
+
+
 def match_trigger_id(content: str) -> Union[str, None]:
     match = re.findall(TRIGGER_ID_PATTERN, content)
     return match[0] if match else None
@@ -48,9 +94,13 @@ async def callback_trigger(trigger_id: str, trigger_status: str, message: Messag
     ))
 
 
-async def callback_describe(trigger_status: str, message: Message, embed: Dict[str, Any]):
+def match_describe_trigger_id(embed: Dict[str, Any]) -> str:
     url = embed.get("image", {}).get("url")
-    trigger_id = url.split("/")[-1].split(".")[0]
+    return url.split("/")[-1].split(".")[0]
+
+
+async def callback_describe(trigger_status: str, message: Message, embed: Dict[str, Any]):
+    trigger_id = match_describe_trigger_id(embed)
 
     await callback(CallbackData(
         type=trigger_status,
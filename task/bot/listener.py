@@ -3,9 +3,14 @@ from discord import Intents, Message
 from discord.ext import commands
 from loguru import logger
 from lib.api import PROXY_URL
+from lib.api.outbox import outbox
 from task.bot import TriggerStatus
+from task.bot.backfill import backfiller, cursor
 from task.bot.handler import (
+    GENERATING_PATTERN,
     match_trigger_id,
+    match_describe_trigger_id,
+    is_duplicate,
     set_temp,
     pop_temp,
     get_temp,
@@ -34,9 +39,31 @@ async def on_ready():
     for guild in bot.guilds:
         logger.info(f"  - 服务器: {guild.name} (ID: {guild.id})")
         
+    # 启动回调发件箱，继续投递上次退出前未送达的回调
+    outbox.start()
+    cursor.start()
+    backfiller.start(bot, replay_message)
     logger.info("🎯 开始监听Midjourney Bot消息...")
 
 
+@bot.event
+async def on_resumed():
+    logger.info("🔗 Bot会话已恢复")
+    backfiller.start(bot, replay_message)
+
+
+async def replay_message(message: Message):
+    """补拉的历史消息是当前状态：生成中或 describe 结果按编辑事件处理，其余按新消息处理"""
+    if message.embeds or GENERATING_PATTERN.search(message.content):
+        # 断线期间开始的任务没有收到 Waiting to start，补记以便识别之后的删除（敏感词）
+        trigger_id = match_trigger_id(message.content)
+        if trigger_id and get_temp(trigger_id) is None:
+            set_temp(trigger_id)
+        await on_message_edit(message, message)
+    else:
+        await on_message(message)
+
+
 @bot.event
 async def on_connect():
     logger.info("🔗 Bot已连接到Discord")
@@ -45,6 +72,7 @@ async def on_connect():
 @bot.event
 async def on_disconnect():
     logger.warning("🔌 Bot与Discord断开连接")
+    await cursor.flush()
 
 
 @bot.event
@@ -90,6 +118,7 @@ async def on_message(message: Message):
         return
 
     logger.info(f"✅ 收到Midjourney Bot消息: {message.content}")
+    cursor.advance(message.channel.id, message.id)
     logger.debug(f"on_message embeds: {message.embeds[0].to_dict() if message.embeds else message.embeds}")
     content = message.content
     trigger_id = match_trigger_id(content)
@@ -99,13 +128,18 @@ async def on_message(message: Message):
 
     if content.find("Waiting to start") != -1:
         trigger_status = TriggerStatus.start.value
-        set_temp(trigger_id)
     elif content.find("(Stopped)") != -1:
         trigger_status = TriggerStatus.error.value
-        pop_temp(trigger_id)
     else:
         trigger_status = TriggerStatus.end.value
-        pop_temp(trigger_id)
+
+    if is_duplicate(trigger_id, trigger_status, message):
+        return
+
+    if trigger_status == TriggerStatus.start.value:
+        set_temp(trigger_id)
+    else:
+        pop_temp(trigger_id, message.id)
 
     await callback_trigger(trigger_id, trigger_status, message)
 
@@ -124,15 +158,17 @@ async def on_message_edit(_: Message, after: Message):
         embed = embed.to_dict()
         logger.debug(f"on_message_edit embeds: {embed}")
         trigger_status = TriggerStatus.text.value
+        if is_duplicate(match_describe_trigger_id(embed), trigger_status, after):
+            return
         trigger_id = await callback_describe(trigger_status, after, embed)
-        pop_temp(trigger_id)
+        pop_temp(trigger_id, after.id)
         return
 
     trigger_id = match_trigger_id(after.content)
     if not trigger_id:
         return
 
-    if after.webhook_id != "":
+    if after.webhook_id != "" and not is_duplicate(trigger_id, TriggerStatus.generating.value, after):
         await callback_trigger(trigger_id, TriggerStatus.generating.value, after)
 
 
@@ -148,8 +184,11 @@ async def on_message_delete(message: Message):
     if get_temp(trigger_id) is None:
         return
 
+    trigger_status = TriggerStatus.banned.value
+    if is_duplicate(trigger_id, trigger_status, message):
+        return
+
     logger.debug(f"on_message_delete: {message.content}")
     logger.warning(f"sensitive content: {message.content}")
-    trigger_status = TriggerStatus.banned.value
-    pop_temp(trigger_id)
+    pop_temp(trigger_id, message.id)
     await callback_trigger(trigger_id, trigger_status, message)
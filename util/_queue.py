@@ -198,7 +198,10 @@ class TaskQueue:
         try:
             # 动态导入避免循环导入
             from lib.db_operations import db_ops
+            from lib.webhook import webhook
+            task = await db_ops.get_task_by_trigger_id_status(trigger_id, "SUBMITTED")
             await db_ops.update_task_status(trigger_id, "TIMEOUT")
+            webhook.notify(task, "TIMEOUT")
             logger.info(f"📝 任务超时状态已更新至数据库: {trigger_id}")
         except Exception as e:
             logger.error(f"❌ 更新任务超时状态失败: {trigger_id} - {e}")
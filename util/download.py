@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+import re
+from os import getenv
+from typing import Dict, Optional
+
+import aiofiles
+import aiohttp
+from loguru import logger
+
+from exceptions import DownloadError
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+# 链接过期或不存在，重试无意义
+FATAL_STATUS = {401, 403, 404, 410}
+
+
+class Downloader:
+    """
+    断点续传下载器
+
+    - 失败后以 Range 请求从已下载的位置继续
+    - 按回调报文中的附件 size 校验文件完整性
+    - 指数退避重试
+    - 共享连接池，按 host 限制并发连接数
+    """
+
+    def __init__(
+        self,
+        limit_per_host: int = 4,
+        max_retry: int = 5,
+        backoff: float = 1.0,
+        backoff_max: float = 30.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 30.0,
+        chunk_size: int = 64 * 1024,
+    ):
+        self.limit_per_host = limit_per_host
+        self.max_retry = max_retry
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.chunk_size = chunk_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats: Dict[str, int] = {
+            "downloads": 0,
+            "failures": 0,
+            "retries": 0,
+            "resumes": 0,
+            "bytes": 0,
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host),
+                # 与 requests 保持一致，读取 HTTP(S)_PROXY 环境变量
+                trust_env=True,
+            )
+        return self._session
+
+    def _sleep_time(self, attempt: int) -> float:
+        delay = min(self.backoff * (2 ** attempt), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def download(self, url: str, path: str, expected_size: Optional[int] = None) -> int:
+        """
+        下载文件到 path，返回文件大小
+
+        下载过程中写入 path + ".part"，校验通过后再重命名为 path。
+        """
+        part_path = path + ".part"
+        for attempt in range(self.max_retry + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._sleep_time(attempt - 1))
+            try:
+                size = await self._download_once(url, part_path, expected_size)
+                if size is not None:
+                    os.replace(part_path, path)
+                    self.stats["downloads"] += 1
+                    return size
+            except DownloadError:
+                self.stats["failures"] += 1
+                _remove(part_path)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"⚠️ 下载中断（{e.__class__.__name__}），第 {attempt + 1} 次: {url}")
+
+        self.stats["failures"] += 1
+        _remove(part_path)
+        raise DownloadError(f"超出最大重试次数: {url}")
+
+    async def _download_once(self, url: str, part_path: str, expected_size: Optional[int]) -> Optional[int]:
+        """单次下载，完成返回文件大小，需要重试时返回 None"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size and offset > expected_size:
+            _remove(part_path)
+            offset = 0
+        if expected_size and offset == expected_size:
+            return offset
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        async with self._get_session().get(url, headers=headers) as resp:
+            if resp.status in FATAL_STATUS:
+                raise DownloadError(f"下载失败: HTTP {resp.status} {url}")
+            if resp.status == 416:
+                # 本地残留与远端不一致，从头下载
+                _remove(part_path)
+                return None
+
+            if resp.status == 206:
+                match = CONTENT_RANGE_PATTERN.match(resp.headers.get("Content-Range", ""))
+                if not match or int(match.group(1)) != offset:
+                    _remove(part_path)
+                    return None
+                total = int(match.group(3)) if match.group(3) != "*" else None
+                mode = "ab"
+                self.stats["resumes"] += 1
+                logger.info(f"🔁 断点续传: {url}, 起始位置: {offset}")
+            elif resp.status == 200:
+                total = resp.content_length
+                offset = 0
+                mode = "wb"
+            else:
+                logger.warning(f"⚠️ 下载失败: HTTP {resp.status} {url}")
+                return None
+
+            if expected_size and total and total != expected_size:
+                raise DownloadError(f"文件大小不一致: 期望 {expected_size}, 服务端 {total}, {url}")
+
+            async with aiofiles.open(part_path, mode) as f:
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    await f.write(chunk)
+                    offset += len(chunk)
+                    self.stats["bytes"] += len(chunk)
+
+        want = expected_size or total
+        if want and offset != want:
+            logger.warning(f"⚠️ 下载不完整: {offset}/{want} {url}")
+            if offset > want:
+                _remove(part_path)
+            return None
+        return offset
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+downloader = Downloader(
+    limit_per_host=int(getenv("DOWNLOAD_LIMIT_PER_HOST") or 4),
+    max_retry=int(getenv("DOWNLOAD_MAX_RETRY") or 5),
+    read_timeout=float(getenv("DOWNLOAD_READ_TIMEOUT") or 30),
+)
@@ -0,0 +1,98 @@
+import asyncio
+import ipaddress
+import socket
+from os import getenv
+from typing import Any, Dict, List, Union
+from urllib.parse import urlparse
+
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+def _parse_allowlist(value: str):
+    hosts, networks = set(), []
+    for entry in (item.strip().lower() for item in value.split(",")):
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            hosts.add(entry)
+    return hosts, networks
+
+
+# 允许访问的内网主机名或网段（逗号分隔），例如同机房的回调服务、出站代理
+ALLOWED_HOSTS, ALLOWED_NETWORKS = _parse_allowlist(getenv("SSRF_ALLOWLIST") or "")
+
+
+class UnsafeAddressError(OSError):
+    """目标地址指向回环、内网、链路本地或保留地址"""
+
+
+def is_public_address(address: IPAddress) -> bool:
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if any(address in network for network in ALLOWED_NETWORKS):
+        return True
+    return address.is_global and not address.is_multicast
+
+
+def check_literal_host(host: str):
+    """不做 DNS 解析的快速检查：localhost 与非公网 IP 字面量直接拒绝，可在同步代码中调用"""
+    host = (host or "").strip("[]").lower()
+    if not host:
+        raise UnsafeAddressError("missing host")
+    if host in ALLOWED_HOSTS:
+        return
+    if host == "localhost" or host.endswith(".localhost"):
+        raise UnsafeAddressError(f"{host} is not a public address")
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return
+    if not is_public_address(address):
+        raise UnsafeAddressError(f"{host} is not a public address")
+
+
+async def check_public_url(url: str):
+    """解析 URL 的主机名，任一解析结果不是公网地址时抛出 UnsafeAddressError"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    check_literal_host(host)
+    if host in ALLOWED_HOSTS:
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, parsed.port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except socket.gaierror as e:
+        raise UnsafeAddressError(f"cannot resolve {host}: {e}")
+    for *_, sockaddr in infos:
+        if not is_public_address(ipaddress.ip_address(sockaddr[0])):
+            raise UnsafeAddressError(f"{host} resolves to non-public address {sockaddr[0]}")
+
+
+class PublicResolver(AbstractResolver):
+    """
+    只返回公网地址的 aiohttp 解析器
+
+    连接时再次校验解析结果，防止检查后 DNS 记录被改为内网地址（DNS rebinding）以及重定向到内网主机。
+    IP 字面量不经过解析器，需先调用 check_public_url。
+    """
+
+    def __init__(self) -> None:
+        self._resolver = DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        hosts = await self._resolver.resolve(host, port, family)
+        if host.lower() in ALLOWED_HOSTS:
+            return hosts
+        for item in hosts:
+            if not is_public_address(ipaddress.ip_address(item["host"])):
+                raise UnsafeAddressError(f"{host} resolves to non-public address {item['host']}")
+        return hosts
+
+    async def close(self) -> None:
+        await self._resolver.close()